@@ -5,6 +5,12 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Serve the central server through this module (e.g. ``uvicorn
+central_server.asgi:application``) so long-polling clients of
+``/productivity/token/watch`` wait on the event loop instead of each
+holding a worker thread. The device endpoints (token, register, unregister)
+are served by the native async views here (settings.PRODUCTIVITY_ASYNC_VIEWS).
 """
 
 import os
@@ -12,5 +18,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'central_server.settings')
+os.environ.setdefault('PRODUCTIVITY_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,6 +83,36 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Backs the device credential cache (productivity.cache). Point this at a
+# shared backend (Redis/Memcached) when running several worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'productivity',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+# LAN sync relay (productivity.relay). Devices opt in with SYNC_URL in their
+# app.config; run `manage.py relay_forward` to push stored payloads upstream.
+
+PRODUCTIVITY_RELAY = {
+    'ENABLED': False,
+    'UPSTREAM_SYNC_URL': 'https://api.jackdesk.com/productivity/sync',
+    'UPSTREAM_BATCH_URL': None,
+}
+
+# Serve /productivity/token, /register and /unregister with the native async
+# views (productivity.async_views) instead of the DRF ones. central_server.asgi
+# switches this on; under WSGI every async request would pay for its own event
+# loop, so the DRF views stay the default there.
+
+PRODUCTIVITY_ASYNC_VIEWS = os.environ.get('PRODUCTIVITY_ASYNC_VIEWS', '') == '1'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,84 @@
+# async_views.py
+"""Native async fast path for the hot device endpoints.
+
+Same contract as the DRF views in views.py, minus DRF's negotiation and
+parser machinery: bodies are read with json.loads and answered with a plain
+JsonResponse. Always mounted under /productivity/async/; under
+central_server.asgi they also serve the main /productivity/token, /register
+and /unregister routes (settings.PRODUCTIVITY_ASYNC_VIEWS).
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+
+from .cache import device_cache
+from .changes import device_etag, etag_matches
+from .presence import device_presence
+from .services import register_device_login, unregister_device_login
+from .throttle import poll_governed
+
+# The ORM has no async transactions yet, so the transactional writes run in
+# the thread pool; token lookups stay on the event loop.
+_register = sync_to_async(register_device_login)
+_unregister = sync_to_async(unregister_device_login)
+
+
+def _device_fields(request):
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    fields = (data.get("email"), data.get("token"), data.get("hostname"))
+    return fields if all(fields) else None
+
+
+@require_GET
+@poll_governed
+async def get_device_credentials(request):
+    hostname = request.GET.get("hostname")
+    if not hostname:
+        return JsonResponse({"error": "Missing hostname."}, status=400)
+    device = await device_cache.aget(hostname)
+    if device is None:
+        return JsonResponse({"error": "Device not registered."}, status=404)
+    if device_presence.seen(hostname):
+        await sync_to_async(device_presence.flush_safely)()
+    etag = device_etag(device)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return HttpResponseNotModified(headers={"ETag": etag})
+    return JsonResponse({"email": device.email, "token": device.token}, headers={"ETag": etag})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def register_device(request):
+    fields = _device_fields(request)
+    if fields is None:
+        return JsonResponse({"error": "Missing required fields."}, status=400)
+    email, token, hostname = fields
+    device, created, _ = await _register(email, token, hostname)
+    return JsonResponse({
+        "status": "registered",
+        "created": created,
+        "device": {
+            "hostname": device.hostname,
+            "email": device.email,
+            "token": device.token
+        }
+    })
+
+
+@csrf_exempt
+@require_http_methods(["DELETE"])
+async def unregister_device(request):
+    fields = _device_fields(request)
+    if fields is None:
+        return JsonResponse({"error": "Missing required fields."}, status=400)
+    email, _, hostname = fields
+    await _unregister(email, hostname)
+    return JsonResponse({"status": "unregistered"})
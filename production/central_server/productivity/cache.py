@@ -0,0 +1,199 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import cache as shared_cache
+
+from .models import DeviceLogin
+
+# Small per-process LRU in front of Django's cache framework. The local TTL is
+# kept short because other worker processes cannot invalidate it; the shared
+# cache is invalidated explicitly on register/unregister.
+LOCAL_MAX_ENTRIES = 4096
+LOCAL_TTL = 5
+SHARED_TTL = 300
+SHARED_KEY_PREFIX = "productivity:device:"
+# Bumped by every invalidation; a refill is only written back when the
+# generation did not move while the row was being loaded, so a reader that
+# loaded a row just before a commit cannot put the old token back.
+GENERATION_KEY_PREFIX = "productivity:device-gen:"
+_ABSENT = "absent"
+
+CachedDevice = namedtuple("CachedDevice", ["hostname", "email", "token", "updated_at"])
+
+
+class DeviceCredentialCache:
+    """Read-through cache for DeviceLogin lookups by hostname."""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES, local_ttl=LOCAL_TTL, shared_ttl=SHARED_TTL):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.shared_ttl = shared_ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def _shared_key(hostname):
+        return SHARED_KEY_PREFIX + hostname
+
+    @staticmethod
+    def _generation_key(hostname):
+        return GENERATION_KEY_PREFIX + hostname
+
+    def _generations(self, hostnames):
+        values = shared_cache.get_many([self._generation_key(h) for h in hostnames])
+        return {h: values.get(self._generation_key(h), 0) for h in hostnames}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _get_local(self, hostname):
+        with self._lock:
+            entry = self._local.get(hostname)
+            if entry is None:
+                return False, None
+            expires_at, device = entry
+            if expires_at < time.monotonic():
+                del self._local[hostname]
+                return False, None
+            self._local.move_to_end(hostname)
+            self._stats["local_hits"] += 1
+            return True, device
+
+    def _set_local(self, hostname, device):
+        with self._lock:
+            self._local[hostname] = (time.monotonic() + self.local_ttl, device)
+            self._local.move_to_end(hostname)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, hostname):
+        """Return a CachedDevice for ``hostname`` or None when it is not registered."""
+        found, device = self._get_local(hostname)
+        if found:
+            return device
+        shared = shared_cache.get(self._shared_key(hostname))
+        if shared is not None:
+            self._count("shared_hits")
+            device = None if shared == _ABSENT else CachedDevice(*shared)
+        else:
+            self._count("misses")
+            generation = shared_cache.get(self._generation_key(hostname), 0)
+            device = self.load(hostname)
+            if shared_cache.get(self._generation_key(hostname), 0) != generation:
+                # Invalidated while loading: serve what was read, but do not cache it
+                return device
+            shared_cache.set(self._shared_key(hostname), tuple(device) if device else _ABSENT, self.shared_ttl)
+        self._set_local(hostname, device)
+        return device
+
+    async def aget(self, hostname):
+        """Async twin of get(): local hits never leave the event loop, misses use the async ORM."""
+        found, device = self._get_local(hostname)
+        if found:
+            return device
+        shared = await shared_cache.aget(self._shared_key(hostname))
+        if shared is not None:
+            self._count("shared_hits")
+            device = None if shared == _ABSENT else CachedDevice(*shared)
+        else:
+            self._count("misses")
+            generation = await shared_cache.aget(self._generation_key(hostname), 0)
+            row = await (
+                DeviceLogin.objects.filter(hostname=hostname)
+                .values_list("hostname", "email", "token", "updated_at")
+                .afirst()
+            )
+            device = CachedDevice(*row) if row else None
+            if await shared_cache.aget(self._generation_key(hostname), 0) != generation:
+                return device
+            await shared_cache.aset(self._shared_key(hostname), tuple(device) if device else _ABSENT, self.shared_ttl)
+        self._set_local(hostname, device)
+        return device
+
+    def get_many(self, hostnames):
+        """Resolve many hostnames; every cache miss is loaded with one ``hostname__in`` query.
+
+        Returns a dict hostname -> CachedDevice or None.
+        """
+        resolved = {}
+        pending = []
+        for hostname in dict.fromkeys(hostnames):
+            found, device = self._get_local(hostname)
+            if found:
+                resolved[hostname] = device
+            else:
+                pending.append(hostname)
+        if pending:
+            shared = shared_cache.get_many([self._shared_key(h) for h in pending])
+            misses = []
+            for hostname in pending:
+                value = shared.get(self._shared_key(hostname))
+                if value is None:
+                    misses.append(hostname)
+                else:
+                    resolved[hostname] = None if value == _ABSENT else CachedDevice(*value)
+                    self._set_local(hostname, resolved[hostname])
+            self._count("shared_hits", len(pending) - len(misses))
+            if misses:
+                self._count("misses", len(misses))
+                generations = self._generations(misses)
+                loaded = {
+                    row[0]: CachedDevice(*row)
+                    for row in DeviceLogin.objects.filter(hostname__in=misses)
+                    .values_list("hostname", "email", "token", "updated_at")
+                }
+                current = self._generations(misses)
+                unchanged = [h for h in misses if current[h] == generations[h]]
+                shared_cache.set_many(
+                    {self._shared_key(h): tuple(loaded[h]) if h in loaded else _ABSENT for h in unchanged},
+                    self.shared_ttl,
+                )
+                for hostname in misses:
+                    resolved[hostname] = loaded.get(hostname)
+                for hostname in unchanged:
+                    self._set_local(hostname, resolved[hostname])
+        return resolved
+
+    @staticmethod
+    def load(hostname):
+        row = (
+            DeviceLogin.objects.filter(hostname=hostname)
+            .values_list("hostname", "email", "token", "updated_at")
+            .first()
+        )
+        return CachedDevice(*row) if row else None
+
+    def invalidate(self, *hostnames):
+        with self._lock:
+            for hostname in hostnames:
+                self._local.pop(hostname, None)
+            self._stats["invalidations"] += len(hostnames)
+        for hostname in hostnames:
+            key = self._generation_key(hostname)
+            if not shared_cache.add(key, 1, timeout=None):
+                try:
+                    shared_cache.incr(key)
+                except ValueError:
+                    # Expired between add() and incr()
+                    shared_cache.add(key, 1, timeout=None)
+        shared_cache.delete_many([self._shared_key(h) for h in hostnames])
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, local_entries=len(self._local))
+        lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else None
+        return stats
+
+
+device_cache = DeviceCredentialCache()
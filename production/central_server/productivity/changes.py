@@ -0,0 +1,74 @@
+# changes.py
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.utils.http import parse_etags
+
+
+def device_version(device):
+    """Opaque fingerprint of a hostname's current credentials ("absent" when unregistered)."""
+    if device is None:
+        return "absent"
+    raw = f"{device.hostname}|{device.email}|{device.token}|{device.updated_at.isoformat()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def device_etag(device):
+    return f'"{device_version(device)}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header value covers ``etag``."""
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in (e.removeprefix("W/") for e in etags)
+
+
+class DeviceChangeHub:
+    """Wakes long-poll waiters when a hostname's DeviceLogin row changes.
+
+    Register/unregister run in worker threads while waiters live on the ASGI
+    event loop, so wake-ups are handed over with call_soon_threadsafe. The hub
+    is per process; waiters also re-check the database periodically so changes
+    made by another worker process are still seen.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def notify(self, *hostnames):
+        with self._lock:
+            waiters = [w for hostname in hostnames for w in self._waiters.get(hostname, ())]
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    @contextmanager
+    def listen(self, hostname):
+        """Yield an asyncio.Event that is set whenever ``hostname`` changes.
+
+        Subscribe before reading the row so a change committed in between is
+        not missed; clear the event before each re-read.
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(hostname, set()).add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(hostname)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[hostname]
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(w) for w in self._waiters.values())
+
+
+device_changes = DeviceChangeHub()
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from productivity.cache import device_cache
+from productivity.models import DeviceLogin
+from productivity.throttle import poll_governor
+
+ROUTES = {
+    "drf": {"token": "/productivity/token", "register": "/productivity/register",
+            "unregister": "/productivity/unregister"},
+    "async": {"token": "/productivity/async/token", "register": "/productivity/async/register",
+              "unregister": "/productivity/async/unregister"},
+}
+
+
+def _summary(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (f"{name:<22} {len(latencies) / elapsed:>9.0f} req/s   "
+            f"p50 {statistics.median(latencies) * 1000:>7.3f} ms   p99 {p99 * 1000:>7.3f} ms")
+
+
+class Command(BaseCommand):
+    help = ("Compare requests/sec and p99 latency of the DRF views (WSGI handler) with the "
+            "native async views (ASGI handler). Runs in-process against a throwaway test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000, help="Requests per endpoint and stack")
+        parser.add_argument("--devices", type=int, default=500, help="Registered devices to look up")
+        parser.add_argument("--concurrency", type=int, default=16,
+                            help="Concurrent requests on both stacks (a serial run is always reported too)")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        workdir = None
+        if connection.vendor == "sqlite":
+            # The default in-memory test database fails concurrent writers with "table is
+            # locked". A file database with a busy timeout and IMMEDIATE transactions (so a
+            # read-then-write transaction waits for the lock instead of failing) lets the
+            # worker threads queue.
+            workdir = tempfile.mkdtemp()
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(workdir, "bench.sqlite3")
+            connection.settings_dict["OPTIONS"].update(timeout=30, transaction_mode="IMMEDIATE")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._run(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def _run(self, options):
+        n, devices = options["requests"], options["devices"]
+        DeviceLogin.objects.bulk_create([
+            DeviceLogin(hostname=f"bench-{i}", email=f"bench{i}@example.com", token=f"token-{i}")
+            for i in range(devices)
+        ])
+        self.hostnames = [f"bench-{i % devices}" for i in range(n)]
+        self.stdout.write(f"{n} requests per row, {devices} devices\n")
+        # Every benchmark request comes from the same client address; give the
+        # governor room for all of them so it is still timed but never answers 429
+        capacity = poll_governor.capacity
+        poll_governor.capacity = n
+        try:
+            # Both stacks run at the same concurrency; the serial run shows latency without queueing
+            for concurrency in sorted({1, options["concurrency"]}):
+                self.stdout.write(f"\nconcurrency {concurrency}")
+                self._run_drf(n, concurrency)
+                self._run_async(n, concurrency)
+        finally:
+            poll_governor.capacity = capacity
+
+    def _requests(self, client, routes):
+        hostnames = self.hostnames
+        return [
+            ("token", lambda i: client.get(routes["token"], {"hostname": hostnames[i]})),
+            ("register", lambda i: client.post(
+                routes["register"], {"email": f"reg{i}@example.com", "token": "t", "hostname": f"reg-{i % 200}"},
+                content_type="application/json")),
+            ("unregister", lambda i: client.delete(
+                routes["unregister"], {"email": f"reg{i}@example.com", "token": "t", "hostname": f"reg-{i % 200}"},
+                content_type="application/json")),
+        ]
+
+    def _run_drf(self, n, concurrency):
+        # The test Client keeps per-instance state, so every worker thread gets its own
+        local = threading.local()
+
+        class ThreadClient:
+            def __getattr__(self, name):
+                if not hasattr(local, "client"):
+                    local.client = Client()
+                return getattr(local.client, name)
+
+        device_cache.clear()
+        poll_governor.clear()
+        for name, call in self._requests(ThreadClient(), ROUTES["drf"]):
+            self.stdout.write(self._sync_bench(f"drf {name}", call, n, concurrency))
+
+    def _run_async(self, n, concurrency):
+        device_cache.clear()
+        poll_governor.clear()
+        for name, call in self._requests(AsyncClient(), ROUTES["async"]):
+            self.stdout.write(asyncio.run(self._async_bench(f"async {name}", call, n, concurrency)))
+
+    @staticmethod
+    def _sync_bench(name, call, n, concurrency):
+        latencies = []
+
+        def one(i):
+            t0 = time.perf_counter()
+            response = call(i)
+            latencies.append(time.perf_counter() - t0)
+            assert response.status_code == 200, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(one, i) for i in range(n)]:
+                future.result()
+        return _summary(name, latencies, time.perf_counter() - started)
+
+    @staticmethod
+    async def _async_bench(name, call, n, concurrency):
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                t0 = time.perf_counter()
+                response = await call(i)
+                latencies.append(time.perf_counter() - t0)
+                assert response.status_code == 200, response.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n)))
+        return _summary(name, latencies, time.perf_counter() - started)
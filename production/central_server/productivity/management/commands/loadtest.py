@@ -0,0 +1,303 @@
+import heapq
+import http.client
+import json
+import random
+import socket
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+# JackWatch asks for credentials at most once per CREDENTIALS_TTL (60s) and
+# re-registers when a user signs in again from the login window.
+DEFAULT_POLL_INTERVAL = 60
+DEFAULT_CHURN = 0.01
+# In watch mode every device holds a /token/watch long-poll like
+# JackWatch.wait_for_credential_change: up to WATCH_TIMEOUT seconds, re-armed
+# no sooner than a second after the previous one started.
+DEFAULT_WATCH_TIMEOUT = 50
+DEFAULT_WATCH_PATH = "/productivity/token/watch"
+WATCH_MIN_CYCLE = 1
+
+
+class Device:
+    __slots__ = ("hostname", "email", "token", "etag", "registered", "version", "changed_at")
+
+    def __init__(self, index, run_id):
+        self.hostname = f"load-{run_id}-{index}"
+        self.email = f"load{index}-{run_id}@example.com"
+        self.token = f"token-{index}"
+        self.etag = None
+        self.registered = False
+        self.version = ""
+        self.changed_at = None
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.lag = []
+        self.wake_delays = []
+        self.watch_timeouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, op, status, latency, lag=None):
+        with self._lock:
+            self.latencies[op].append(latency)
+            self.statuses[op][status] += 1
+            if lag is not None:
+                self.lag.append(lag)
+
+    def record_watch(self, wake_delay):
+        with self._lock:
+            if wake_delay is None:
+                self.watch_timeouts += 1
+            else:
+                self.wake_delays.append(wake_delay)
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        super().connect()
+        # Headers and body go out in separate writes; without this, Nagle plus
+        # delayed ACKs add ~40ms to every POST/DELETE
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class Connection(threading.local):
+    """One keep-alive connection per worker thread, reopened after errors."""
+
+    def __init__(self, host, port, timeout=30):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = _HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.body = response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    self.close()
+                return response
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Simulate N devices against a running central server: token polls at the JackWatch "
+            "interval (--mode poll) or held /token/watch long-polls (--mode watch), plus "
+            "register/unregister churn. Reports throughput, latency percentiles and error rates "
+            "per operation; watch mode also reports how quickly churn wakes the held requests.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the central server")
+        parser.add_argument("--devices", type=int, default=1000)
+        parser.add_argument("--duration", type=float, default=120, help="Seconds to run after setup")
+        parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+        parser.add_argument("--churn", type=float, default=DEFAULT_CHURN,
+                            help="Probability that a poll is replaced by unregister + register")
+        parser.add_argument("--workers", type=int, default=32, help="Concurrent connections")
+        parser.add_argument("--prefix", default="/productivity", help="API prefix, e.g. /productivity/async")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--mode", choices=["poll", "watch"], default="poll",
+                            help="watch: one thread and connection per device holding a long-poll")
+        parser.add_argument("--watch-timeout", type=float, default=DEFAULT_WATCH_TIMEOUT)
+        parser.add_argument("--watch-path", default=DEFAULT_WATCH_PATH)
+
+    def handle(self, *args, **options):
+        parts = urlsplit(options["url"])
+        if parts.scheme != "http" or not parts.hostname:
+            raise CommandError("--url must be an http:// URL")
+        self.prefix = options["prefix"].rstrip("/")
+        self.connection = Connection(parts.hostname, parts.port or 80)
+        self.rng = random.Random(options["seed"])
+        self.churn = options["churn"]
+        self.interval = options["poll_interval"]
+        self.watching = options["mode"] == "watch"
+        self.watch_timeout = options["watch_timeout"]
+        self.watch_path = options["watch_path"]
+        self.address = (parts.hostname, parts.port or 80)
+        self.stats = Stats()
+
+        run_id = format(int(time.time()), "x")
+        devices = [Device(i, run_id) for i in range(options["devices"])]
+        self.stdout.write(f"Registering {len(devices)} devices...")
+        for device in devices:
+            self._register(device, time.monotonic())
+        self.stats = Stats()
+
+        # First polls are spread over one interval, as real devices start at random times
+        started = time.monotonic()
+        schedule = [(started + self.rng.uniform(0, self.interval), i) for i in range(len(devices))]
+        heapq.heapify(schedule)
+        stop = threading.Event()
+        watchers = []
+        if self.watching:
+            watchers = [threading.Thread(target=self._watch_loop, args=(device, stop), daemon=True)
+                        for device in devices]
+            for thread in watchers:
+                thread.start()
+        self._run(schedule, devices, started + options["duration"], options["workers"])
+        elapsed = time.monotonic() - started
+        stop.set()
+        stats, self.stats = self.stats, Stats()
+
+        for device in devices:
+            if device.registered:
+                self._unregister(device, time.monotonic())
+        self._report(stats, elapsed, len(devices))
+
+    def _run(self, schedule, devices, deadline, workers):
+        lock = threading.Condition()
+
+        def worker():
+            while True:
+                with lock:
+                    while True:
+                        if not schedule or schedule[0][0] >= deadline:
+                            return
+                        due, index = schedule[0]
+                        wait = due - time.monotonic()
+                        if wait <= 0:
+                            heapq.heappop(schedule)
+                            break
+                        lock.wait(wait)
+                self._step(devices[index], due)
+                with lock:
+                    heapq.heappush(schedule, (due + self.interval, index))
+                    lock.notify()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _step(self, device, due):
+        if device.registered and self.rng.random() < self.churn:
+            self._unregister(device, due)
+            self._register(device, due)
+        elif device.registered:
+            # Watching devices get their credentials from the long-poll answers
+            if not self.watching:
+                self._poll(device, due)
+        else:
+            self._register(device, due)
+
+    def _watch_loop(self, device, stop):
+        connection = Connection(*self.address, timeout=self.watch_timeout + 30)
+        while not stop.is_set():
+            started = time.monotonic()
+            query = urlencode({"hostname": device.hostname, "version": device.version,
+                               "timeout": self.watch_timeout})
+            try:
+                response = connection.request("GET", f"{self.watch_path}?{query}")
+                status = response.status
+            except (http.client.HTTPException, OSError) as e:
+                response, status = None, type(e).__name__
+            self.stats.record("watch", status, time.monotonic() - started)
+            wait = WATCH_MIN_CYCLE - (time.monotonic() - started)
+            if response is not None and response.status in (200, 404):
+                body = json.loads(response.body)
+                device.version = body.get("version", device.version)
+                if body.get("changed"):
+                    if device.changed_at is not None:
+                        self.stats.record_watch(time.monotonic() - device.changed_at)
+                        device.changed_at = None
+                else:
+                    self.stats.record_watch(None)
+            elif response is not None and response.status == 429:
+                wait = max(wait, float(response.getheader("Retry-After") or 1))
+            else:
+                wait = max(wait, 1)
+            stop.wait(max(wait, 0))
+        connection.close()
+
+    def _timed(self, op, due, method, path, body=None, headers=None):
+        started = time.monotonic()
+        try:
+            response = self.connection.request(method, self.prefix + path, body, headers)
+            status = response.status
+        except (http.client.HTTPException, OSError) as e:
+            response, status = None, type(e).__name__
+        self.stats.record(op, status, time.monotonic() - started, max(started - due, 0))
+        return response
+
+    def _poll(self, device, due):
+        headers = {"If-None-Match": device.etag} if device.etag else None
+        response = self._timed("token", due, "GET", "/token?" + urlencode({"hostname": device.hostname}),
+                               headers=headers)
+        if response is not None and response.status == 200:
+            device.etag = response.getheader("ETag")
+
+    def _register(self, device, due):
+        body = {"email": device.email, "token": device.token, "hostname": device.hostname}
+        response = self._timed("register", due, "POST", "/register", body)
+        device.registered = response is not None and response.status == 200
+        device.etag = None
+
+    def _unregister(self, device, due):
+        body = {"email": device.email, "token": device.token, "hostname": device.hostname}
+        self._timed("unregister", due, "DELETE", "/unregister", body)
+        device.registered = False
+        # The held watch of this device should return now
+        device.changed_at = time.monotonic()
+
+    def _report(self, stats, elapsed, device_count):
+        mode = f"watch timeout {self.watch_timeout:g}s" if self.watching else f"poll interval {self.interval:g}s"
+        self.stdout.write(f"\n{device_count} devices, {elapsed:.1f}s, {mode}\n")
+        self.stdout.write(f"{'op':<11} {'count':>8} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+                          f"{'p99 ms':>8} {'max ms':>8} {'errors':>7}  statuses")
+        total = errors = 0
+        for op in ("token", "watch", "register", "unregister"):
+            latencies = sorted(stats.latencies.get(op, []))
+            if not latencies:
+                continue
+            statuses = stats.statuses[op]
+            ok = {"token": (200, 304), "watch": (200, 404)}.get(op, (200,))
+            failed = sum(count for status, count in statuses.items() if status not in ok)
+            total += len(latencies)
+            errors += failed
+            self.stdout.write(
+                f"{op:<11} {len(latencies):>8} {len(latencies) / elapsed:>8.1f} "
+                f"{statistics.median(latencies) * 1000:>8.2f} {_percentile(latencies, 0.9) * 1000:>8.2f} "
+                f"{_percentile(latencies, 0.99) * 1000:>8.2f} {latencies[-1] * 1000:>8.2f} "
+                f"{failed / len(latencies):>7.2%}  {dict(statuses)}"
+            )
+        lag = sorted(stats.lag)
+        if lag:
+            # Requests starting late mean the server (or --workers) cannot keep up with the schedule
+            self.stdout.write(f"\nschedule lag  p50 {statistics.median(lag) * 1000:.1f} ms   "
+                              f"p99 {_percentile(lag, 0.99) * 1000:.1f} ms")
+        if self.watching:
+            # Held watches that return well after the change mean wake-ups are not reaching them
+            wakes = sorted(stats.wake_delays)
+            line = f"watch  {stats.watch_timeouts} timed out, {len(wakes)} woken by churn"
+            if wakes:
+                line += (f", wake delay p50 {statistics.median(wakes) * 1000:.1f} ms   "
+                         f"p99 {_percentile(wakes, 0.99) * 1000:.1f} ms")
+            self.stdout.write(line)
+        if total:
+            self.stdout.write(f"total {total} requests, {total / elapsed:.1f} req/s, error rate {errors / total:.2%}")
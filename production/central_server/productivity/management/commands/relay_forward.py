@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from productivity.relay import UpstreamClient, forward_pending, prune_forwarded
+
+DEFAULT_INTERVAL = 30
+
+
+class Command(BaseCommand):
+    help = ("Forward payloads accepted by the LAN relay to the upstream sync API, merged per user "
+            "and gzip-compressed over one keep-alive connection.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between passes")
+        parser.add_argument("--once", action="store_true", help="Run one pass and exit")
+        parser.add_argument("--upstream", default=None, help="Override PRODUCTIVITY_RELAY['UPSTREAM_SYNC_URL']")
+        parser.add_argument("--upstream-batch", default=None,
+                            help="Override PRODUCTIVITY_RELAY['UPSTREAM_BATCH_URL'] (multi-user endpoint)")
+
+    def handle(self, *args, **options):
+        client = UpstreamClient(sync_url=options["upstream"], batch_url=options["upstream_batch"])
+        try:
+            while True:
+                forwarded = failed = 0
+                while True:
+                    # Keep draining a backlog instead of waiting a full interval per pass
+                    done, errors = forward_pending(client)
+                    forwarded += done
+                    failed += errors
+                    if not done or errors:
+                        break
+                pruned = prune_forwarded()
+                if forwarded or failed or pruned:
+                    self.stdout.write(f"[relay] forwarded {forwarded}, failed {failed}, pruned {pruned}")
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            client.close()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from productivity.upstream_stub import UpstreamStub
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the upstream sync API and report what it received on exit."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8100)
+
+    def handle(self, *args, **options):
+        stub = UpstreamStub(port=options["port"])
+        self.stdout.write(f"Upstream stub listening on {stub.url}")
+        try:
+            stub.server.serve_forever(poll_interval=0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write(f"{stub.requests} requests, {len(stub.received)} payloads received")
+            stub.server.server_close()
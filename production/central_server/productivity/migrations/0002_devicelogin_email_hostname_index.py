@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productivity', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='devicelogin',
+            index=models.Index(fields=['email', 'hostname'], name='devicelogin_email_host_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productivity', '0002_devicelogin_email_hostname_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelayBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('hostname', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254)),
+                ('token', models.TextField()),
+                ('payload', models.TextField()),
+                ('event_count', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status', models.IntegerField(blank=True, null=True)),
+                ('forwarded_at', models.DateTimeField(blank=True, null=True)),
+                ('dead', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['forwarded_at', 'dead', 'id'], name='relaybatch_pending_idx')],
+            },
+        ),
+    ]
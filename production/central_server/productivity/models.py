@@ -5,6 +5,39 @@ class DeviceLogin(models.Model):
     email = models.EmailField()
     token = models.TextField()
     updated_at = models.DateTimeField(auto_now=True)
+    # Written in batches by productivity.presence, never through save()
+    last_seen_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # register_device filters by email alone and unregister_device by
+            # (email, hostname); the leading column serves the former too.
+            models.Index(fields=["email", "hostname"], name="devicelogin_email_host_idx"),
+        ]
 
     def __str__(self):
         return f"{self.hostname} -> {self.email}"
+
+
+class RelayBatch(models.Model):
+    """A device sync payload accepted by the LAN relay, waiting to be forwarded upstream."""
+    received_at = models.DateTimeField(auto_now_add=True)
+    hostname = models.CharField(max_length=255)
+    email = models.EmailField()
+    token = models.TextField()
+    payload = models.TextField()
+    event_count = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.IntegerField(null=True, blank=True)
+    forwarded_at = models.DateTimeField(null=True, blank=True)
+    dead = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # The forwarder scans pending rows oldest first
+            models.Index(fields=["forwarded_at", "dead", "id"], name="relaybatch_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.hostname} ({self.event_count} events)"
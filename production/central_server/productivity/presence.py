@@ -0,0 +1,119 @@
+# presence.py
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DeviceLogin
+
+# Sightings are kept in memory and written at most this often; a token poll
+# costs no write of its own.
+FLUSH_INTERVAL = 30
+# last_seen_at is stored at this granularity so one flush needs only a few
+# distinct UPDATEs (one per second-bucket and chunk of hostnames).
+RESOLUTION_SECONDS = 10
+FLUSH_CHUNK = 500
+
+
+def _bucket(moment):
+    epoch = int(moment.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % RESOLUTION_SECONDS, tz=dt_timezone.utc)
+
+
+class PresenceTracker:
+    """Write-coalescing last-seen tracker for DeviceLogin rows."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._flushed_at = time.monotonic()
+        self._stats = {"seen": 0, "flushes": 0, "failed_flushes": 0, "rows_written": 0}
+
+    def seen(self, hostname, when=None):
+        """Record a sighting; returns True when the caller should run flush()."""
+        when = _bucket(when or timezone.now())
+        with self._lock:
+            if self._pending.get(hostname, when) <= when:
+                self._pending[hostname] = when
+            self._stats["seen"] += 1
+            due = not self._flushing and time.monotonic() - self._flushed_at >= self.flush_interval
+            if due:
+                self._flushing = True
+            return due
+
+    def flush(self):
+        """Write pending sightings with one UPDATE per (timestamp, chunk); returns rows updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushing = True
+        written = 0
+        try:
+            by_moment = {}
+            for hostname, moment in pending.items():
+                by_moment.setdefault(moment, []).append(hostname)
+            for moment, hostnames in by_moment.items():
+                for start in range(0, len(hostnames), FLUSH_CHUNK):
+                    # Never move last_seen_at backwards (another process may have written a later one)
+                    written += DeviceLogin.objects.filter(
+                        Q(last_seen_at__isnull=True) | Q(last_seen_at__lt=moment),
+                        hostname__in=hostnames[start:start + FLUSH_CHUNK],
+                    ).update(last_seen_at=moment)
+        except Exception:
+            # Put the sightings back so the next flush retries them
+            with self._lock:
+                for hostname, moment in pending.items():
+                    if self._pending.get(hostname, moment) <= moment:
+                        self._pending[hostname] = moment
+            raise
+        finally:
+            with self._lock:
+                self._flushing = False
+                self._flushed_at = time.monotonic()
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += written
+        return written
+
+    def flush_safely(self):
+        """flush() for request paths: a failed write is logged and left pending, never raised.
+
+        Presence is best effort; a locked or slow database must not turn a
+        credential answer into a 500.
+        """
+        try:
+            return self.flush()
+        except Exception as e:
+            with self._lock:
+                self._stats["failed_flushes"] += 1
+            print(f"[presence] Flush failed, {self.pending_count()} sightings kept for the next one: {e}")
+            return 0
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "pending": len(self._pending)}
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._flushing = False
+            self._flushed_at = time.monotonic()
+            self._stats = {"seen": 0, "flushes": 0, "failed_flushes": 0, "rows_written": 0}
+
+
+def online_devices(within, limit):
+    """Devices seen in the last ``within`` seconds, newest first (served by the last_seen_at index)."""
+    since = timezone.now() - timedelta(seconds=within)
+    return (DeviceLogin.objects.filter(last_seen_at__gte=since)
+            .order_by("-last_seen_at")
+            .values("hostname", "email", "last_seen_at")[:limit])
+
+
+device_presence = PresenceTracker()
@@ -0,0 +1,274 @@
+# relay.py
+import gzip
+import http.client
+import json
+import random
+import zlib
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RelayBatch
+
+# Defaults for settings.PRODUCTIVITY_RELAY
+DEFAULTS = {
+    "ENABLED": False,
+    "UPSTREAM_SYNC_URL": "https://api.jackdesk.com/productivity/sync",
+    # Optional multi-user endpoint taking {"batches": [{"authorization", "payload"}, ...]}
+    # and answering {"results": [status, ...]}; when unset each user is posted separately.
+    "UPSTREAM_BATCH_URL": None,
+    "TIMEOUT": 60,
+}
+
+MAX_BODY_BYTES = 4 * 1024 * 1024        # decompressed size of one device upload
+MAX_UPSTREAM_EVENTS = 10000             # per merged upstream payload
+MAX_UPSTREAM_BYTES = 4 * 1024 * 1024    # uncompressed JSON size of one upstream request
+FORWARD_BATCH_ROWS = 2000               # pending rows read per forwarding pass
+BACKOFF_BASE = 10
+BACKOFF_CAP = 30 * 60
+MAX_FORWARD_ATTEMPTS = 100
+FORWARDED_RETENTION = timedelta(days=1)
+GZIP_LEVEL = 6
+
+
+class RelayError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def relay_setting(name):
+    return getattr(settings, "PRODUCTIVITY_RELAY", {}).get(name, DEFAULTS[name])
+
+
+def decode_body(body, content_encoding):
+    if (content_encoding or "").lower() == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BODY_BYTES + 1)
+        except zlib.error:
+            raise RelayError("Invalid gzip body.")
+        if len(body) > MAX_BODY_BYTES or decompressor.unconsumed_tail:
+            raise RelayError("Payload too large.", status=413)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise RelayError("Invalid JSON body.")
+    if not isinstance(payload, dict) or not payload.get("email") or not payload.get("system"):
+        raise RelayError("Missing required fields.")
+    return payload
+
+
+def event_lists(payload):
+    return {key: value for key, value in payload.items() if isinstance(value, list)}
+
+
+def accept_payload(payload, token):
+    """Persist one device upload; once this returns the device may drop it."""
+    return RelayBatch.objects.create(
+        hostname=payload["system"],
+        email=payload["email"],
+        token=token,
+        payload=json.dumps(payload, separators=(",", ":")),
+        event_count=sum(len(events) for events in event_lists(payload).values()),
+    )
+
+
+def _granularity(payload):
+    rollups = payload.get("rollups")
+    return rollups.get("granularity") if isinstance(rollups, dict) else None
+
+
+def _fits(merged, event_count, size, payload):
+    if merged["events"] + event_count > MAX_UPSTREAM_EVENTS or merged["size"] + size > MAX_UPSTREAM_BYTES:
+        return False
+    # Rollups of different granularity cannot share one section
+    granularities = {_granularity(merged["payload"]), _granularity(payload)} - {None}
+    return len(granularities) <= 1
+
+
+def _merge_rollups(merged, rollups):
+    # Rollup sections of consecutive uploads cover adjacent time ranges
+    if not isinstance(rollups, dict):
+        return
+    current = merged.get("rollups")
+    if not isinstance(current, dict):
+        merged["rollups"] = rollups
+        return
+    current["rows"] = current.get("rows", []) + rollups.get("rows", [])
+    current["end"] = rollups.get("end", current.get("end"))
+
+
+def merge_payloads(batches):
+    """Group pending rows per (email, token, hostname) and concatenate their event lists.
+
+    Returns ``[(token, payload, [row ids]), ...]`` in arrival order; a group is
+    split when it would exceed the upstream size limits. ``rollups`` sections
+    are concatenated as well.
+    """
+    groups = {}
+    for batch in batches:
+        key = (batch.email, batch.token, batch.hostname)
+        payload = json.loads(batch.payload)
+        size = len(batch.payload)
+        merged = groups.get(key)
+        if merged is not None and not _fits(merged, batch.event_count, size, payload):
+            groups[(key, batch.id)] = groups.pop(key)
+            merged = None
+        if merged is None:
+            groups[key] = {"payload": payload, "ids": [batch.id], "token": batch.token,
+                           "events": batch.event_count, "size": size}
+            continue
+        for name, events in event_lists(payload).items():
+            merged["payload"].setdefault(name, []).extend(events)
+        _merge_rollups(merged["payload"], payload.get("rollups"))
+        merged["ids"].append(batch.id)
+        merged["events"] += batch.event_count
+        merged["size"] += size
+    ordered = sorted(groups.values(), key=lambda merged: merged["ids"][0])
+    return [(merged["token"], merged["payload"], merged["ids"]) for merged in ordered]
+
+
+def encode(document):
+    body = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class UpstreamClient:
+    """Keep-alive connection to the upstream API: one TLS session per forwarding pass, not per device."""
+
+    def __init__(self, sync_url=None, batch_url=None, timeout=None):
+        self.sync_url = sync_url or relay_setting("UPSTREAM_SYNC_URL")
+        self.batch_url = batch_url if batch_url is not None else relay_setting("UPSTREAM_BATCH_URL")
+        self.timeout = timeout or relay_setting("TIMEOUT")
+        self._connections = {}
+
+    def _connection(self, parts):
+        key = (parts.scheme, parts.netloc)
+        conn = self._connections.get(key)
+        if conn is None:
+            factory = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = self._connections[key] = factory(parts.netloc, timeout=self.timeout)
+        return conn
+
+    def post(self, url, body, headers):
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip", **headers}
+        for attempt in (1, 2):
+            conn = self._connection(parts)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # A keep-alive connection closed by the peer; retry once on a fresh one
+                conn.close()
+                self._connections.pop((parts.scheme, parts.netloc), None)
+                if attempt == 2:
+                    raise
+
+    def send(self, groups):
+        """Send merged groups; returns one HTTP status per group."""
+        if self.batch_url:
+            document = {"batches": [{"authorization": f"Bearer {token}", "payload": payload}
+                                    for token, payload, _ in groups]}
+            status, body = self.post(self.batch_url, encode(document), {})
+            if status != 200:
+                return [status] * len(groups)
+            results = json.loads(body).get("results", [])
+            return [int(status) for status in results] + [502] * (len(groups) - len(results))
+        return [self.post(self.sync_url, encode(payload), {"Authorization": f"Bearer {token}"})[0]
+                for token, payload, _ in groups]
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+
+def _split_upstream(groups, key_of):
+    # Keep one multi-user request within the same size bound as a single
+    # payload, and at most one group per device in it: a later group of a
+    # device must not be accepted when an earlier one is rejected
+    chunk, keys, size = [], set(), 0
+    for group in groups:
+        group_size = len(json.dumps(group[1]))
+        if chunk and (size + group_size > MAX_UPSTREAM_BYTES or key_of(group) in keys):
+            yield chunk
+            chunk, keys, size = [], set(), 0
+        chunk.append(group)
+        keys.add(key_of(group))
+        size += group_size
+    if chunk:
+        yield chunk
+
+
+def backoff_delay(attempts):
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def forward_pending(client, limit=FORWARD_BATCH_ROWS):
+    """One forwarding pass. Returns ``(forwarded_rows, failed_rows)``."""
+    now = timezone.now()
+    pending, blocked = [], set()
+    for batch in RelayBatch.objects.filter(forwarded_at__isnull=True, dead=False).order_by("id")[:limit]:
+        key = (batch.email, batch.token, batch.hostname)
+        # A device's data goes upstream in arrival order: rows behind one that
+        # is backing off wait for it
+        if key in blocked or (batch.next_attempt_at and batch.next_attempt_at > now):
+            blocked.add(key)
+            continue
+        pending.append(batch)
+    if not pending:
+        return 0, 0
+    by_id = {batch.id: batch for batch in pending}
+
+    def key_of(group):
+        batch = by_id[group[2][0]]
+        return batch.email, batch.token, batch.hostname
+
+    groups = merge_payloads(pending)
+    forwarded = failed = 0
+    chunks = _split_upstream(groups, key_of) if client.batch_url else ([group] for group in groups)
+    for chunk in chunks:
+        # Once a device's group fails in this pass, its later groups wait for the next one
+        chunk = [group for group in chunk if key_of(group) not in blocked]
+        if not chunk:
+            continue
+        try:
+            statuses = client.send(chunk)
+        except (http.client.HTTPException, OSError) as e:
+            print(f"[relay] Upstream error: {e}")
+            statuses = [None] * len(chunk)
+        done, retry = [], []
+        for group, status in zip(chunk, statuses):
+            ids = group[2]
+            if status == 200:
+                done.extend(ids)
+                continue
+            blocked.add(key_of(group))
+            for batch_id in ids:
+                batch = by_id[batch_id]
+                batch.attempts += 1
+                batch.last_status = status
+                batch.dead = batch.attempts >= MAX_FORWARD_ATTEMPTS
+                batch.next_attempt_at = timezone.now() + backoff_delay(batch.attempts)
+                retry.append(batch)
+        with transaction.atomic():
+            if done:
+                RelayBatch.objects.filter(id__in=done).update(forwarded_at=timezone.now(), last_status=200)
+            if retry:
+                RelayBatch.objects.bulk_update(retry, ["attempts", "last_status", "dead", "next_attempt_at"])
+        forwarded += len(done)
+        failed += len(retry)
+    return forwarded, failed
+
+
+def prune_forwarded(retention=FORWARDED_RETENTION):
+    deleted, _ = RelayBatch.objects.filter(forwarded_at__lt=timezone.now() - retention).delete()
+    return deleted
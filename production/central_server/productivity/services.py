@@ -0,0 +1,129 @@
+# services.py
+from itertools import zip_longest
+
+from django.db import transaction
+from django.db.models import Q
+
+from .cache import device_cache
+from .changes import device_changes
+from .models import DeviceLogin
+
+UPSERT_FIELDS = ["email", "token", "updated_at"]
+
+
+def devices_changed(*hostnames):
+    device_cache.invalidate(*hostnames)
+    device_changes.notify(*hostnames)
+
+
+def register_device_login(email, token, hostname):
+    """Bind ``hostname`` to the user and drop the user's other devices.
+
+    Always a constant number of queries: one read, at most one delete and one
+    upsert. Returns ``(device, created, displaced_hostnames)``.
+    """
+    with transaction.atomic():
+        existing = list(
+            DeviceLogin.objects.filter(Q(email=email) | Q(hostname=hostname))
+            .values_list("pk", "hostname", "email")
+        )
+        created = all(row_hostname != hostname for _, row_hostname, _ in existing)
+        # Remove previous device login by the same user (if any)
+        displaced = [(pk, row_hostname) for pk, row_hostname, row_email in existing
+                     if row_email == email and row_hostname != hostname]
+        if displaced:
+            DeviceLogin.objects.filter(pk__in=[pk for pk, _ in displaced]).delete()
+        device = DeviceLogin(hostname=hostname, email=email, token=token)
+        DeviceLogin.objects.bulk_create(
+            [device], update_conflicts=True, unique_fields=["hostname"], update_fields=UPSERT_FIELDS
+        )
+        displaced_hostnames = [row_hostname for _, row_hostname in displaced]
+        transaction.on_commit(lambda: devices_changed(hostname, *displaced_hostnames))
+    return device, created, displaced_hostnames
+
+
+def unregister_device_login(email, hostname):
+    with transaction.atomic():
+        deleted, _ = DeviceLogin.objects.filter(email=email, hostname=hostname).delete()
+        transaction.on_commit(lambda: devices_changed(hostname))
+    return deleted
+
+
+# Bulk operations for onboarding/offboarding a whole lab in one request
+MAX_BULK_DEVICES = 1000
+# Rows per INSERT and per IN (...) list; stays below SQLite's bound-variable limit
+BULK_BATCH_SIZE = 250
+
+
+def _chunks(items, size=BULK_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_register_device_logins(records):
+    """Register many ``{email, token, hostname}`` records in one transaction.
+
+    Applies the same rule as register_device_login: one device per user and
+    one user per hostname, later records winning. Returns one result per
+    record, in input order.
+    """
+    results = [None] * len(records)
+    winners = {}        # hostname -> record index
+    email_owner = {}    # email -> record index
+    for index, record in enumerate(records):
+        hostname, email = record["hostname"], record["email"]
+        for loser in {winners.get(hostname), email_owner.get(email)} - {None}:
+            results[loser] = {"hostname": records[loser]["hostname"], "status": "superseded", "by": index}
+            winners.pop(records[loser]["hostname"], None)
+            email_owner.pop(records[loser]["email"], None)
+        winners[hostname] = index
+        email_owner[email] = index
+
+    hostnames = set(winners)
+    emails = set(email_owner)
+    with transaction.atomic():
+        existing = []
+        for hostname_chunk, email_chunk in zip_longest(_chunks(hostnames), _chunks(emails), fillvalue=[]):
+            existing += DeviceLogin.objects.filter(
+                Q(email__in=email_chunk) | Q(hostname__in=hostname_chunk)
+            ).values_list("pk", "hostname", "email")
+        existing_hostnames = {row_hostname for _, row_hostname, _ in existing}
+        displaced = {(pk, row_hostname) for pk, row_hostname, row_email in existing
+                     if row_email in emails and row_hostname not in hostnames}
+        for pk_chunk in _chunks(pk for pk, _ in displaced):
+            DeviceLogin.objects.filter(pk__in=pk_chunk).delete()
+        DeviceLogin.objects.bulk_create(
+            [DeviceLogin(hostname=records[i]["hostname"], email=records[i]["email"], token=records[i]["token"])
+             for i in winners.values()],
+            batch_size=BULK_BATCH_SIZE, update_conflicts=True, unique_fields=["hostname"],
+            update_fields=UPSERT_FIELDS,
+        )
+        changed = hostnames | {row_hostname for _, row_hostname in displaced}
+        transaction.on_commit(lambda: devices_changed(*changed))
+
+    for hostname, index in winners.items():
+        results[index] = {"hostname": hostname, "status": "registered", "created": hostname not in existing_hostnames}
+    return results, sorted(row_hostname for _, row_hostname in displaced)
+
+
+def bulk_unregister_device_logins(records):
+    """Remove many ``(email, hostname)`` device logins in one transaction."""
+    wanted = {(record["email"], record["hostname"]) for record in records}
+    with transaction.atomic():
+        matched = {}
+        for hostname_chunk in _chunks({hostname for _, hostname in wanted}):
+            for pk, row_hostname, row_email in DeviceLogin.objects.filter(
+                hostname__in=hostname_chunk
+            ).values_list("pk", "hostname", "email"):
+                if (row_email, row_hostname) in wanted:
+                    matched[(row_email, row_hostname)] = pk
+        for pk_chunk in _chunks(matched.values()):
+            DeviceLogin.objects.filter(pk__in=pk_chunk).delete()
+        removed = [hostname for _, hostname in matched]
+        transaction.on_commit(lambda: devices_changed(*removed))
+    return [
+        {"hostname": record["hostname"],
+         "status": "unregistered" if (record["email"], record["hostname"]) in matched else "not_found"}
+        for record in records
+    ]
@@ -1,3 +1,582 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache as shared_cache
+from django.db import OperationalError
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+
+from central_server import urls as root_urls
+
+from . import async_views, urls, views
+from .cache import device_cache
+from .changes import device_changes, device_version
+from .models import DeviceLogin, RelayBatch
+from .presence import device_presence
+from .relay import UpstreamClient, forward_pending
+from .throttle import BASE_POLL_INTERVAL, PollGovernor, poll_governor
+from .upstream_stub import UpstreamStub
+
+
+class ProductivityTestCase(TestCase):
+    """Starts every test with empty process-wide caches, poll buckets and pending sightings."""
+
+    def setUp(self):
+        device_cache.clear()
+        shared_cache.clear()
+        poll_governor.clear()
+        device_presence.clear()
+
+
+class WatchDeviceCredentialsTests(ProductivityTestCase):
+    url = "/productivity/token/watch"
+
+    async def test_returns_immediately_when_client_version_is_stale(self):
+        device = await DeviceLogin.objects.acreate(hostname="lab-01", email="a@example.com", token="t1")
+        response = await self.async_client.get(self.url, {"hostname": "lab-01", "version": "old"})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body["changed"])
+        self.assertEqual(body["token"], "t1")
+        self.assertEqual(body["version"], device_version(device))
+
+    async def test_times_out_without_change(self):
+        response = await self.async_client.get(
+            self.url, {"hostname": "lab-02", "version": device_version(None), "timeout": "0.1"}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.json()["changed"])
+
+    async def test_wakes_up_on_device_change(self):
+        watch = asyncio.ensure_future(self.async_client.get(
+            self.url, {"hostname": "lab-03", "version": device_version(None), "timeout": "30"}
+        ))
+        await asyncio.sleep(0.2)
+        self.assertFalse(watch.done())
+        await DeviceLogin.objects.acreate(hostname="lab-03", email="b@example.com", token="t2")
+        device_changes.notify("lab-03")
+        response = await asyncio.wait_for(watch, 5)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["changed"])
+        self.assertEqual(response.json()["email"], "b@example.com")
+
+    def test_register_notifies_new_and_replaced_hostnames(self):
+        DeviceLogin.objects.create(hostname="old-pc", email="c@example.com", token="t0")
+        with mock.patch.object(device_changes, "notify") as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/productivity/register",
+                {"email": "c@example.com", "token": "t1", "hostname": "new-pc"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        notify.assert_called_once_with("new-pc", "old-pc")
+
+
+class DeviceCredentialCacheTests(ProductivityTestCase):
+    url = "/productivity/token"
+
+    def register(self, email, token, hostname):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/productivity/register",
+                {"email": email, "token": token, "hostname": hostname},
+                content_type="application/json",
+            )
+
+    def test_steady_state_token_lookups_skip_the_database(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        self.client.get(self.url, {"hostname": "lab-01"})
+        before = device_cache.stats()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"hostname": "lab-01"})
+        after = device_cache.stats()
+        self.assertEqual(response.json(), {"email": "a@example.com", "token": "t1"})
+        # Loaded once; every lookup of the second request is answered from process memory
+        self.assertEqual(after["misses"], 1)
+        self.assertEqual(after["shared_hits"], before["shared_hits"])
+        self.assertGreater(after["local_hits"], before["local_hits"])
+
+    def test_unregistered_hostnames_are_cached_too(self):
+        self.client.get(self.url, {"hostname": "nobody"})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"hostname": "nobody"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_register_and_unregister_invalidate(self):
+        self.register("a@example.com", "t1", "lab-01")
+        self.assertEqual(self.client.get(self.url, {"hostname": "lab-01"}).json()["token"], "t1")
+        # Same user signs in elsewhere: the old hostname must stop resolving immediately
+        self.register("a@example.com", "t2", "lab-02")
+        self.assertEqual(self.client.get(self.url, {"hostname": "lab-01"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"hostname": "lab-02"}).json()["token"], "t2")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(
+                "/productivity/unregister",
+                {"email": "a@example.com", "token": "t2", "hostname": "lab-02"},
+                content_type="application/json",
+            )
+        self.assertEqual(self.client.get(self.url, {"hostname": "lab-02"}).status_code, 404)
+
+
+    def test_refill_racing_an_invalidation_is_not_cached(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        load = device_cache.load
+
+        def load_then_commit_elsewhere(hostname):
+            # The row is read, then another request commits a new token and invalidates
+            device = load(hostname)
+            DeviceLogin.objects.filter(hostname=hostname).update(token="t2")
+            device_cache.invalidate(hostname)
+            return device
+
+        with mock.patch.object(device_cache, "load", side_effect=load_then_commit_elsewhere):
+            self.assertEqual(device_cache.get("lab-01").token, "t1")
+        self.assertIsNone(shared_cache.get("productivity:device:lab-01"))
+        self.assertEqual(device_cache.get("lab-01").token, "t2")
+
+
+class DeviceLoginQueryCountTests(ProductivityTestCase):
+    # Inside TestCase every view transaction is a savepoint: SAVEPOINT + RELEASE
+    # account for two of the counted queries.
+
+    def register(self, email, token, hostname):
+        return self.client.post(
+            "/productivity/register",
+            {"email": email, "token": token, "hostname": hostname},
+            content_type="application/json",
+        )
+
+    def test_register_new_device(self):
+        with self.assertNumQueries(4):  # savepoint, read, upsert, release
+            response = self.register("a@example.com", "t1", "lab-01")
+        self.assertTrue(response.json()["created"])
+
+    def test_register_replacing_other_devices_of_the_user(self):
+        for i in range(5):
+            DeviceLogin.objects.create(hostname=f"old-{i}", email="a@example.com", token="t0")
+        with self.assertNumQueries(5):  # savepoint, read, delete, upsert, release
+            response = self.register("a@example.com", "t1", "lab-01")
+        self.assertTrue(response.json()["created"])
+        self.assertEqual(list(DeviceLogin.objects.values_list("hostname", flat=True)), ["lab-01"])
+
+    def test_register_existing_hostname_updates_in_place(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="b@example.com", token="t0")
+        with self.assertNumQueries(4):
+            response = self.register("a@example.com", "t1", "lab-01")
+        self.assertFalse(response.json()["created"])
+        device = DeviceLogin.objects.get(hostname="lab-01")
+        self.assertEqual((device.email, device.token), ("a@example.com", "t1"))
+
+    def test_unregister(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        with self.assertNumQueries(3):  # savepoint, delete, release
+            self.client.delete(
+                "/productivity/unregister",
+                {"email": "a@example.com", "token": "t1", "hostname": "lab-01"},
+                content_type="application/json",
+            )
+        self.assertFalse(DeviceLogin.objects.exists())
+
+    def test_token_lookup(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        with self.assertNumQueries(1):
+            self.client.get("/productivity/token", {"hostname": "lab-01"})
+
+
+class BulkDeviceRegistrationTests(ProductivityTestCase):
+
+    def test_bulk_register_applies_single_device_rule(self):
+        DeviceLogin.objects.create(hostname="old-pc", email="a@example.com", token="t0")
+        DeviceLogin.objects.create(hostname="lab-02", email="x@example.com", token="t0")
+        devices = [
+            {"email": "a@example.com", "token": "t1", "hostname": "lab-01"},
+            {"email": "b@example.com", "token": "t2", "hostname": "lab-02"},
+            {"email": "c@example.com", "hostname": "lab-03"},
+            {"email": "d@example.com", "token": "t4", "hostname": "lab-04"},
+            {"email": "d@example.com", "token": "t5", "hostname": "lab-05"},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/productivity/register/bulk", {"devices": devices},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results],
+                         ["registered", "registered", "error", "superseded", "registered"])
+        self.assertEqual(results[3]["by"], 4)
+        self.assertTrue(results[0]["created"])
+        self.assertFalse(results[1]["created"])
+        self.assertEqual(response.json()["displaced"], ["old-pc"])
+        self.assertEqual(
+            dict(DeviceLogin.objects.values_list("hostname", "email")),
+            {"lab-01": "a@example.com", "lab-02": "b@example.com", "lab-05": "d@example.com"},
+        )
+        self.assertEqual(self.client.get("/productivity/token", {"hostname": "lab-02"}).json()["token"], "t2")
+
+    def test_bulk_unregister_reports_per_record(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        DeviceLogin.objects.create(hostname="lab-02", email="b@example.com", token="t2")
+        devices = [
+            {"email": "a@example.com", "token": "t1", "hostname": "lab-01"},
+            {"email": "wrong@example.com", "token": "t2", "hostname": "lab-02"},
+        ]
+        response = self.client.delete("/productivity/unregister/bulk", {"devices": devices},
+                                      content_type="application/json")
+        self.assertEqual([r["status"] for r in response.json()["results"]], ["unregistered", "not_found"])
+        self.assertEqual(list(DeviceLogin.objects.values_list("hostname", flat=True)), ["lab-02"])
+
+    def test_bulk_limits(self):
+        response = self.client.post("/productivity/register/bulk", {"devices": "nope"},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        with mock.patch("productivity.views.MAX_BULK_DEVICES", 1):
+            response = self.client.post("/productivity/register/bulk", {"devices": [{}, {}]},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 413)
+
+
+class BatchedTokenLookupTests(ProductivityTestCase):
+    url = "/productivity/token/batch"
+
+    def setUp(self):
+        super().setUp()
+        DeviceLogin.objects.bulk_create([
+            DeviceLogin(hostname=f"lab-{i:03d}", email=f"user{i}@example.com", token=f"t{i}") for i in range(150)
+        ])
+
+    def test_resolves_hits_and_misses_with_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {"hostnames": ["lab-001", "lab-002", "ghost"]},
+                                        content_type="application/json")
+        self.assertEqual(response.json(), {
+            "credentials": {
+                "lab-001": {"email": "user1@example.com", "token": "t1"},
+                "lab-002": {"email": "user2@example.com", "token": "t2"},
+            },
+            "missing": ["ghost"],
+        })
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url + "?hostname=lab-001&hostname=ghost")
+        self.assertEqual(response.json()["missing"], ["ghost"])
+
+    def test_large_batches_are_streamed(self):
+        hostnames = [f"lab-{i:03d}" for i in range(150)] + ["ghost"]
+        response = self.client.post(self.url, {"hostnames": hostnames}, content_type="application/json")
+        self.assertTrue(response.streaming)
+        body = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(body["credentials"]), 150)
+        self.assertEqual(body["missing"], ["ghost"])
+
+    def test_streamed_batches_resolve_hostnames_in_chunks(self):
+        hostnames = [f"lab-{i:03d}" for i in range(150)] + ["ghost"]
+        with mock.patch("productivity.views.STREAM_LOOKUP_CHUNK", 50), \
+                mock.patch.object(device_cache, "get_many", wraps=device_cache.get_many) as get_many:
+            response = self.client.post(self.url, {"hostnames": hostnames}, content_type="application/json")
+            # Nothing is looked up before the body is consumed
+            self.assertEqual(get_many.call_count, 0)
+            body = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([len(call.args[0]) for call in get_many.call_args_list], [50, 50, 50, 1])
+        self.assertEqual(len(body["credentials"]), 150)
+        self.assertEqual(body["missing"], ["ghost"])
+
+    def test_batch_size_is_capped(self):
+        with mock.patch("productivity.views.MAX_TOKEN_BATCH", 2):
+            response = self.client.post(self.url, {"hostnames": ["a", "b", "c"]}, content_type="application/json")
+        self.assertEqual(response.status_code, 413)
+
+
+class AsyncDeviceEndpointTests(ProductivityTestCase):
+
+    def test_register_lookup_unregister(self):
+        body = {"email": "a@example.com", "token": "t1", "hostname": "lab-01"}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/productivity/async/register", body, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["created"])
+        response = self.client.get("/productivity/async/token", {"hostname": "lab-01"})
+        self.assertEqual(response.json(), {"email": "a@example.com", "token": "t1"})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete("/productivity/async/unregister", body, content_type="application/json")
+        self.assertEqual(self.client.get("/productivity/async/token", {"hostname": "lab-01"}).status_code, 404)
+
+    async def test_token_lookup_from_async_client(self):
+        await DeviceLogin.objects.acreate(hostname="lab-02", email="b@example.com", token="t2")
+        response = await self.async_client.get("/productivity/async/token", {"hostname": "lab-02"})
+        self.assertEqual(response.json()["token"], "t2")
+
+    def test_missing_fields(self):
+        response = self.client.post("/productivity/async/register", {"email": "a@example.com"},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_main_routes_serve_the_async_views_when_enabled(self):
+        routes = {"/productivity/token": "get_device_credentials", "/productivity/register": "register_device",
+                  "/productivity/unregister": "unregister_device"}
+        def reload_urls():
+            importlib.reload(urls)
+            importlib.reload(root_urls)
+            clear_url_caches()
+
+        try:
+            with self.settings(PRODUCTIVITY_ASYNC_VIEWS=True):
+                reload_urls()
+                for path, name in routes.items():
+                    self.assertIs(resolve(path).func, getattr(async_views, name))
+                DeviceLogin.objects.create(hostname="lab-03", email="c@example.com", token="t3")
+                response = self.client.get("/productivity/token", {"hostname": "lab-03"})
+                self.assertEqual(response.json(), {"email": "c@example.com", "token": "t3"})
+        finally:
+            reload_urls()
+        for path, name in routes.items():
+            self.assertIs(resolve(path).func, getattr(views, name))
+
+
+class ConditionalTokenResponseTests(ProductivityTestCase):
+
+    def test_matching_etag_returns_304_without_body(self):
+        device = DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        for url in ("/productivity/token", "/productivity/async/token"):
+            response = self.client.get(url, {"hostname": "lab-01"})
+            etag = response.headers["ETag"]
+            self.assertEqual(etag, f'"{device_version(device)}"')
+            response = self.client.get(url, {"hostname": "lab-01"}, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response.headers["ETag"], etag)
+
+    def test_changed_credentials_return_a_new_body(self):
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        etag = self.client.get("/productivity/token", {"hostname": "lab-01"}).headers["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/productivity/register", {"email": "a@example.com", "token": "t2", "hostname": "lab-01"},
+                             content_type="application/json")
+        response = self.client.get("/productivity/token", {"hostname": "lab-01"}, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["token"], "t2")
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+
+@override_settings(PRODUCTIVITY_RELAY={"ENABLED": True})
+class RelayTests(ProductivityTestCase):
+    url = "/productivity/relay/sync"
+
+    def setUp(self):
+        super().setUp()
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+        DeviceLogin.objects.create(hostname="lab-02", email="b@example.com", token="t2")
+        self.stub = UpstreamStub().start()
+        self.addCleanup(self.stub.stop)
+
+    def upload(self, hostname, email, token, window_events, afk_events=()):
+        payload = {"email": email, "system": hostname,
+                   "window_events": list(window_events), "afk_events": list(afk_events)}
+        return self.client.generic("POST", self.url, gzip.compress(json.dumps(payload).encode()),
+                                   content_type="application/json",
+                                   headers={"Content-Encoding": "gzip", "Authorization": f"Bearer {token}"})
+
+    def test_accepts_gzip_payload_once_stored(self):
+        response = self.upload("lab-01", "a@example.com", "t1", [{"id": 1}, {"id": 2}], [{"id": 7}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["events"], 3)
+        self.assertEqual(RelayBatch.objects.get().hostname, "lab-01")
+
+    def test_rejects_credentials_upstream_would_reject(self):
+        self.assertEqual(self.upload("lab-01", "a@example.com", "stale", [{"id": 1}]).status_code, 401)
+        self.assertEqual(self.upload("lab-09", "a@example.com", "t1", [{"id": 1}]).status_code, 401)
+        self.assertFalse(RelayBatch.objects.exists())
+
+    @override_settings(PRODUCTIVITY_RELAY={"ENABLED": False})
+    def test_disabled_by_default(self):
+        self.assertEqual(self.upload("lab-01", "a@example.com", "t1", [{"id": 1}]).status_code, 404)
+
+    def test_forwarder_merges_per_user(self):
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 1}], [{"id": 10}])
+        self.upload("lab-02", "b@example.com", "t2", [{"id": 5}])
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 2}])
+        forwarded, failed = forward_pending(UpstreamClient(sync_url=self.stub.url + "/productivity/sync"))
+        self.assertEqual((forwarded, failed), (3, 0))
+        self.assertEqual(self.stub.requests, 2)
+        auth, payload = self.stub.received[0]
+        self.assertEqual(auth, "Bearer t1")
+        self.assertEqual(payload["window_events"], [{"id": 1}, {"id": 2}])
+        self.assertEqual(payload["afk_events"], [{"id": 10}])
+        self.assertFalse(RelayBatch.objects.filter(forwarded_at__isnull=True).exists())
+
+    def test_forwarder_concatenates_rollups(self):
+        for rows in ([["2026-10-18T09:00:00Z", "code", "not-afk", 60.0]],
+                     [["2026-10-18T09:01:00Z", "code", "afk", 30.0]]):
+            payload = {"email": "a@example.com", "system": "lab-01", "window_events": [{"id": 1}], "afk_events": [],
+                       "rollups": {"granularity": "minute", "columns": ["start", "app", "afk", "seconds"], "rows": rows}}
+            self.client.post(self.url, payload, content_type="application/json",
+                             headers={"Authorization": "Bearer t1"})
+        forward_pending(UpstreamClient(sync_url=self.stub.url + "/productivity/sync"))
+        rollups = self.stub.received[0][1]["rollups"]
+        self.assertEqual([row[2] for row in rollups["rows"]], ["not-afk", "afk"])
+
+    def test_forwarder_keeps_additional_watcher_lists(self):
+        for events in ([{"id": 1}], [{"id": 2}]):
+            payload = {"email": "a@example.com", "system": "lab-01", "window_events": [], "afk_events": [],
+                       "web_events": events}
+            self.client.post(self.url, payload, content_type="application/json",
+                             headers={"Authorization": "Bearer t1"})
+        self.assertEqual(RelayBatch.objects.first().event_count, 1)
+        forward_pending(UpstreamClient(sync_url=self.stub.url + "/productivity/sync"))
+        self.assertEqual(self.stub.received[0][1]["web_events"], [{"id": 1}, {"id": 2}])
+
+    def test_multi_user_batch_endpoint(self):
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 1}])
+        self.upload("lab-02", "b@example.com", "t2", [{"id": 5}])
+        client = UpstreamClient(batch_url=self.stub.url + "/productivity/sync/batch")
+        self.assertEqual(forward_pending(client), (2, 0))
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual([auth for auth, _ in self.stub.received], ["Bearer t1", "Bearer t2"])
+
+    def test_failed_forward_backs_off_and_keeps_order(self):
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 1}])
+        client = UpstreamClient(sync_url=self.stub.url + "/productivity/sync")
+        self.stub.fail_with = [503]
+        self.assertEqual(forward_pending(client), (0, 1))
+        batch = RelayBatch.objects.get()
+        self.assertEqual((batch.attempts, batch.last_status), (1, 503))
+        # A newer upload from the same device waits behind the one backing off
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 2}])
+        self.assertEqual(forward_pending(client), (0, 0))
+        RelayBatch.objects.update(next_attempt_at=None)
+        self.assertEqual(forward_pending(client), (2, 0))
+        self.assertEqual(self.stub.received[0][1]["window_events"], [{"id": 1}, {"id": 2}])
+
+
+    def test_failed_group_holds_back_later_groups_of_the_device(self):
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 1}])
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 2}])
+        self.upload("lab-02", "b@example.com", "t2", [{"id": 5}])
+        client = UpstreamClient(sync_url=self.stub.url + "/productivity/sync")
+        self.stub.fail_with = [503]
+        with mock.patch("productivity.relay.MAX_UPSTREAM_EVENTS", 1):
+            self.assertEqual(forward_pending(client), (1, 1))
+        # lab-01's second group was never sent; lab-02 is unaffected
+        self.assertEqual([auth for auth, _ in self.stub.received], ["Bearer t2"])
+        first, second = RelayBatch.objects.filter(hostname="lab-01").order_by("id")
+        self.assertEqual((first.attempts, second.attempts), (1, 0))
+        self.assertIsNone(second.forwarded_at)
+
+    def test_batch_endpoint_sends_one_group_per_device_per_request(self):
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 1}])
+        self.upload("lab-01", "a@example.com", "t1", [{"id": 2}])
+        client = UpstreamClient(batch_url=self.stub.url + "/productivity/sync/batch")
+        self.stub.fail_with = [503]
+        with mock.patch("productivity.relay.MAX_UPSTREAM_EVENTS", 1):
+            self.assertEqual(forward_pending(client), (0, 1))
+        self.assertEqual(self.stub.requests, 1)
+        self.assertFalse(RelayBatch.objects.filter(forwarded_at__isnull=False).exists())
+
+
+class PollGovernorTests(ProductivityTestCase):
+    url = "/productivity/token"
+
+    def setUp(self):
+        super().setUp()
+        DeviceLogin.objects.create(hostname="lab-01", email="a@example.com", token="t1")
+
+    def test_responses_advertise_poll_interval(self):
+        response = self.client.get(self.url, {"hostname": "lab-01"})
+        self.assertEqual(response.headers["X-Poll-Interval"], str(BASE_POLL_INTERVAL))
+        response = self.client.get("/productivity/async/token", {"hostname": "ghost"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("X-Poll-Interval", response.headers)
+
+    def test_burst_beyond_bucket_gets_429_with_retry_after(self):
+        with mock.patch.object(poll_governor, "capacity", 2):
+            statuses = [self.client.get(self.url, {"hostname": "lab-01"}).status_code for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            response = self.client.get(self.url, {"hostname": "lab-01"})
+            self.assertGreaterEqual(int(response.headers["Retry-After"]), 1)
+            # Other registered devices have their own bucket
+            DeviceLogin.objects.create(hostname="lab-02", email="b@example.com", token="t2")
+            self.assertEqual(self.client.get(self.url, {"hostname": "lab-02"}).status_code, 200)
+
+    def test_client_supplied_hostnames_cannot_dodge_or_drain_buckets(self):
+        with mock.patch.object(poll_governor, "capacity", 2):
+            # Made-up hostnames share the caller's address bucket
+            statuses = [self.client.get(self.url, {"hostname": f"fake-{i}"}).status_code for i in range(3)]
+            self.assertEqual(statuses, [404, 404, 429])
+            # Another address naming lab-01 does not touch lab-01's own bucket
+            for _ in range(3):
+                self.client.get(self.url, {"hostname": "lab-01"}, REMOTE_ADDR="10.0.0.9")
+            self.assertEqual(self.client.get(self.url, {"hostname": "lab-01"}).status_code, 200)
+
+    def test_interval_stretches_with_active_fleet(self):
+        governor = PollGovernor()
+        for i in range(10000):
+            governor.acquire(f"host-{i}", now=100.0)
+        with mock.patch("productivity.throttle.TARGET_POLLS_PER_SECOND", 50):
+            self.assertEqual(governor.poll_interval(now=101.0), 200)
+        self.assertEqual(governor.acquire("host-1", now=100.0)[0], True)
+        governor = PollGovernor(capacity=1, refill_per_second=0.1)
+        governor.acquire("a", now=0.0)
+        self.assertEqual(governor.acquire("a", now=1.0), (False, 9))
+
+
+class DevicePresenceTests(ProductivityTestCase):
+    url = "/productivity/token"
+
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            DeviceLogin.objects.create(hostname=f"lab-0{i}", email=f"u{i}@example.com", token="t")
+
+    def test_polls_are_coalesced_into_one_update(self):
+        for hostname in ("lab-00", "lab-01", "lab-00"):
+            self.client.get(self.url, {"hostname": hostname})
+        self.assertFalse(DeviceLogin.objects.filter(last_seen_at__isnull=False).exists())
+        with self.assertNumQueries(1):
+            self.assertEqual(device_presence.flush(), 2)
+        self.assertEqual(
+            set(DeviceLogin.objects.filter(last_seen_at__isnull=False).values_list("hostname", flat=True)),
+            {"lab-00", "lab-01"},
+        )
+
+    def test_flush_is_triggered_by_a_poll_once_due(self):
+        with mock.patch.object(device_presence, "flush_interval", 0):
+            self.client.get("/productivity/async/token", {"hostname": "lab-02"})
+        self.assertIsNotNone(DeviceLogin.objects.get(hostname="lab-02").last_seen_at)
+
+    def test_failed_flush_still_returns_credentials(self):
+        locked = mock.patch.object(QuerySet, "update", side_effect=OperationalError("database is locked"))
+        for url in (self.url, "/productivity/async/token", "/productivity/token/watch"):
+            with self.subTest(url=url), locked, mock.patch.object(device_presence, "flush_interval", 0):
+                response = self.client.get(url, {"hostname": "lab-00", "timeout": 0})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["token"], "t")
+        # The sighting is kept and written by the next successful flush
+        self.assertEqual(device_presence.pending_count(), 1)
+        self.assertEqual(device_presence.flush(), 1)
+
+    def test_last_seen_does_not_change_credential_version(self):
+        device = DeviceLogin.objects.get(hostname="lab-00")
+        etag = self.client.get(self.url, {"hostname": "lab-00"}).headers["ETag"]
+        device_presence.flush()
+        device_cache.clear()
+        shared_cache.clear()
+        response = self.client.get(self.url, {"hostname": "lab-00"}, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(DeviceLogin.objects.get(hostname="lab-00").updated_at, device.updated_at)
+
+    def test_online_devices(self):
+        self.client.get(self.url, {"hostname": "lab-01"})
+        DeviceLogin.objects.filter(hostname="lab-02").update(last_seen_at=timezone.now() - timedelta(hours=1))
+        response = self.client.get("/productivity/devices/online")
+        self.assertEqual([d["hostname"] for d in response.json()["devices"]], ["lab-01"])
+        response = self.client.get("/productivity/devices/online", {"within": 7200})
+        self.assertEqual([d["hostname"] for d in response.json()["devices"]], ["lab-01", "lab-02"])
+
+    def test_online_devices_rejects_non_positive_bounds(self):
+        for params in ({"limit": -5}, {"limit": 0}, {"within": 0}, {"within": -60}, {"within": "nan"}, {"within": "inf"}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get("/productivity/devices/online", params).status_code, 400)
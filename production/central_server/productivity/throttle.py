@@ -0,0 +1,142 @@
+# throttle.py
+import asyncio
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.http import JsonResponse
+
+from .cache import device_cache
+
+# Per-host token bucket on the polled endpoints: a device may burst a few
+# requests (login, re-registration) but is held to one per 10s sustained.
+BUCKET_CAPACITY = 6
+BUCKET_REFILL_PER_SECOND = 1 / 10
+MAX_TRACKED_HOSTS = 50000
+
+# Advertised poll interval (X-Poll-Interval): never below the poller's own
+# default, and stretched so the fleet stays under TARGET_POLLS_PER_SECOND.
+BASE_POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 600
+TARGET_POLLS_PER_SECOND = 50
+# Devices seen within this window count as active
+ACTIVE_WINDOW = MAX_POLL_INTERVAL
+# The interval is recomputed at most this often (it scans the tracked hosts)
+INTERVAL_REFRESH = 5
+
+
+class PollGovernor:
+    """Token bucket per host plus the poll interval advertised to the fleet."""
+
+    def __init__(self, capacity=BUCKET_CAPACITY, refill_per_second=BUCKET_REFILL_PER_SECOND,
+                 max_hosts=MAX_TRACKED_HOSTS):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_hosts = max_hosts
+        self._buckets = OrderedDict()   # host -> (tokens, updated_at, last_seen)
+        self._lock = threading.Lock()
+        self._rejected = 0
+        self._interval = (BASE_POLL_INTERVAL, None)
+
+    def acquire(self, host, now=None):
+        """Take one token for ``host``; returns ``(allowed, retry_after_seconds)``."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated_at, _ = self._buckets.pop(host, (self.capacity, now, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self._rejected += 1
+            # Most recently seen last, so the oldest hosts are evicted first
+            self._buckets[host] = (tokens, now, now)
+            while len(self._buckets) > self.max_hosts:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0
+        return False, max(1, math.ceil((1 - tokens) / self.refill_per_second))
+
+    def active_hosts(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            count = 0
+            for _, _, last_seen in reversed(self._buckets.values()):
+                if now - last_seen > ACTIVE_WINDOW:
+                    break
+                count += 1
+            return count
+
+    def poll_interval(self, now=None):
+        """Seconds between polls that keeps the active fleet under the target rate."""
+        now = time.monotonic() if now is None else now
+        interval, computed_at = self._interval
+        if computed_at is not None and now - computed_at < INTERVAL_REFRESH:
+            return interval
+        interval = math.ceil(self.active_hosts(now) / TARGET_POLLS_PER_SECOND)
+        interval = int(min(MAX_POLL_INTERVAL, max(BASE_POLL_INTERVAL, interval)))
+        self._interval = (interval, now)
+        return interval
+
+    def stats(self):
+        with self._lock:
+            tracked, rejected = len(self._buckets), self._rejected
+        return {"tracked_hosts": tracked, "rejected": rejected, "active_hosts": self.active_hosts(),
+                "poll_interval": self.poll_interval()}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._rejected = 0
+            self._interval = (BASE_POLL_INTERVAL, None)
+
+
+poll_governor = PollGovernor()
+
+
+def client_host(request, registered):
+    """Bucket key: the client address, split per hostname only for registered devices.
+
+    ``hostname`` is client-supplied, so made-up names all share their
+    address's bucket and no client can drain a device's bucket from
+    another address.
+    """
+    address = request.META.get("REMOTE_ADDR", "")
+    hostname = request.GET.get("hostname")
+    return f"{address}|{hostname}" if hostname and registered else address
+
+
+def _governed_response(request, registered):
+    allowed, retry_after = poll_governor.acquire(client_host(request, registered))
+    if allowed:
+        return None
+    return JsonResponse({"error": "Too many requests.", "retry_after": retry_after}, status=429,
+                        headers={"Retry-After": str(retry_after)})
+
+
+def poll_governed(view):
+    """Apply the per-host token bucket to a polled view and advertise X-Poll-Interval."""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            hostname = request.GET.get("hostname")
+            registered = bool(hostname) and await device_cache.aget(hostname) is not None
+            response = _governed_response(request, registered)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            response["X-Poll-Interval"] = str(poll_governor.poll_interval())
+            return response
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        hostname = request.GET.get("hostname")
+        registered = bool(hostname) and device_cache.get(hostname) is not None
+        response = _governed_response(request, registered)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        response["X-Poll-Interval"] = str(poll_governor.poll_interval())
+        return response
+    return wrapper
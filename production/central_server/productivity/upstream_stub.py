@@ -0,0 +1,76 @@
+# upstream_stub.py
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SYNC_PATH = "/productivity/sync"
+BATCH_PATH = "/productivity/sync/batch"
+
+
+class UpstreamStub:
+    """Stand-in for the upstream sync API, for tests and local relay runs.
+
+    Records every accepted payload as ``(authorization, payload)``. Statuses
+    queued in ``fail_with`` are answered (one per request) before accepting again.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.received = []
+        self.requests = 0
+        self.fail_with = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                status, answer = stub.handle(self.path, self.headers.get("Authorization"), json.loads(body))
+                data = json.dumps(answer).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, path, authorization, document):
+        with self._lock:
+            self.requests += 1
+            if self.fail_with:
+                return self.fail_with.pop(0), {"error": "stub failure"}
+            if path == SYNC_PATH:
+                self.received.append((authorization, document))
+                return 200, {"status": "ok"}
+            if path == BATCH_PATH:
+                for item in document["batches"]:
+                    self.received.append((item["authorization"], item["payload"]))
+                return 200, {"results": [200] * len(document["batches"])}
+        return 404, {"error": "not found"}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
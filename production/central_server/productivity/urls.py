@@ -1,10 +1,33 @@
 # urls.py
+from django.conf import settings
 from django.urls import path
-from .views import register_device, unregister_device, get_device_credentials
+from . import async_views, views
+from .views import (
+    register_devices_bulk, unregister_devices_bulk,
+    get_device_credentials_batch, watch_device_credentials, device_cache_stats,
+    online_device_list, relay_sync
+)
+
+# Device hot path: native async views under ASGI (settings.PRODUCTIVITY_ASYNC_VIEWS), DRF otherwise
+device_views = async_views if settings.PRODUCTIVITY_ASYNC_VIEWS else views
 
 urlpatterns = [
-    path("register", register_device),
-    path("unregister", unregister_device),
-    path("token", get_device_credentials),
+    path("register", device_views.register_device),
+    path("unregister", device_views.unregister_device),
+    path("register/bulk", register_devices_bulk),
+    path("unregister/bulk", unregister_devices_bulk),
+    path("token", device_views.get_device_credentials),
+    path("token/batch", get_device_credentials_batch),
+    path("token/watch", watch_device_credentials),
+    path("token/cache-stats", device_cache_stats),
+    path("devices/online", online_device_list),
+
+    # LAN relay for device sync uploads (settings.PRODUCTIVITY_RELAY)
+    path("relay/sync", relay_sync),
+
+    # Native async views on fixed paths, whichever stack serves the routes above
+    path("async/register", async_views.register_device),
+    path("async/unregister", async_views.unregister_device),
+    path("async/token", async_views.get_device_credentials),
 
 ]
@@ -1,10 +1,42 @@
 # views.py
+import asyncio
+import json
+import math
+import time
+
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny  # or IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK
-from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from .cache import device_cache
+from .changes import device_changes, device_etag, device_version, etag_matches
 from .models import DeviceLogin
+from .presence import FLUSH_INTERVAL, device_presence, online_devices
+from .relay import RelayError, accept_payload, decode_body, relay_setting
+from .throttle import poll_governed, poll_governor
+from .services import (
+    MAX_BULK_DEVICES, register_device_login, unregister_device_login,
+    bulk_register_device_logins, bulk_unregister_device_logins,
+)
+
+# Batched token lookups: hard cap per request, size above which the
+# response is streamed instead of rendered in one piece, and hostnames
+# resolved per cache/database round trip while streaming
+MAX_TOKEN_BATCH = 500
+STREAM_TOKEN_BATCH_ABOVE = 100
+STREAM_LOOKUP_CHUNK = 100
+
+# Upper bound on rows returned by online_device_list
+MAX_ONLINE_DEVICES = 5000
+
+# Long-poll limits for watch_device_credentials (seconds)
+WATCH_DEFAULT_TIMEOUT = 50
+WATCH_MAX_TIMEOUT = 120
+# Waiters re-read the row this often so changes made by other worker processes are seen
+WATCH_RECHECK_INTERVAL = 5
 
 
 @api_view(['POST'])
@@ -15,22 +47,16 @@ def register_device(request):
     hostname = request.data.get("hostname")
     if not all([email, token, hostname]):
         return Response({"error": "Missing required fields."}, status=400)
-    with transaction.atomic():
-        # Remove previous device login by the same user (if any)
-        DeviceLogin.objects.filter(email=email).exclude(hostname=hostname).delete()
-        device, created = DeviceLogin.objects.update_or_create(
-            hostname=hostname,
-            defaults={"email": email, "token": token}
-        )
-        return Response({
-            "status": "registered",
-            "created": created,
-            "device": {
-                "hostname": device.hostname,
-                "email": device.email,
-                "token": device.token
-            }
-        })
+    device, created, _ = register_device_login(email, token, hostname)
+    return Response({
+        "status": "registered",
+        "created": created,
+        "device": {
+            "hostname": device.hostname,
+            "email": device.email,
+            "token": device.token
+        }
+    })
 
 
 @api_view(['DELETE'])
@@ -41,27 +67,215 @@ def unregister_device(request):
     hostname = request.data.get("hostname")
     if not all([email, token, hostname]):
         return Response({"error": "Missing required fields."}, status=400)
-    with transaction.atomic():
-        # Remove previous device login by the same user (if any)
-        DeviceLogin.objects.filter(email=email,hostname=hostname).delete()
-        return Response({
-            "status": "unregistered"
-        }, status=HTTP_200_OK)
+    unregister_device_login(email, hostname)
+    return Response({
+        "status": "unregistered"
+    }, status=HTTP_200_OK)
+
+
+def _bulk_records(request):
+    """Split a bulk body into valid records and per-index errors (or return an error Response)."""
+    devices = request.data.get("devices") if isinstance(request.data, dict) else None
+    if not isinstance(devices, list):
+        return None, None, Response({"error": "Expected a 'devices' list."}, status=400)
+    if len(devices) > MAX_BULK_DEVICES:
+        return None, None, Response({"error": f"At most {MAX_BULK_DEVICES} devices per request."}, status=413)
+    valid, errors = [], {}
+    for index, device in enumerate(devices):
+        if isinstance(device, dict) and all(isinstance(device.get(k), str) and device.get(k)
+                                            for k in ("email", "token", "hostname")):
+            valid.append((index, device))
+        else:
+            hostname = device.get("hostname") if isinstance(device, dict) else None
+            errors[index] = {"hostname": hostname, "status": "error", "error": "Missing required fields."}
+    return valid, errors, None
+
+
+def _merge_results(total, valid, results, errors):
+    merged = [errors.get(index) for index in range(total)]
+    for (index, _), result in zip(valid, results):
+        if result.get("status") == "superseded":
+            result["by"] = valid[result["by"]][0]
+        merged[index] = result
+    return merged
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])  # or IsAuthenticated based on your app flow
+def register_devices_bulk(request):
+    valid, errors, error_response = _bulk_records(request)
+    if error_response:
+        return error_response
+    results, displaced = bulk_register_device_logins([device for _, device in valid])
+    return Response({
+        "status": "registered",
+        "results": _merge_results(len(valid) + len(errors), valid, results, errors),
+        "displaced": displaced
+    })
+
+
+@api_view(['DELETE'])
+@permission_classes([AllowAny])  # or IsAuthenticated based on your app flow
+def unregister_devices_bulk(request):
+    valid, errors, error_response = _bulk_records(request)
+    if error_response:
+        return error_response
+    results = bulk_unregister_device_logins([device for _, device in valid])
+    return Response({
+        "status": "unregistered",
+        "results": _merge_results(len(valid) + len(errors), valid, results, errors)
+    }, status=HTTP_200_OK)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@poll_governed
 def get_device_credentials(request):
     hostname = request.query_params.get("hostname")
 
     if not hostname:
         return Response({"error": "Missing hostname."}, status=400)
 
-    try:
-        device = DeviceLogin.objects.get(hostname=hostname)
-        return Response({
-            "email": device.email,
-            "token": device.token
-        })
-    except DeviceLogin.DoesNotExist:
+    device = device_cache.get(hostname)
+    if device is None:
         return Response({"error": "Device not registered."}, status=404)
+    if device_presence.seen(hostname):
+        device_presence.flush_safely()
+    etag = device_etag(device)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status=304, headers={"ETag": etag})
+    return Response({
+        "email": device.email,
+        "token": device.token
+    }, headers={"ETag": etag})
+
+
+def _stream_credentials(hostnames):
+    # Hostnames are resolved a chunk at a time, so the first bytes go out
+    # before the last lookup runs
+    yield '{"credentials": {'
+    first = True
+    missing = []
+    for i in range(0, len(hostnames), STREAM_LOOKUP_CHUNK):
+        for hostname, device in device_cache.get_many(hostnames[i:i + STREAM_LOOKUP_CHUNK]).items():
+            if device is None:
+                missing.append(hostname)
+                continue
+            entry = json.dumps(hostname) + ": " + json.dumps({"email": device.email, "token": device.token})
+            yield entry if first else ", " + entry
+            first = False
+    yield '}, "missing": ' + json.dumps(missing) + '}'
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([AllowAny])
+def get_device_credentials_batch(request):
+    """Credentials for many hostnames in one call: ``{"credentials": {...}, "missing": [...]}``."""
+    if request.method == "POST":
+        hostnames = request.data.get("hostnames") if isinstance(request.data, dict) else None
+    else:
+        hostnames = request.query_params.getlist("hostname")
+    if not isinstance(hostnames, list) or not hostnames or \
+            not all(isinstance(h, str) and h for h in hostnames):
+        return Response({"error": "Expected a non-empty list of hostnames."}, status=400)
+    if len(hostnames) > MAX_TOKEN_BATCH:
+        return Response({"error": f"At most {MAX_TOKEN_BATCH} hostnames per request."}, status=413)
+
+    hostnames = list(dict.fromkeys(hostnames))
+    if len(hostnames) > STREAM_TOKEN_BATCH_ABOVE:
+        return StreamingHttpResponse(_stream_credentials(hostnames), content_type="application/json")
+    resolved = device_cache.get_many(hostnames)
+    return Response({
+        "credentials": {h: {"email": d.email, "token": d.token} for h, d in resolved.items() if d is not None},
+        "missing": [h for h, d in resolved.items() if d is None]
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def online_device_list(request):
+    """Devices that polled within ``within`` seconds (default: two advertised poll intervals)."""
+    try:
+        within = float(request.query_params.get("within", 2 * poll_governor.poll_interval() + FLUSH_INTERVAL))
+        limit = min(int(request.query_params.get("limit", MAX_ONLINE_DEVICES)), MAX_ONLINE_DEVICES)
+    except ValueError:
+        return Response({"error": "Invalid within/limit."}, status=400)
+    if not (within > 0 and math.isfinite(within)) or limit < 1:
+        return Response({"error": "Invalid within/limit."}, status=400)
+    # Include this process's not-yet-written sightings
+    if device_presence.pending_count():
+        device_presence.flush_safely()
+    devices = list(online_devices(within, limit))
+    return Response({"within": within, "count": len(devices), "devices": devices})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def device_cache_stats(request):
+    return Response({**device_cache.stats(), "polling": poll_governor.stats(), "presence": device_presence.stats()})
+
+
+def _credentials_body(device, version, changed):
+    if device is None:
+        return {"error": "Device not registered.", "version": version, "changed": changed}
+    return {"email": device.email, "token": device.token, "version": version, "changed": changed}
+
+
+@require_GET
+@poll_governed
+async def watch_device_credentials(request):
+    """Long-poll variant of get_device_credentials.
+
+    Returns as soon as the hostname's credentials differ from the ``version``
+    the client already holds, or once ``timeout`` seconds pass without a
+    change. Served under ASGI, a waiting request costs a coroutine, not a worker.
+    """
+    hostname = request.GET.get("hostname")
+    if not hostname:
+        return JsonResponse({"error": "Missing hostname."}, status=400)
+    known_version = request.GET.get("version", "")
+    try:
+        timeout = min(float(request.GET.get("timeout", WATCH_DEFAULT_TIMEOUT)), WATCH_MAX_TIMEOUT)
+    except ValueError:
+        return JsonResponse({"error": "Invalid timeout."}, status=400)
+
+    deadline = time.monotonic() + max(timeout, 0)
+    with device_changes.listen(hostname) as changed_event:
+        while True:
+            changed_event.clear()
+            device = await DeviceLogin.objects.filter(hostname=hostname).afirst()
+            version = device_version(device)
+            changed = version != known_version
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                if device is not None and device_presence.seen(hostname):
+                    await sync_to_async(device_presence.flush_safely)()
+                return JsonResponse(_credentials_body(device, version, changed), status=200 if device else 404)
+            try:
+                await asyncio.wait_for(changed_event.wait(), min(remaining, WATCH_RECHECK_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def relay_sync(request):
+    """LAN relay for device sync uploads (same body as the upstream sync API).
+
+    The payload is acknowledged once it is stored; the relay_forward command
+    merges stored payloads and sends them upstream.
+    """
+    if not relay_setting("ENABLED"):
+        return Response({"error": "Relay disabled."}, status=404)
+    auth = request.headers.get("Authorization", "")
+    token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+    try:
+        payload = decode_body(request.body, request.headers.get("Content-Encoding"))
+    except RelayError as e:
+        return Response({"error": str(e)}, status=e.status)
+    # Only accept what upstream will accept: the token the device registered with
+    device = device_cache.get(payload["system"])
+    if not token or device is None or (device.email, device.token) != (payload["email"], token):
+        return Response({"error": "Invalid credentials."}, status=401)
+    batch = accept_payload(payload, token)
+    return Response({"status": "accepted", "id": batch.id, "events": batch.event_count})
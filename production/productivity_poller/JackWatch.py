@@ -1,26 +1,36 @@
-import requests
+import json
 import time
 import os
 import sys
 import subprocess
 import threading
-from datetime import datetime, timedelta
-
-from constants import ActivewatchApi, JckdeskApi
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from batching import add_rollups, split_payload, encode_payload, event_lists
+from buckets import bucket_registry, missing_required, sync_bucket_types, type_for_payload_key
+from coalesce import coalesce_events
+import config
+from constants import ActivewatchApi, CentralServerApi, JckdeskApi
+import http_client
+import metrics
+from outbox import Outbox, is_retryable
 from registration import unregister_device_from_server
-from util import get_hostname, get_credentials_from_server
+import rollup
+from sync_cursor import load_cursor, advance_cursor, fetch_range
+from util import (
+    get_hostname, get_credentials_from_server, invalidate_credentials, watch_credentials,
+    jittered, poll_interval, retry_delay
+)
 
 CACHE_FILE = "aw_status.flag"
 SYNC_PERIOD = 60  # 10 minute - TODO
 HOST_VALIDATION_PERIOD = 30
 LOGIN_TIME_WAIT = 300 # 30 minutes - TODO
+HTTP_STATS_EVERY = 60  # sync cycles between connection reuse reports
+FETCH_WORKERS = 4  # buckets fetched from aw-server at once
 CACHED_CREDS = {"email": None, "token": None}
 
-LAST_ID_FILES = {
-    "window": "last_event_id_window.txt",
-    "afk": "last_event_id_afk.txt"
-}
-
 AW_SERVICES = ["ActivityWatchServer", "aw-watcher-afk", "aw-watcher-window"]
 
 
@@ -34,6 +44,7 @@ login_processes = []  # global list to track PyQt subprocesses
 
 def launch_login_window():
     if not is_login_already_open():
+        metrics.inc("jackwatch_login_prompts_total")
         pyqt_path = os.path.join(os.path.dirname(__file__), "client.py")
         proc = subprocess.Popen([sys.executable, pyqt_path])
         login_processes.append(proc)
@@ -76,42 +87,18 @@ def stop_activitywatch_services():
     print(f"[{datetime.now()}] ActivityWatch services stopped.")
 
 
-# ─── Event ID Storage ────────────────────────────────────────────────────────────
-
-def get_last_synced_event_id(bucket_type):
-    file_path = LAST_ID_FILES.get(bucket_type)
-    try:
-        with open(file_path, "r") as f:
-            return int(f.read().strip())
-    except (FileNotFoundError, ValueError):
-        return -1
-
-
-def set_last_synced_event_id(bucket_type, last_event_id):
-    file_path = LAST_ID_FILES.get(bucket_type)
-    with open(file_path, "w") as f:
-        f.write(str(last_event_id))
-
-
 # ─── ActivityWatch Fetching ──────────────────────────────────────────────────────
 
-def get_bucket_ids():
-    try:
-        response = requests.get(ActivewatchApi.LIST_BUCKETS)
-        response.raise_for_status()
-        all_buckets = response.json()
-        window_bucket = next((b["id"] for k, b in all_buckets.items() if k.startswith("aw-watcher-window_")), None)
-        afk_bucket = next((b["id"] for k, b in all_buckets.items() if k.startswith("aw-watcher-afk_")), None)
-        return window_bucket, afk_bucket
-    except Exception as e:
-        print("Error fetching bucket IDs:", e)
-        return None, None
-
-
 def fetch_events(bucket_id, start, end):
     try:
         url = ActivewatchApi.GET_EVENTS.format(bucket_id=bucket_id, start=start, end=end)
-        return requests.get(url).json()
+        response = http_client.get(url, endpoint="activitywatch")
+        if response.status_code == 404:
+            # The bucket was deleted or recreated under another id; list the buckets again next cycle
+            print(f"Bucket {bucket_id} not found; rediscovering buckets.")
+            bucket_registry.invalidate()
+            return []
+        return response.json()
     except Exception as e:
         print(f"Failed to fetch events from {bucket_id}:", e)
         return []
@@ -122,94 +109,228 @@ def filter_events_by_last_id(events, last_id, include_last_sent_event=False):
         return [event for event in events if event.get("id", -1) >= last_id]  # ✅ include last ID
     return [event for event in events if event.get("id", -1) > last_id]
 
+
+def collect_pending_events(bucket, bucket_id, include_last_sent_event=False):
+    # Only ask ActivityWatch for events from the watermark onwards. Watchers
+    # keep extending their newest event via heartbeats, so the event at the
+    # watermark is re-sent (include_last_sent_event) with its new duration.
+    bucket_type, keep = bucket.name, bucket.keep
+    cursor = load_cursor(bucket_type)
+    start, end = fetch_range(cursor)
+    with metrics.timer("jackwatch_phase_seconds", phase="fetch_events", bucket=bucket_type):
+        events = fetch_events(bucket_id, start, end)
+    with metrics.timer("jackwatch_phase_seconds", phase="filter", bucket=bucket_type):
+        events = sorted(
+            filter_events_by_last_id(events, cursor["id"], include_last_sent_event),
+            key=lambda e: e["id"]
+        )
+        if not events:
+            return events
+        if keep:
+            # The newest event stays whatever the rule says: the watermark moves to it
+            events = [event for event in events[:-1] if keep(event)] + events[-1:]
+        # The re-sent watermark event and the newest (still growing) event keep their own ids
+        compacted = coalesce_events(events, pinned_ids=(cursor["id"], events[-1]["id"]))
+    # The compression ratio is jackwatch_coalesce_events_total{stage="before"} / {stage="after"}
+    metrics.inc("jackwatch_coalesce_events_total", len(events), bucket=bucket_type, stage="before")
+    metrics.inc("jackwatch_coalesce_events_total", len(compacted), bucket=bucket_type, stage="after")
+    return compacted
+
+
+def resolve_buckets():
+    """The configured bucket types and their bucket ids, read once per sync cycle.
+
+    Later steps of the cycle take the types from here rather than from
+    app.config, so a config change mid-cycle cannot leave them disagreeing.
+    """
+    bucket_types = {bucket_type.name: bucket_type for bucket_type in sync_bucket_types()}
+    return bucket_types, bucket_registry.resolve(bucket_types.values())
+
+
+def collect_all_pending(bucket_types, bucket_ids, include_last_sent_event=False, workers=FETCH_WORKERS):
+    """Collect every resolved bucket through a bounded pool; returns ``{bucket_type: events}``."""
+    found = {name: bucket_id for name, bucket_id in bucket_ids.items() if bucket_id and name in bucket_types}
+    if not found:
+        return {}
+    workers = max(1, min(workers, len(found), http_client.POOL_MAXSIZE))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            name: pool.submit(collect_pending_events, bucket_types[name], bucket_id, include_last_sent_event)
+            for name, bucket_id in found.items()
+        }
+    return {name: future.result() for name, future in futures.items()}
+
+
+# ─── Outbox ──────────────────────────────────────────────────────────────────────
+
+_outbox = None
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+    return _outbox
+
+
+def enqueue_sync_batch(email, token, events_by_type, bucket_types):
+    if not any(events_by_type.values()):
+        return None
+    payload = {
+        "email": email,
+        "system": get_hostname(),
+        "window_events": [],
+        "afk_events": []
+    }
+    for bucket_type, events in events_by_type.items():
+        payload[bucket_types[bucket_type].payload_key] = events
+    # Each size-bounded chunk is its own outbox batch and is acknowledged on its
+    # own, so a timeout after a long offline period only retries that chunk
+    chunks = split_payload(payload)
+    granularity = config.get_config().get(rollup.ROLLUP_GRANULARITY_KEY, rollup.DEFAULT_GRANULARITY)
+    rollups, rollup_state = rollup.fold_batch(rollup.load_state(), events_by_type.get("window", []),
+                                              events_by_type.get("afk", []), granularity)
+    if rollups:
+        # Summaries are sent once, on the last chunk or in chunks of their own
+        chunks = add_rollups(chunks, rollups)
+    batch_ids = get_outbox().enqueue_many(chunks, email, token)
+    # The batches are durable in the outbox now, so the watermarks can move past them
+    rollup.save_state(rollup_state)
+    for bucket_type, events in events_by_type.items():
+        advance_cursor(bucket_type, events)
+    return batch_ids
+
+
+def post_sync_batch(batch):
+    payload = json.loads(batch["payload"])
+    token = batch["token"]
+    # Logging in again issues a new token; older batches of the same user use it
+    if CACHED_CREDS["email"] and CACHED_CREDS["email"] == batch["email"]:
+        token = CACHED_CREDS["token"]
+    body, headers = encode_payload(payload)
+    headers["Authorization"] = f"Bearer {token}"
+    with metrics.timer("jackwatch_phase_seconds", phase="post"):
+        response = http_client.post(JckdeskApi.SYNC, endpoint="jackdesk", data=body, headers=headers)
+    metrics.inc("jackwatch_payload_bytes_total", len(batch["payload"].encode("utf-8")), encoding="raw")
+    metrics.inc("jackwatch_payload_bytes_total", len(body), encoding="sent")
+    metrics.observe("jackwatch_payload_sent_bytes", len(body))
+    if response.status_code == 401:
+        metrics.inc("jackwatch_unauthorized_total")
+    if response.status_code != 200:
+        print(f"[{datetime.now()}] Error syncing batch {batch['id']}: {response.status_code} - {response.text}")
+    else:
+        counts = {type_for_payload_key(key): len(events) for key, events in event_lists(payload).items()}
+        for bucket_type, count in counts.items():
+            metrics.inc("jackwatch_events_synced_total", count, bucket=bucket_type)
+        print(f"[{datetime.now()}] Synced {', '.join(f'{count} {name}' for name, count in counts.items())} "
+              f"({len(body)} bytes).")
+    return response.status_code, http_client.retry_after(response)
+
+
+def batch_retryable(batch, status):
+    # A 401 for the signed-in user is fixed by logging in again, which
+    # post_sync_batch then picks up; a previous user's token stays rejected
+    if status == 401:
+        return bool(CACHED_CREDS["email"]) and CACHED_CREDS["email"] == batch["email"]
+    return is_retryable(status)
+
+
+def flush_outbox():
+    # Picks up a SYNC_URL (relay) change in app.config
+    CentralServerApi.refresh_config()
+    return get_outbox().drain(post_sync_batch, batch_retryable)
+
 # ─── Core Logic ──────────────────────────────────────────────────────────────────
 
+def finish_cycle(started, result):
+    # Recorded before any login/back-off sleep so cycle durations only cover the work
+    metrics.observe("jackwatch_sync_cycle_seconds", time.perf_counter() - started)
+    metrics.inc("jackwatch_sync_cycles_total", result=result)
+    metrics.maybe_write_snapshot()
+
+
 start_monitor_level = -1
 start_sync_level = -1
+def sync_cycle():
+    """One sync_loop iteration without its waits and login window.
+
+    Returns the cycle result: "ok", "no_credentials", "no_buckets",
+    "http_<status>" or "error".
+    """
+    global start_sync_level
+    start_sync_level += 1
+    cycle_started = time.perf_counter()
+    result = "error"
+    try:
+        with metrics.timer("jackwatch_phase_seconds", phase="credentials"):
+            creds = get_credentials_from_server()
+        if not creds or not creds.get("token") or not creds.get("email"):
+            print(f"[{datetime.now()}] No valid credentials; skipping sync.")
+            result = "no_credentials"
+            return result
+        email = creds["email"]
+        token = creds["token"]
+        CACHED_CREDS["email"] = email
+        CACHED_CREDS["token"] = token
+        # Unregistering after caching the credentials and 1st time the script starts or after user logs in to the system
+        if start_sync_level == 0:
+            with metrics.timer("jackwatch_phase_seconds", phase="unregister"):
+                unregister_device_from_server(email, token, get_hostname())
+        else:
+            # Skip(continue in line 136) unregistration, if the user is already logged into other system and we would get fresh login
+            print("Skipping unregistration")
+        bucket_types, bucket_ids = resolve_buckets()
+        if missing_required(bucket_ids):
+            print(f"Missing bucket IDs: {', '.join(missing_required(bucket_ids))}.")
+            result = "no_buckets"
+            return result
+        with metrics.timer("jackwatch_phase_seconds", phase="collect"):
+            events_by_type = collect_all_pending(bucket_types, bucket_ids, True)
+        with metrics.timer("jackwatch_phase_seconds", phase="enqueue"):
+            enqueue_sync_batch(email, token, events_by_type, bucket_types)
+        with metrics.timer("jackwatch_phase_seconds", phase="flush"):
+            status = flush_outbox()
+        result = "ok" if status in (None, 200) else f"http_{status}"
+        if status == 401:
+            invalidate_credentials()
+    except Exception as e:
+        print(f"Sync exception: {e}")
+        close_last_login_window()
+    finally:
+        finish_cycle(cycle_started, result)
+    return result
+
+
+def cycle_delay(result):
+    """Seconds sync_loop waits after a cycle with this result."""
+    if result in ("no_credentials", "http_401"):
+        return LOGIN_TIME_WAIT
+    if result == "no_buckets":
+        return 60
+    return jittered(SYNC_PERIOD)
+
+
 def sync_loop():
-    global start_sync_level, start_monitor_level
+    global start_monitor_level
     print("Starting sync loop...")
+    metrics.start_http_server()
     while True:
-        start_sync_level += 1
-        try:
-            creds = get_credentials_from_server()
-            if not creds or not creds.get("token") or not creds.get("email"):
-                print(f"[{datetime.now()}] No valid credentials; skipping sync.")
-                close_last_login_window()
-                launch_login_window()
-                try:
-                    time.sleep(LOGIN_TIME_WAIT)
-                except KeyboardInterrupt as e:
-                    close_last_login_window()
-                    raise e
-                continue
-            email = creds["email"]
-            token = creds["token"]
-            CACHED_CREDS["email"] = email
-            CACHED_CREDS["token"] = token
-            # Unregistering after caching the credentials and 1st time the script starts or after user logs in to the system
-            if start_sync_level == 0:
-                unregister_device_from_server(email, token, get_hostname())
-            else:
-                # Skip(continue in line 136) unregistration, if the user is already logged into other system and we would get fresh login
-                print("Skipping unregistration")
-            window_bucket, afk_bucket = get_bucket_ids()
-            if not window_bucket or not afk_bucket:
-                print("Missing bucket IDs.")
-                time.sleep(60)
-                continue
-            now = datetime.utcnow()
-            start = (now - timedelta(hours=12)).isoformat() + "Z"
-            end = now.isoformat() + "Z"
-            all_window_events = fetch_events(window_bucket, start, end)
-            all_afk_events = fetch_events(afk_bucket, start, end)
-            last_window_id = get_last_synced_event_id("window")
-            last_afk_id = get_last_synced_event_id("afk")
-            window_events = sorted(
-                filter_events_by_last_id(all_window_events, last_window_id, True),
-                key=lambda e: e["id"]
-            )
-            afk_events = sorted(
-                filter_events_by_last_id(all_afk_events, last_afk_id),
-                key=lambda e: e["id"]
-            )
-            payload = {
-                "email": email,
-                "system": get_hostname(),
-                "window_events": window_events,
-                "afk_events": afk_events
-            }
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-            response = requests.post(JckdeskApi.SYNC, json=payload, headers=headers)
-            if response.status_code == 401:
-                close_last_login_window()
-                launch_login_window()
-                try:
-                    time.sleep(LOGIN_TIME_WAIT)
-                except KeyboardInterrupt as e:
-                    close_last_login_window()
-                    raise e
-                continue
-            elif response.status_code != 200:
-                print(f"[{datetime.now()}] Error syncing: {response.status_code} - {response.text}")
-            else:
-                print(f"[{datetime.now()}] Synced {len(window_events)} window, {len(afk_events)} afk events.")
-                if window_events:
-                    max_win_id = max(e["id"] for e in window_events)
-                    set_last_synced_event_id("window", max_win_id)
-                if afk_events:
-                    max_afk_id = max(e["id"] for e in afk_events)
-                    set_last_synced_event_id("afk", max_afk_id)
-        except Exception as e:
-            print(f"Sync exception: {e}")
+        result = sync_cycle()
+        if result in ("no_credentials", "http_401"):
             close_last_login_window()
-        if start_monitor_level == -1:
-            threading.Thread(target=monitor_aw_state, daemon=True).start()
-            start_monitor_level += 1
-        time.sleep(SYNC_PERIOD)
+            launch_login_window()
+            try:
+                time.sleep(cycle_delay(result))
+            except KeyboardInterrupt as e:
+                close_last_login_window()
+                raise e
+            continue
+        if result != "no_buckets":
+            if start_sync_level % HTTP_STATS_EVERY == 0:
+                http_client.log_connection_stats()
+            if start_monitor_level == -1:
+                threading.Thread(target=monitor_aw_state, daemon=True).start()
+                start_monitor_level += 1
+        time.sleep(cycle_delay(result))
 
 
 def sync__flush():
@@ -218,48 +339,30 @@ def sync__flush():
     token = CACHED_CREDS["token"]
     CACHED_CREDS["email"] = None
     CACHED_CREDS["token"] = None
-    window_bucket, afk_bucket = get_bucket_ids()
-    if not window_bucket or not afk_bucket:
-        print("Missing bucket IDs.")
+    bucket_types, bucket_ids = resolve_buckets()
+    if missing_required(bucket_ids):
+        print(f"Missing bucket IDs: {', '.join(missing_required(bucket_ids))}.")
         return
-    now = datetime.utcnow()
-    start = (now - timedelta(hours=12)).isoformat() + "Z"
-    end = now.isoformat() + "Z"
-    all_window_events = fetch_events(window_bucket, start, end)
-    all_afk_events = fetch_events(afk_bucket, start, end)
-    last_window_id = get_last_synced_event_id("window")
-    last_afk_id = get_last_synced_event_id("afk")
-    window_events = sorted(
-        filter_events_by_last_id(all_window_events, last_window_id, True),
-        key=lambda e: e["id"]
-    )
-    afk_events = sorted(
-        filter_events_by_last_id(all_afk_events, last_afk_id),
-        key=lambda e: e["id"]
-    )
-    payload = {
-        "email": email,
-        "system": get_hostname(),
-        "window_events": window_events,
-        "afk_events": afk_events
-    }
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    # Even if the sync fails we would reset the last syn id since the new user would not
-    # get accounted as this function gets called only when the user changes the system
-    if window_events:
-        max_win_id = max(e["id"] for e in window_events)
-        set_last_synced_event_id("window", max_win_id)
-    if afk_events:
-        max_afk_id = max(e["id"] for e in afk_events)
-        set_last_synced_event_id("afk", max_afk_id)
-    response = requests.post(JckdeskApi.SYNC, json=payload, headers=headers)
-    if response.status_code != 200:
-        print(f"[{datetime.now()}] Error syncing: {response.status_code} - {response.text}")
-    else:
-        print(f"[{datetime.now()}] Synced {len(window_events)} window, {len(afk_events)} afk events.")
+    events_by_type = collect_all_pending(bucket_types, bucket_ids, True)
+    # Batches stay in the outbox with the previous user's token until the API
+    # acknowledges them, so the new user never inherits these events
+    enqueue_sync_batch(email, token, events_by_type, bucket_types)
+    flush_outbox()
+
+
+def wait_for_credential_change():
+    # Long-poll the central server so logout and re-registration arrive within
+    # a second; fall back to plain polling against servers without the endpoint.
+    started = time.monotonic()
+    try:
+        changed = watch_credentials()
+    except Exception as e:
+        print(f"[Monitor] Credential watch unavailable ({e}); polling instead.")
+        time.sleep(max(jittered(poll_interval(HOST_VALIDATION_PERIOD)), retry_delay()))
+        return False
+    # Never spin if the server keeps answering immediately, and back off when it asks us to
+    time.sleep(max(1 - (time.monotonic() - started), retry_delay()))
+    return changed
 
 
 def monitor_aw_state():
@@ -286,7 +389,7 @@ def monitor_aw_state():
                     raise e
         except Exception as e:
             print(f"[Monitor] Exception: {e}")
-        time.sleep(HOST_VALIDATION_PERIOD)
+        wait_for_credential_change()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from datetime import datetime
+
+import JackWatch as jw
+import metrics
+from registration import unregister_device_from_server
+from util import get_hostname, get_credentials_from_server, invalidate_credentials, jittered, poll_interval
+
+# Same cadence as JackWatch; one event loop drives the sync and monitor tasks
+# and blocking HTTP/SQLite work runs in the default thread pool.
+SYNC_PERIOD = jw.SYNC_PERIOD
+HOST_VALIDATION_PERIOD = jw.HOST_VALIDATION_PERIOD
+LOGIN_TIME_WAIT = jw.LOGIN_TIME_WAIT
+
+
+class CredentialState:
+    """Credentials shared by the sync and monitor tasks.
+
+    Concurrent callers wait on a single in-flight request instead of each
+    hitting the central server's token endpoint.
+    """
+
+    def __init__(self):
+        self.creds = None
+        self.fetched_at = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, max_age=None):
+        # Default to the interval the central server advertises
+        max_age = poll_interval(HOST_VALIDATION_PERIOD) if max_age is None else max_age
+        async with self._lock:
+            if self.fetched_at is None or time.monotonic() - self.fetched_at >= max_age:
+                with metrics.timer("jackwatch_phase_seconds", phase="credentials"):
+                    self.creds = await asyncio.to_thread(get_credentials_from_server)
+                self.fetched_at = time.monotonic()
+            return self.creds
+
+    def expire(self):
+        # Re-read on next get(); the shared util cache may already hold the answer
+        self.fetched_at = None
+
+    def invalidate(self):
+        self.fetched_at = None
+        invalidate_credentials()
+
+    @staticmethod
+    def is_valid(creds):
+        return bool(creds and creds.get("token") and creds.get("email"))
+
+
+class PollerEngine:
+    def __init__(self):
+        self.credentials = CredentialState()
+        # Serialises a sync cycle and a flush so both never move the watermarks at once
+        self.cycle_lock = asyncio.Lock()
+        self.cycles = 0
+
+    async def wait_for_login(self):
+        jw.close_last_login_window()
+        jw.launch_login_window()
+        await asyncio.sleep(LOGIN_TIME_WAIT)
+        self.credentials.invalidate()
+
+    async def sync_cycle(self):
+        started = time.perf_counter()
+        creds, (bucket_types, bucket_ids) = await asyncio.gather(
+            self.credentials.get(),
+            asyncio.to_thread(jw.resolve_buckets)
+        )
+        if not self.credentials.is_valid(creds):
+            print(f"[{datetime.now()}] No valid credentials; skipping sync.")
+            jw.finish_cycle(started, "no_credentials")
+            await self.wait_for_login()
+            return
+        email = creds["email"]
+        token = creds["token"]
+        jw.CACHED_CREDS["email"] = email
+        jw.CACHED_CREDS["token"] = token
+        # Unregistering after caching the credentials and 1st time the script starts
+        if self.cycles == 0:
+            await asyncio.to_thread(unregister_device_from_server, email, token, get_hostname())
+            self.credentials.invalidate()
+        if jw.missing_required(bucket_ids):
+            print(f"Missing bucket IDs: {', '.join(jw.missing_required(bucket_ids))}.")
+            jw.finish_cycle(started, "no_buckets")
+            return
+        async with self.cycle_lock:
+            events_by_type = await asyncio.to_thread(jw.collect_all_pending, bucket_types, bucket_ids, True)
+            with metrics.timer("jackwatch_phase_seconds", phase="enqueue"):
+                await asyncio.to_thread(jw.enqueue_sync_batch, email, token, events_by_type, bucket_types)
+            with metrics.timer("jackwatch_phase_seconds", phase="flush"):
+                status = await asyncio.to_thread(jw.flush_outbox)
+        jw.finish_cycle(started, "ok" if status in (None, 200) else f"http_{status}")
+        if status == 401:
+            self.credentials.invalidate()
+            await self.wait_for_login()
+
+    async def sync_task(self):
+        print("Starting async sync loop...")
+        while True:
+            try:
+                await self.sync_cycle()
+            except Exception as e:
+                print(f"Sync exception: {e}")
+                metrics.inc("jackwatch_sync_cycles_total", result="error")
+                jw.close_last_login_window()
+            self.cycles += 1
+            await asyncio.sleep(jittered(SYNC_PERIOD))
+
+    async def monitor_task(self):
+        print("Starting AW monitoring task...")
+        while True:
+            try:
+                creds = await self.credentials.get()
+                active = self.credentials.is_valid(creds)
+                if active and jw.is_aw_stopped():
+                    print(f"[{datetime.now()}] Detected valid creds. Restarting AW...")
+                elif not active and not jw.is_aw_stopped():
+                    if jw.CACHED_CREDS["token"]:
+                        print(f"[{datetime.now()}] Flushing unsynced events...")
+                        async with self.cycle_lock:
+                            await asyncio.to_thread(jw.sync__flush)
+                    print(f"[{datetime.now()}] No valid creds. Stopping AW...")
+                    await self.wait_for_login()
+            except Exception as e:
+                print(f"[Monitor] Exception: {e}")
+            await asyncio.to_thread(jw.wait_for_credential_change)
+            self.credentials.expire()
+
+    async def run(self):
+        metrics.start_http_server()
+        await asyncio.gather(self.sync_task(), self.monitor_task())
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(PollerEngine().run())
+    except KeyboardInterrupt:
+        jw.close_last_login_window()
@@ -0,0 +1,81 @@
+import gzip
+import json
+
+# Upper bounds for one upload; a long offline period is sent as many small
+# batches so a single timeout only costs one of them.
+MAX_BATCH_EVENTS = 1000
+MAX_BATCH_BYTES = 512 * 1024   # uncompressed JSON size
+GZIP_LEVEL = 6
+
+
+def event_lists(payload):
+    # Every list in a sync payload is a bucket's events ("window_events", "afk_events", ...)
+    return {key: value for key, value in payload.items() if isinstance(value, list)}
+
+
+def split_payload(payload, event_keys=None, max_events=MAX_BATCH_EVENTS, max_bytes=MAX_BATCH_BYTES):
+    event_keys = list(event_lists(payload)) if event_keys is None else event_keys
+    base = {k: v for k, v in payload.items() if k not in event_keys}
+    base_size = len(json.dumps(base)) + sum(len(k) + 8 for k in event_keys)
+
+    def empty_chunk():
+        chunk = dict(base)
+        for key in event_keys:
+            chunk[key] = []
+        return chunk
+
+    chunks = []
+    chunk, count, size = empty_chunk(), 0, base_size
+    for key in event_keys:
+        for event in payload.get(key) or []:
+            event_size = len(json.dumps(event)) + 2
+            if count and (count >= max_events or size + event_size > max_bytes):
+                chunks.append(chunk)
+                chunk, count, size = empty_chunk(), 0, base_size
+            chunk[key].append(event)
+            count += 1
+            size += event_size
+    if count:
+        chunks.append(chunk)
+    return chunks
+
+
+def add_rollups(chunks, rollups, max_bytes=MAX_BATCH_BYTES):
+    """Attach a rollups section to the chunks without letting any chunk grow past max_bytes.
+
+    The section rides on the last chunk when it fits. Otherwise its rows go
+    into chunks of their own (empty event lists), as consecutive sections
+    with adjacent start/end ranges, which the relay merges back together.
+    """
+    last = dict(chunks[-1], rollups=rollups)
+    if len(json.dumps(last)) <= max_bytes:
+        chunks[-1] = last
+        return chunks
+    base = {key: [] if isinstance(value, list) else value for key, value in chunks[-1].items()}
+    base_size = len(json.dumps(dict(base, rollups=dict(rollups, rows=[]))))
+    sections, rows, size = [], [], base_size
+    for row in rollups["rows"]:
+        row_size = len(json.dumps(row)) + 2
+        if rows and size + row_size > max_bytes:
+            sections.append(rows)
+            rows, size = [], base_size
+        rows.append(row)
+        size += row_size
+    sections.append(rows)
+    for index, rows in enumerate(sections):
+        section = dict(rollups, rows=rows)
+        if index > 0:
+            section["start"] = rows[0][0]
+        if index < len(sections) - 1:
+            section["end"] = sections[index + 1][0][0]
+        chunks.append(dict(base, rollups=section))
+    return chunks
+
+
+def encode_payload(payload, compress=True):
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
@@ -0,0 +1,358 @@
+"""Benchmark harness for the JackWatch sync cycle.
+
+Runs JackWatch against local stand-ins for aw-server, the sync API and the
+central server, and reports per-phase latency, CPU time, peak RSS and bytes
+on the wire for each synthetic event volume:
+
+    python benchmark.py --events 1000,10000,100000 --cycles 20
+
+The stand-ins run in their own process and every volume runs in a fresh
+poller process, so CPU time and RSS belong to the poller alone.
+"""
+import argparse
+import bisect
+import contextlib
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HOSTNAME = "bench-host"
+EMAIL = "bench@example.com"
+TOKEN = "bench-token"
+LOOKBACK = timedelta(hours=12)
+APPS = ["code.exe", "chrome.exe", "outlook.exe", "teams.exe", "excel.exe", "explorer.exe"]
+PHASES = ["credentials", "unregister", "buckets", "collect", "enqueue", "flush"]
+
+
+# ─── Stand-in servers (run in their own process) ─────────────────────────────────
+
+def _aw_timestamp(dt):
+    return dt.astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+class FakeActivityWatch:
+    """Synthetic window/afk buckets: ``events`` window events over the last 12h, ~1 afk event per 20."""
+
+    def __init__(self, events, new_events_per_cycle):
+        self.new_events_per_cycle = new_events_per_cycle
+        self.lock = threading.Lock()
+        now = datetime.now(timezone.utc)
+        self.start = now - LOOKBACK
+        self.step = LOOKBACK.total_seconds() / max(events, 1)
+        self.buckets = {"window": [], "afk": []}
+        self.next_id = {"window": 1, "afk": 1}
+        for _ in range(events):
+            self._append("window")
+        for _ in range(max(events // 20, 1)):
+            self._append("afk", step=self.step * 20)
+
+    def _append(self, kind, step=None):
+        step = step or self.step
+        events = self.buckets[kind]
+        event_id = self.next_id[kind]
+        self.next_id[kind] += 1
+        start = self.start + timedelta(seconds=step * (event_id - 1))
+        if kind == "window":
+            app = APPS[event_id % len(APPS)]
+            data = {"app": app, "title": f"{app} - document {event_id % 97}"}
+        else:
+            data = {"status": "not-afk" if event_id % 4 else "afk"}
+        events.append({"id": event_id, "timestamp": _aw_timestamp(start), "duration": step, "data": data,
+                       "_start": start.timestamp()})
+
+    def advance(self):
+        # New activity since the last cycle; the newest events keep growing like heartbeats
+        with self.lock:
+            for _ in range(self.new_events_per_cycle):
+                self._append("window")
+            self._append("afk", step=self.step * 20)
+            for kind in ("window", "afk"):
+                self.buckets[kind][-1]["duration"] += 5
+
+    def list_buckets(self):
+        return {
+            f"aw-watcher-{kind}_{HOSTNAME}": {"id": f"aw-watcher-{kind}_{HOSTNAME}", "type": bucket_type,
+                                              "hostname": HOSTNAME}
+            for kind, bucket_type in (("window", "currentwindow"), ("afk", "afkstatus"))
+        }
+
+    def events(self, bucket_id, start):
+        kind = "window" if "window" in bucket_id else "afk"
+        start = datetime.fromisoformat(start.replace("Z", "+00:00")).timestamp()
+        with self.lock:
+            events = self.buckets[kind]
+            # Timestamps run ahead of the wall clock over many cycles, so the end bound is ignored
+            index = bisect.bisect_left(events, start, key=lambda e: e["_start"] + e["duration"])
+            selected = [{k: v for k, v in e.items() if k != "_start"} for e in events[index:]]
+        # aw-server answers newest first
+        return selected[::-1]
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, role, aw=None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.role = role
+        self.aw = aw
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.requests = 0
+        self.counter_lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # One write per response and no Nagle delay, so the stand-ins add no latency of their own
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, document):
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        server = self.server
+        with server.counter_lock:
+            server.requests += 1
+            server.bytes_in += len(self.requestline) + len(str(self.headers)) + self._body_length
+            server.bytes_out += len(body) + 200  # status line and headers, roughly
+
+    def _read_body(self):
+        self._body_length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(self._body_length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def do_GET(self):
+        self._read_body()
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        server = self.server
+        if parts.path == "/_stats":
+            return self._reply(200, {"requests": server.requests, "bytes_in": server.bytes_in,
+                                     "bytes_out": server.bytes_out})
+        if server.role == "aw" and parts.path == "/api/0/buckets":
+            return self._reply(200, server.aw.list_buckets())
+        if server.role == "aw" and parts.path.endswith("/events"):
+            bucket_id = parts.path.split("/")[-2]
+            return self._reply(200, server.aw.events(bucket_id, query["start"][0]))
+        if server.role == "central" and parts.path == "/productivity/token":
+            return self._reply(200, {"email": EMAIL, "token": TOKEN})
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        self._read_body()
+        server = self.server
+        if server.role == "aw" and self.path == "/_advance":
+            server.aw.advance()
+            return self._reply(200, {"status": "ok"})
+        if server.role == "sync" and self.path.startswith("/productivity/sync"):
+            return self._reply(200, {"status": "ok"})
+        self._reply(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        self._read_body()
+        self._reply(200, {"status": "unregistered"})
+
+
+def serve_stand_ins(events, new_events_per_cycle, ports):
+    servers = [
+        StandInServer("aw", FakeActivityWatch(events, new_events_per_cycle)),
+        StandInServer("sync"),
+        StandInServer("central"),
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports.put([server.server_address[1] for server in servers])
+    while True:
+        time.sleep(3600)
+
+
+# ─── Poller side (runs in a fresh process per volume) ────────────────────────────
+
+def _rss_peak_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _stats(url):
+    import http_client
+    return http_client.get(url + "/_stats").json()
+
+
+def run_poller(aw_port, sync_port, central_port, cycles, results):
+    workdir = tempfile.mkdtemp(prefix="jackwatch-bench-")
+    os.chdir(workdir)
+    os.environ["COMPUTERNAME"] = HOSTNAME
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    config_path = os.path.join(workdir, "app.config")
+    with open(config_path, "w") as f:
+        f.write(f"CENTRAL_SERVER_IP=127.0.0.1\nCENTRAL_SERVER_PORT={central_port}\n"
+                f"SYNC_URL=http://127.0.0.1:{sync_port}/productivity/sync\n"
+                f"METRICS_PORT=0\n")
+
+    import config
+    config.DEFAULT_CONFIG_PATH = config_path
+    import JackWatch as jw
+    import http_client
+    from constants import ActivewatchApi
+
+    aw = f"http://127.0.0.1:{aw_port}"
+    ActivewatchApi.LIST_BUCKETS = f"{aw}/api/0/buckets"
+    ActivewatchApi.GET_EVENTS = aw + "/api/0/buckets/{bucket_id}/events?start={start}&end={end}"
+
+    import metrics
+
+    def totals():
+        # Phase and cycle durations as recorded by JackWatch itself
+        sums = dict.fromkeys(PHASES + ["cycle total"], 0.0)
+        for histogram in metrics.REGISTRY.snapshot()["histograms"]:
+            if histogram["name"] == "jackwatch_sync_cycle_seconds":
+                sums["cycle total"] += histogram["sum"]
+            elif histogram["name"] == "jackwatch_phase_seconds" and histogram["labels"]["phase"] in sums:
+                sums[histogram["labels"]["phase"]] += histogram["sum"]
+        return sums
+
+    timings = {phase: [] for phase in PHASES + ["cycle total"]}
+    cpu = []
+    delays = []
+
+    for _ in range(cycles):
+        http_client.post(f"{aw}/_advance")
+        before = totals()
+        cpu_started = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = jw.sync_cycle()
+        cpu.append(time.process_time() - cpu_started)
+        after = totals()
+        for phase in timings:
+            timings[phase].append(after[phase] - before[phase])
+        if result != "ok":
+            raise RuntimeError(f"sync cycle ended with {result}")
+        # sync_loop would sleep this long before the next cycle
+        delays.append(jw.cycle_delay(result))
+
+    # Signing out: sync__flush queues and sends whatever is left under the old user
+    http_client.post(f"{aw}/_advance")
+    started, cpu_started = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        jw.sync__flush()
+    logout = {"seconds": time.perf_counter() - started, "cpu": time.process_time() - cpu_started,
+              "pending": jw.get_outbox().pending_count()}
+
+    sent = {}
+    for value in metrics.REGISTRY.snapshot()["values"]:
+        if value["name"] == "jackwatch_events_synced_total":
+            bucket_type = value["labels"]["bucket"]
+            sent[bucket_type] = sent.get(bucket_type, 0) + value["value"]
+
+    jw.get_outbox().close()
+    os.chdir(tempfile.gettempdir())
+    shutil.rmtree(workdir, ignore_errors=True)
+    results.put({
+        "timings": timings,
+        "cpu": cpu,
+        "delays": delays,
+        "logout": logout,
+        "rss_mb": _rss_peak_mb(),
+        "sent": sent,
+        "wire": {role: _stats(f"http://127.0.0.1:{port}")
+                 for role, port in (("aw", aw_port), ("sync", sync_port), ("central", central_port))},
+    })
+
+
+# ─── Reporting ───────────────────────────────────────────────────────────────────
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:9.1f}"
+
+
+def report(events, result):
+    print(f"\n=== {events} events in the 12h window, {len(result['cpu'])} cycles ===")
+    print(f"{'phase':<16}{'first ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for phase in PHASES + ["cycle total"]:
+        samples = result["timings"][phase]
+        print(f"{phase:<16}{_ms(samples[0])}{_ms(statistics.median(samples))}"
+              f"{_ms(_percentile(samples, 0.95))}{_ms(max(samples))}")
+    cpu = result["cpu"]
+    print(f"CPU per cycle: first {cpu[0] * 1000:.1f} ms, p50 {statistics.median(cpu) * 1000:.1f} ms")
+    delays = result["delays"]
+    print(f"Next cycle after: {min(delays):.1f}-{max(delays):.1f} s (jittered sync period)")
+    logout = result["logout"]
+    print(f"Sign-out flush: {logout['seconds'] * 1000:.1f} ms, CPU {logout['cpu'] * 1000:.1f} ms, "
+          f"{logout['pending']} batches left in the outbox")
+    if result["rss_mb"] is not None:
+        print(f"Peak RSS: {result['rss_mb']:.1f} MB")
+    print(f"Events synced: {', '.join(f'{count:g} {name}' for name, count in sorted(result['sent'].items()))}")
+    for role, wire in result["wire"].items():
+        print(f"{role:<8} {wire['requests']:>6} requests  {wire['bytes_in'] / 1024:>10.1f} KiB to server  "
+              f"{wire['bytes_out'] / 1024:>10.1f} KiB to poller")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default="1000,10000,100000",
+                        help="Comma-separated window event counts in the 12h window")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--new-events", type=int, default=20, help="Window events added between cycles")
+    args = parser.parse_args()
+
+    for events in [int(value) for value in args.events.split(",")]:
+        ports = multiprocessing.Queue()
+        stand_ins = multiprocessing.Process(target=serve_stand_ins, args=(events, args.new_events, ports), daemon=True)
+        stand_ins.start()
+        try:
+            aw_port, sync_port, central_port = ports.get(timeout=120)
+            results = multiprocessing.Queue()
+            poller = multiprocessing.Process(
+                target=run_poller, args=(aw_port, sync_port, central_port, args.cycles, results)
+            )
+            poller.start()
+            result = None
+            while result is None:
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    if not poller.is_alive():
+                        raise SystemExit(f"Poller process failed (exit code {poller.exitcode})")
+            poller.join()
+            report(events, result)
+        finally:
+            stand_ins.terminate()
+            stand_ins.join()
+
+
+if __name__ == "__main__":
+    main()
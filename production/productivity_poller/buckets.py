@@ -0,0 +1,177 @@
+import threading
+import time
+
+import config
+import http_client
+import metrics
+from constants import ActivewatchApi
+from util import get_hostname
+
+# Comma-separated bucket types synced every cycle, e.g. SYNC_BUCKETS=window,afk,web,input.
+# Each type adds its own "<type>_events" list to the sync payload, so the
+# upstream API must accept it before a type is switched on.
+SYNC_BUCKETS_KEY = "SYNC_BUCKETS"
+DEFAULT_SYNC_BUCKETS = ("window", "afk")
+# app.config can override a type's prefix or add a new type: BUCKET_PREFIX_WEB=aw-watcher-web-firefox_
+PREFIX_KEY = "BUCKET_PREFIX_"
+# A sync cycle cannot run without these; optional watchers may come and go
+REQUIRED_TYPES = ("window", "afk")
+# While an optional watcher has no bucket yet, the listing is fetched again this often (seconds)
+REDISCOVER_INTERVAL = 300
+
+
+class BucketType:
+    """One kind of ActivityWatch bucket: where to find it and how its events are synced.
+
+    ``keep`` is an optional predicate; events it rejects are not uploaded.
+    The newest event of a fetch is always kept because it carries the
+    bucket's watermark.
+    """
+
+    def __init__(self, name, prefix, payload_key=None, keep=None):
+        self.name = name
+        self.prefix = prefix
+        self.payload_key = payload_key or f"{name}_events"
+        self.keep = keep
+
+
+def _has_url(event):
+    return bool((event.get("data") or {}).get("url"))
+
+
+def _has_input(event):
+    data = event.get("data") or {}
+    return any(data.get(key) for key in ("presses", "clicks", "deltaX", "deltaY", "scrollX", "scrollY"))
+
+
+BUCKET_TYPES = {}
+# name -> signature of the app.config snapshot it was last reported unknown in
+_unknown_reported = {}
+
+
+def register_bucket_type(bucket_type):
+    BUCKET_TYPES[bucket_type.name] = bucket_type
+    return bucket_type
+
+
+register_bucket_type(BucketType("window", "aw-watcher-window_"))
+register_bucket_type(BucketType("afk", "aw-watcher-afk_"))
+register_bucket_type(BucketType("web", "aw-watcher-web-chrome_", keep=_has_url))
+register_bucket_type(BucketType("input", "aw-watcher-input_", keep=_has_input))
+
+
+def get_bucket_type(name):
+    snapshot = config.get_config()
+    registered = BUCKET_TYPES.get(name)
+    prefix = snapshot.get(PREFIX_KEY + name.upper()) or (registered.prefix if registered else None)
+    if registered is None:
+        return BucketType(name, prefix) if prefix else None
+    if prefix == registered.prefix:
+        return registered
+    return BucketType(name, prefix, registered.payload_key, registered.keep)
+
+
+def sync_bucket_types():
+    """The configured bucket types, required ones first; unknown names without a prefix are skipped."""
+    snapshot = config.get_config()
+    names = [name.strip().lower() for name in
+             (snapshot.get(SYNC_BUCKETS_KEY) or ",".join(DEFAULT_SYNC_BUCKETS)).split(",")]
+    types = {}
+    for name in list(REQUIRED_TYPES) + names:
+        if name and name not in types:
+            bucket_type = get_bucket_type(name)
+            if bucket_type is None:
+                # Once per edit of app.config, not once per cycle
+                if _unknown_reported.get(name) != snapshot.signature:
+                    _unknown_reported[name] = snapshot.signature
+                    print(f"Unknown bucket type {name!r}; set {PREFIX_KEY}{name.upper()} in app.config.")
+                continue
+            types[name] = bucket_type
+    return list(types.values())
+
+
+def configured_prefixes(bucket_types=None):
+    bucket_types = sync_bucket_types() if bucket_types is None else bucket_types
+    return {bucket_type.name: bucket_type.prefix for bucket_type in bucket_types}
+
+
+def type_for_payload_key(payload_key):
+    """The bucket type name behind a payload list, e.g. "afk" for "afk_events"."""
+    for bucket_type in BUCKET_TYPES.values():
+        if bucket_type.payload_key == payload_key:
+            return bucket_type.name
+    return payload_key[:-len("_events")] if payload_key.endswith("_events") else payload_key
+
+
+def match_buckets(all_buckets, prefixes, hostname):
+    """Pick one bucket id per type, preferring the bucket this host's watcher writes to."""
+    resolved = {}
+    for bucket_type, prefix in prefixes.items():
+        candidates = [b for k, b in all_buckets.items() if k.startswith(prefix)]
+        own = [b for b in candidates if b.get("hostname") == hostname or b["id"] == prefix + hostname]
+        chosen = (own or candidates or [None])[0]
+        resolved[bucket_type] = chosen["id"] if chosen else None
+    return resolved
+
+
+def missing_required(resolved):
+    return [bucket_type for bucket_type in REQUIRED_TYPES if not resolved.get(bucket_type)]
+
+
+class BucketRegistry:
+    """Bucket ids resolved from the aw-server listing once and reused every cycle.
+
+    The listing is fetched again after invalidate() (a bucket answered 404),
+    when the hostname or the configured prefixes change, every cycle while a
+    required bucket is still missing, and every REDISCOVER_INTERVAL seconds
+    while an optional one is.
+    """
+
+    def __init__(self, rediscover_interval=REDISCOVER_INTERVAL):
+        self._lock = threading.Lock()
+        self._resolved = None
+        self._key = None
+        self._resolved_at = 0.0
+        self.rediscover_interval = rediscover_interval
+
+    def resolve(self, bucket_types=None):
+        key = (get_hostname(), tuple(sorted(configured_prefixes(bucket_types).items())))
+        with self._lock:
+            if self._resolved is not None and self._key == key and (
+                    all(self._resolved.values())
+                    or time.monotonic() - self._resolved_at < self.rediscover_interval):
+                return dict(self._resolved)
+            cached = dict(self._resolved) if self._resolved is not None and self._key == key else None
+        resolved = self._discover(key[0], dict(key[1]))
+        with self._lock:
+            if missing_required(resolved):
+                if cached is None:
+                    # Keep asking while a required watcher has not created its bucket yet
+                    return resolved
+                # A failed rediscovery keeps the ids we had; try again after the next interval
+                resolved = cached
+            self._resolved, self._key, self._resolved_at = resolved, key, time.monotonic()
+        return dict(resolved)
+
+    def _discover(self, hostname, prefixes):
+        try:
+            with metrics.timer("jackwatch_phase_seconds", phase="buckets"):
+                response = http_client.get(ActivewatchApi.LIST_BUCKETS, endpoint="activitywatch")
+                response.raise_for_status()
+                all_buckets = response.json()
+        except Exception as e:
+            print("Error fetching bucket IDs:", e)
+            return {bucket_type: None for bucket_type in prefixes}
+        metrics.inc("jackwatch_bucket_discoveries_total")
+        return match_buckets(all_buckets, prefixes, hostname)
+
+    def get(self, bucket_type):
+        return self.resolve().get(bucket_type)
+
+    def invalidate(self):
+        with self._lock:
+            self._resolved = None
+            self._key = None
+
+
+bucket_registry = BucketRegistry()
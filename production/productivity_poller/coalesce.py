@@ -0,0 +1,48 @@
+from sync_cursor import parse_event_timestamp
+
+# Largest gap (seconds) between the end of one event and the start of the next
+# for the two to still count as contiguous.
+MERGE_GAP_TOLERANCE = 1.0
+
+
+def _end_time(event, start):
+    return start.timestamp() + float(event.get("duration") or 0)
+
+
+def coalesce_events(events, pinned_ids=()):
+    """Merge runs of contiguous events carrying identical data.
+
+    A merged event keeps the start timestamp of the run, the summed duration,
+    the id of its newest member (so the max-id watermark is unchanged) and an
+    ``id_range`` of [first_id, last_id]. Events in ``pinned_ids`` are never
+    merged: they are the heartbeat events that get re-sent with a longer
+    duration and must keep their own id.
+    """
+    pinned_ids = set(pinned_ids)
+    merged = []
+    run_end = None
+    for event in events:
+        try:
+            start = parse_event_timestamp(event["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            merged.append(event)
+            run_end = None
+            continue
+        prev = merged[-1] if merged else None
+        if (
+            prev is not None
+            and run_end is not None
+            and prev.get("id") not in pinned_ids
+            and event.get("id") not in pinned_ids
+            and prev.get("data") == event.get("data")
+            and abs(start.timestamp() - run_end) <= MERGE_GAP_TOLERANCE
+        ):
+            first_id = prev.get("id_range", [prev["id"]])[0]
+            prev["duration"] = float(prev.get("duration") or 0) + float(event.get("duration") or 0)
+            prev["id"] = event["id"]
+            prev["id_range"] = [first_id, event["id"]]
+        else:
+            merged.append(dict(event))
+        run_end = _end_time(event, start)
+    return merged
+
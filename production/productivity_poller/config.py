@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from types import MappingProxyType
+
+CONFIG_FILE = 'app.config'
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), CONFIG_FILE)
+
+# How often a reader may stat the file to notice edits; in between, readers
+# get the published snapshot without touching the disk.
+CHECK_INTERVAL = 2.0
+
+_snapshots = {}
+_checked_at = {}
+_lock = threading.Lock()
+
+
+class ConfigSnapshot:
+    """Immutable, parsed view of one app.config file."""
+
+    __slots__ = ("path", "signature", "values")
+
+    def __init__(self, path, signature, values):
+        self.path = path
+        self.signature = signature
+        self.values = MappingProxyType(dict(values))
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+
+def parse_config(path):
+    values = {}
+    with open(path, 'r') as config:
+        for config_line in config:
+            config_line = config_line.strip()
+            if not config_line or config_line.startswith('#') or '=' not in config_line:
+                continue
+            key, value = config_line.split('=', 1)
+            values[key.strip()] = value.strip()
+    return values
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_config(path=None):
+    path = os.path.abspath(path or DEFAULT_CONFIG_PATH)
+    snapshot = _snapshots.get(path)
+    if snapshot is not None and time.monotonic() - _checked_at.get(path, 0) < CHECK_INTERVAL:
+        return snapshot
+    with _lock:
+        snapshot = _snapshots.get(path)
+        signature = _signature(path)
+        if snapshot is None or snapshot.signature != signature:
+            snapshot = ConfigSnapshot(path, signature, parse_config(path))
+            _snapshots[path] = snapshot
+        _checked_at[path] = time.monotonic()
+        return snapshot
+
+
+def invalidate(path=None):
+    with _lock:
+        if path is None:
+            _snapshots.clear()
+            _checked_at.clear()
+        else:
+            _snapshots.pop(os.path.abspath(path), None)
+            _checked_at.pop(os.path.abspath(path), None)
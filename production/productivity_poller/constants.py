@@ -1,25 +1,20 @@
-import os
+import config
 
-CONFIG_FILE = 'app.config'
+CONFIG_FILE = config.CONFIG_FILE
+DEFAULT_CENTRAL_SERVER_PORT = "8000"
 
 def load_config(custom_config_path=None):
-    configurations = {}
-    config_file = os.path.join(os.path.dirname(__file__), CONFIG_FILE)
-    if custom_config_path:
-        config_file = custom_config_path
-    with open(config_file, 'r') as config:
-        for config_line in config.readlines():
-            print("config_line ", config_line, config_line.split('='))
-            config_pair = config_line.split('=')
-            configurations.update({config_pair[0]: config_pair[1]})
-    return configurations
+    return dict(config.get_config(custom_config_path).values)
 
 configurations = load_config()
 
 
 class JckdeskApi:
     LOGIN = "https://api.jackdesk.com/users/login/google"
-    SYNC = "https://api.jackdesk.com/productivity/sync"
+    DEFAULT_SYNC = "https://api.jackdesk.com/productivity/sync"
+    # SYNC_URL=http://<central server>:8000/productivity/relay/sync sends syncs through the LAN relay
+    SYNC_URL_KEY = "SYNC_URL"
+    SYNC = configurations.get(SYNC_URL_KEY) or DEFAULT_SYNC
     #LOGIN = "http://localhost:8000/users/login/google"
     #SYNC = "http://localhost:8000/productivity/sync"
 
@@ -27,19 +22,36 @@ class JckdeskApi:
 class ActivewatchApi:
     LIST_BUCKETS = "http://localhost:5600/api/0/buckets"
     GET_EVENTS = "http://localhost:5600/api/0/buckets/{bucket_id}/events?start={start}&end={end}"
+    DELETE_EVENT = "http://localhost:5600/api/0/buckets/{bucket_id}/events/{event_id}"
 
 class CentralServerApi:
     CENTRAL_SERVER_IP_KEY = "CENTRAL_SERVER_IP"
+    CENTRAL_SERVER_PORT_KEY = "CENTRAL_SERVER_PORT"
     CENTRAL_SERVER_IP = configurations[CENTRAL_SERVER_IP_KEY]
-    REGISTER = f"http://{CENTRAL_SERVER_IP}:8000/productivity/register"
-    UNREGISTER = f"http://{CENTRAL_SERVER_IP}:8000/productivity/unregister"
-    TOKEN = f"http://{CENTRAL_SERVER_IP}:8000/productivity/token?"+"hostname={hostname}"
+    CENTRAL_SERVER_PORT = configurations.get(CENTRAL_SERVER_PORT_KEY, DEFAULT_CENTRAL_SERVER_PORT)
+    REGISTER = f"http://{CENTRAL_SERVER_IP}:{CENTRAL_SERVER_PORT}/productivity/register"
+    UNREGISTER = f"http://{CENTRAL_SERVER_IP}:{CENTRAL_SERVER_PORT}/productivity/unregister"
+    TOKEN = f"http://{CENTRAL_SERVER_IP}:{CENTRAL_SERVER_PORT}/productivity/token?"+"hostname={hostname}"
+    TOKEN_WATCH = f"http://{CENTRAL_SERVER_IP}:{CENTRAL_SERVER_PORT}/productivity/token/watch?"+"hostname={hostname}&version={version}&timeout={timeout}"
+    _snapshot = config.get_config()
 
     @classmethod
     def refresh_config(cls, custom_config_path=None):
+        # Cheap on the hot path: the URLs are only rebuilt when the published
+        # config snapshot actually changed.
         global configurations
-        configurations = load_config(custom_config_path)
-        CENTRAL_SERVER_IP = configurations[CentralServerApi.CENTRAL_SERVER_IP_KEY]
-        CentralServerApi.REGISTER = f"http://{CENTRAL_SERVER_IP}:8000/productivity/register"
-        CentralServerApi.UNREGISTER = f"http://{CENTRAL_SERVER_IP}:8000/productivity/unregister"
-        CentralServerApi.TOKEN = f"http://{CENTRAL_SERVER_IP}:8000/productivity/token?"+"hostname={hostname}"
+        snapshot = config.get_config(custom_config_path)
+        if snapshot is cls._snapshot:
+            return
+        cls._snapshot = snapshot
+        configurations = dict(snapshot.values)
+        central_server_ip = snapshot[CentralServerApi.CENTRAL_SERVER_IP_KEY]
+        central_server_port = snapshot.get(CentralServerApi.CENTRAL_SERVER_PORT_KEY, DEFAULT_CENTRAL_SERVER_PORT)
+        CentralServerApi.CENTRAL_SERVER_IP = central_server_ip
+        CentralServerApi.CENTRAL_SERVER_PORT = central_server_port
+        base = f"http://{central_server_ip}:{central_server_port}/productivity"
+        CentralServerApi.REGISTER = f"{base}/register"
+        CentralServerApi.UNREGISTER = f"{base}/unregister"
+        CentralServerApi.TOKEN = f"{base}/token?"+"hostname={hostname}"
+        CentralServerApi.TOKEN_WATCH = f"{base}/token/watch?"+"hostname={hostname}&version={version}&timeout={timeout}"
+        JckdeskApi.SYNC = snapshot.get(JckdeskApi.SYNC_URL_KEY) or JckdeskApi.DEFAULT_SYNC
@@ -1,33 +1,139 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
-import requests
-
+import http_client
+from buckets import bucket_registry, configured_prefixes, get_bucket_type
 from constants import ActivewatchApi
+from outbox import OUTBOX_FILE, Outbox
+from sync_cursor import load_cursor, parse_event_timestamp, format_aw_timestamp
 
-def clear_bucket_events(bucket_id, events_to_be_removed):
-    try:
-        for i in events_to_be_removed:
-            url = f"http://127.0.0.1:5600/api/0/buckets/{bucket_id}/events/{i}"
-            response = requests.delete(url)
-            if response.status_code == 200:
-                print(f"Cleared bucket: {bucket_id} event {i}")
-    except Exception as e:
-        print(f"Error clearing bucket {bucket_id}: {e}")
-
-def get_bucket_ids():
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+PROGRESS_INTERVAL = 1.0  # seconds between progress lines
+
+
+def oldest_undelivered_id(bucket_type, path=OUTBOX_FILE):
+    """Lowest event id of this type still waiting in the outbox, or None when all were acknowledged."""
+    bucket = get_bucket_type(bucket_type)
+    if bucket is None or not os.path.exists(path):
+        return None
+    outbox = Outbox(path)
     try:
-        response = requests.get(ActivewatchApi.LIST_BUCKETS)
-        response.raise_for_status()
-        all_buckets = response.json()
-        window_bucket = next((b["id"] for k, b in all_buckets.items() if k.startswith("aw-watcher-window_")), None)
-        afk_bucket = next((b["id"] for k, b in all_buckets.items() if k.startswith("aw-watcher-afk_")), None)
-        return window_bucket, afk_bucket
-    except Exception as e:
-        print("Error fetching bucket IDs:", e)
-        return None, None
-
-def remove_all_events():
-    window_bucket, afk_bucket = get_bucket_ids()
-    clear_bucket_events(window_bucket, range(1000, 1083))
-    #clear_bucket_events(afk_bucket, range(1, 1000))
-
-remove_all_events()
\ No newline at end of file
+        payloads = outbox.undelivered()
+    finally:
+        outbox.close()
+    # A coalesced event stands for every id in its id_range
+    ids = [(event.get("id_range") or [event["id"]])[0]
+           for payload in payloads for event in payload.get(bucket.payload_key) or [] if "id" in event]
+    return min(ids, default=None)
+
+
+def select_events(bucket_type, bucket_id, start=None, end=None, synced_only=False):
+    """Ids of events in [start, end]; with synced_only, only those the sync API has acknowledged.
+
+    The watermark moves as soon as a batch is queued in the outbox, so events
+    from the oldest unacknowledged batch onwards are kept as well.
+    """
+    start = start or EPOCH
+    end = end or datetime.now(timezone.utc)
+    url = ActivewatchApi.GET_EVENTS.format(
+        bucket_id=bucket_id, start=format_aw_timestamp(start), end=format_aw_timestamp(end)
+    )
+    response = http_client.get(url, endpoint="activitywatch")
+    if response.status_code == 404:
+        bucket_registry.invalidate()
+    response.raise_for_status()
+    events = response.json()
+    if synced_only:
+        # The watermark event itself may still be growing and is re-sent next cycle; keep it
+        cutoff = load_cursor(bucket_type)["id"]
+        undelivered = oldest_undelivered_id(bucket_type)
+        if undelivered is not None:
+            cutoff = min(cutoff, undelivered)
+        events = [e for e in events if e.get("id", cutoff) < cutoff]
+    return sorted(e["id"] for e in events if "id" in e)
+
+
+def _delete_event(bucket_id, event_id):
+    url = ActivewatchApi.DELETE_EVENT.format(bucket_id=bucket_id, event_id=event_id)
+    return http_client.delete(url, endpoint="activitywatch").status_code
+
+
+def clear_bucket_events(bucket_id, events_to_be_removed, workers=http_client.POOL_MAXSIZE):
+    """Delete events through a bounded thread pool sharing the pooled aw-server session.
+
+    Safe to re-run: events that are already gone (404) count as done.
+    """
+    event_ids = list(events_to_be_removed)
+    stats = {"deleted": 0, "missing": 0, "failed": 0}
+    started = last_report = time.monotonic()
+    workers = max(1, min(workers, http_client.POOL_MAXSIZE))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_delete_event, bucket_id, event_id): event_id for event_id in event_ids}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f"Error deleting event {futures[future]} from {bucket_id}: {e}")
+                status = None
+            if status == 200:
+                stats["deleted"] += 1
+            elif status == 404:
+                stats["missing"] += 1
+            else:
+                stats["failed"] += 1
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL or done == len(event_ids):
+                last_report = now
+                rate = done / max(now - started, 1e-9)
+                print(f"[{bucket_id}] {done}/{len(event_ids)} processed ({rate:.0f} events/s)")
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 3)
+    print(f"Cleared bucket {bucket_id}: {stats['deleted']} deleted, {stats['missing']} already gone, "
+          f"{stats['failed']} failed in {elapsed:.1f}s")
+    return stats
+
+
+def remove_events(bucket_types, start=None, end=None, synced_only=False, workers=http_client.POOL_MAXSIZE,
+                  dry_run=False):
+    bucket_ids = bucket_registry.resolve()
+    results = {}
+    for bucket_type in bucket_types:
+        bucket_id = bucket_ids.get(bucket_type)
+        if not bucket_id:
+            print(f"No {bucket_type} bucket found; skipping.")
+            continue
+        event_ids = select_events(bucket_type, bucket_id, start, end, synced_only)
+        print(f"Selected {len(event_ids)} events from {bucket_id}.")
+        if dry_run or not event_ids:
+            results[bucket_type] = {"selected": len(event_ids)}
+            continue
+        results[bucket_type] = clear_bucket_events(bucket_id, event_ids, workers)
+    return results
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Delete ActivityWatch events by time range and/or sync status. "
+                    "Run from the JackWatch working directory when using --synced."
+    )
+    parser.add_argument("--bucket", choices=sorted(configured_prefixes()) + ["all"], default="all")
+    parser.add_argument("--start", type=parse_event_timestamp, help="ISO timestamp (default: beginning of time)")
+    parser.add_argument("--end", type=parse_event_timestamp, help="ISO timestamp (default: now)")
+    parser.add_argument("--synced", action="store_true", help="Only delete events the sync API has acknowledged")
+    parser.add_argument("--workers", type=int, default=http_client.POOL_MAXSIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many events would be deleted")
+    args = parser.parse_args(argv)
+    if not (args.start or args.end or args.synced):
+        parser.error("refusing to delete everything: give --start/--end and/or --synced")
+    return args
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    bucket_types = sorted(configured_prefixes()) if args.bucket == "all" else [args.bucket]
+    remove_events(bucket_types, args.start, args.end, args.synced, args.workers, args.dry_run)
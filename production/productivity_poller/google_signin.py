@@ -1,4 +1,4 @@
-import requests
+import http_client
 from google_auth_oauthlib.flow import InstalledAppFlow
 
 from constants import JckdeskApi
@@ -13,7 +13,7 @@ def login_and_get_app_token():
     id_token = credentials.id_token
 
     # Send to your Django backend to validate
-    response = requests.post(JckdeskApi.LOGIN, json={"token": id_token})
+    response = http_client.post(JckdeskApi.LOGIN, endpoint="jackdesk", json={"token": id_token})
 
     if response.status_code == 200:
         result = response.json()
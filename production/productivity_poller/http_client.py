@@ -0,0 +1,120 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# (connect, read) timeouts in seconds per endpoint family
+TIMEOUTS = {
+    "activitywatch": (2, 30),   # local aw-server; event listings can be large
+    "central": (3, 10),         # central server on the LAN
+    "jackdesk": (5, 60),        # api.jackdesk.com over the WAN
+    "default": (5, 30),
+}
+
+POOL_MAXSIZE = 8
+
+# Statuses after which the server's Retry-After is honoured
+RETRY_AFTER_STATUSES = (429, 503)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def session_for(url):
+    # One keep-alive session per host, shared by every module of the poller
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _sessions[key] = session
+    return session
+
+
+def request(method, url, endpoint="default", **kwargs):
+    kwargs.setdefault("timeout", TIMEOUTS.get(endpoint, TIMEOUTS["default"]))
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = session_for(url).request(method, url, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.observe("jackwatch_http_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+        metrics.inc("jackwatch_http_requests_total", endpoint=endpoint, method=method, status=status)
+
+
+def get(url, endpoint="default", **kwargs):
+    return request("GET", url, endpoint, **kwargs)
+
+
+def post(url, endpoint="default", **kwargs):
+    return request("POST", url, endpoint, **kwargs)
+
+
+def delete(url, endpoint="default", **kwargs):
+    return request("DELETE", url, endpoint, **kwargs)
+
+
+def retry_after(response):
+    """Seconds the server asked us to wait (Retry-After on 429/503), or None."""
+    if response.status_code not in RETRY_AFTER_STATUSES:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def connection_stats():
+    """Requests sent vs. TCP connections opened per host; the difference is keep-alive reuse."""
+    stats = {}
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+    for key, session in sessions:
+        opened = sent = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                sent += pool.num_requests
+        stats[key] = {"requests": sent, "connections": opened, "reused": max(sent - opened, 0)}
+    return stats
+
+
+def log_connection_stats():
+    for host, stat in connection_stats().items():
+        print(f"[HTTP] {host}: {stat['requests']} requests over {stat['connections']} connections "
+              f"({stat['reused']} reused)")
+
+
+def close_all():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Local Prometheus endpoint (127.0.0.1 only); METRICS_PORT=0 in app.config disables it
+METRICS_PORT_KEY = "METRICS_PORT"
+DEFAULT_METRICS_PORT = 9465
+# JSON-lines snapshots, rotated like a log file
+SNAPSHOT_FILE = "jackwatch_metrics.jsonl"
+SNAPSHOT_INTERVAL = 300
+SNAPSHOT_MAX_BYTES = 1024 * 1024
+SNAPSHOT_BACKUPS = 3
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Registry:
+    """Counters, gauges and histograms keyed by name and label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._values = {}       # (name, labels) -> float
+        self._histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {}
+
+    def _declare(self, name, kind, help_text, buckets=None):
+        if name not in self._types:
+            self._types[name] = kind
+            self._help[name] = help_text
+            if buckets is not None:
+                self._buckets[name] = tuple(buckets)
+
+    def counter(self, name, help_text=""):
+        with self._lock:
+            self._declare(name, "counter", help_text)
+
+    def gauge(self, name, help_text=""):
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            self._declare(name, "histogram", help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "counter", "")
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "gauge", "")
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "histogram", "", DEFAULT_BUCKETS)
+            buckets = self._buckets[name]
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._types):
+                kind = self._types[name]
+                if self._help[name]:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "histogram":
+                    buckets = self._buckets[name]
+                    for (metric, labels), state in sorted(self._histograms.items()):
+                        if metric != name:
+                            continue
+                        for bound, count in zip(buckets, state):
+                            lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {count}")
+                        lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {state[-1]}")
+                        lines.append(f"{name}_sum{_labels(labels)} {_number(state[-2])}")
+                        lines.append(f"{name}_count{_labels(labels)} {state[-1]}")
+                else:
+                    for (metric, labels), value in sorted(self._values.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            values = [{"name": name, "labels": dict(labels), "value": value}
+                      for (name, labels), value in sorted(self._values.items())]
+            histograms = [{"name": name, "labels": dict(labels), "sum": state[-2], "count": state[-1],
+                           "buckets": dict(zip(map(_number, self._buckets[name]), state[:-2]))}
+                          for (name, labels), state in sorted(self._histograms.items())]
+        return {"timestamp": time.time(), "values": values, "histograms": histograms}
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+REGISTRY.histogram("jackwatch_phase_seconds", "Duration of each sync phase")
+REGISTRY.histogram("jackwatch_sync_cycle_seconds", "Duration of a whole sync cycle")
+REGISTRY.counter("jackwatch_sync_cycles_total", "Sync cycles by result")
+REGISTRY.counter("jackwatch_bucket_discoveries_total", "Times the aw-server bucket listing was fetched")
+REGISTRY.counter("jackwatch_events_synced_total", "Events acknowledged by the sync endpoint")
+REGISTRY.counter("jackwatch_coalesce_events_total", "Events per bucket before and after coalescing")
+REGISTRY.counter("jackwatch_payload_bytes_total", "Sync payload bytes, raw JSON and as sent")
+REGISTRY.histogram("jackwatch_payload_sent_bytes", "Size of each sync request body", BYTE_BUCKETS)
+REGISTRY.counter("jackwatch_sync_retries_total", "Outbox batches scheduled for another attempt")
+REGISTRY.gauge("jackwatch_outbox_pending", "Batches waiting in the outbox")
+REGISTRY.counter("jackwatch_outbox_dead_total", "Batches parked after a permanent error or too many attempts")
+REGISTRY.counter("jackwatch_unauthorized_total", "401 answers from the sync endpoint")
+REGISTRY.counter("jackwatch_login_prompts_total", "Times the login window was opened")
+REGISTRY.histogram("jackwatch_http_request_seconds", "HTTP request duration per endpoint family")
+REGISTRY.counter("jackwatch_http_requests_total", "HTTP requests per endpoint family and status")
+
+
+# ─── Exposure ────────────────────────────────────────────────────────────────────
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_last_snapshot = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def start_http_server(port=None, host="127.0.0.1"):
+    """Serve /metrics in a daemon thread; a no-op when disabled or already running."""
+    global _server
+    if _server is not None:
+        return _server
+    if port is None:
+        try:
+            port = int(config.get_config().get(METRICS_PORT_KEY, DEFAULT_METRICS_PORT))
+        except (OSError, ValueError):
+            port = DEFAULT_METRICS_PORT
+    if not port:
+        return None
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"[Metrics] Cannot listen on {host}:{port}: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"[Metrics] Serving on http://{host}:{port}/metrics")
+    return _server
+
+
+def _rotate(path, backups):
+    for index in range(backups - 1, 0, -1):
+        older = f"{path}.{index}"
+        if os.path.exists(older):
+            os.replace(older, f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def write_snapshot(path=SNAPSHOT_FILE, max_bytes=SNAPSHOT_MAX_BYTES, backups=SNAPSHOT_BACKUPS):
+    line = json.dumps(REGISTRY.snapshot(), separators=(",", ":")) + "\n"
+    with _snapshot_lock:
+        if os.path.exists(path) and os.path.getsize(path) + len(line) > max_bytes:
+            _rotate(path, backups)
+        with open(path, "a") as f:
+            f.write(line)
+
+
+def maybe_write_snapshot(interval=SNAPSHOT_INTERVAL):
+    global _last_snapshot
+    now = time.monotonic()
+    if now - _last_snapshot < interval:
+        return False
+    _last_snapshot = now
+    try:
+        write_snapshot()
+    except OSError as e:
+        print(f"[Metrics] Snapshot failed: {e}")
+        return False
+    return True
@@ -0,0 +1,181 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import metrics
+
+OUTBOX_FILE = "sync_outbox.db"
+
+BACKOFF_BASE = 5          # seconds before the first retry
+BACKOFF_CAP = 30 * 60     # never wait more than 30 minutes between retries
+MAX_ATTEMPTS = 100        # after this a batch is parked as dead instead of blocking the queue
+# Only these answers (plus timeouts/connection errors and 5xx) are retried;
+# anything else (400, 401, 403, 413, ...) will not change on a retry, so the
+# batch is parked at once instead of holding back the batches behind it
+RETRYABLE_STATUSES = (408, 429)
+ACKED_RETENTION = 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    email TEXT,
+    token TEXT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_status INTEGER,
+    acked_at REAL,
+    dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS batches_pending ON batches (acked_at, dead, id);
+"""
+
+
+def is_retryable(status):
+    return status is None or status in RETRYABLE_STATUSES or status >= 500
+
+
+def backoff_delay(attempts):
+    # Exponential backoff with jitter so a fleet coming back from an outage
+    # does not retry in lockstep.
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Outbox:
+    """Durable spool of sync batches waiting to be acknowledged by the API."""
+
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+
+    def enqueue(self, payload, email=None, token=None):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO batches (created_at, email, token, payload) VALUES (?, ?, ?, ?)",
+                (time.time(), email, token, json.dumps(payload))
+            )
+            return cur.lastrowid
+
+    def enqueue_many(self, payloads, email=None, token=None):
+        # All chunks of one cycle become durable together or not at all
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [
+                    self._conn.execute(
+                        "INSERT INTO batches (created_at, email, token, payload) VALUES (?, ?, ?, ?)",
+                        (now, email, token, json.dumps(payload))
+                    ).lastrowid
+                    for payload in payloads
+                ]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return ids
+
+    def due(self, now=None, limit=50):
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM batches WHERE acked_at IS NULL AND dead = 0 ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        # Batches are sent strictly in order, so the queue is only due once its head is.
+        if rows and rows[0]["next_attempt_at"] > now:
+            return []
+        return rows
+
+    def mark_acked(self, batch_id, status=200):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET acked_at = ?, last_status = ?, attempts = attempts + 1 WHERE id = ?",
+                (time.time(), status, batch_id)
+            )
+
+    def mark_failed(self, batch_id, status=None, retry_after=None, permanent=False):
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if row is None:
+                return
+            attempts = row["attempts"] + 1
+            dead = permanent or attempts >= MAX_ATTEMPTS
+            if dead:
+                metrics.inc("jackwatch_outbox_dead_total", status=str(status))
+            else:
+                metrics.inc("jackwatch_sync_retries_total", status=str(status))
+            # A server-supplied Retry-After wins over our own backoff when it is longer
+            delay = max(backoff_delay(attempts), retry_after or 0)
+            self._conn.execute(
+                "UPDATE batches SET attempts = ?, last_status = ?, next_attempt_at = ?, dead = ? WHERE id = ?",
+                (attempts, status, time.time() + delay, int(dead), batch_id)
+            )
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM batches WHERE acked_at IS NULL AND dead = 0"
+            ).fetchone()[0]
+
+    def undelivered(self):
+        """Payloads of every batch the API has not acknowledged, parked ones included."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM batches WHERE acked_at IS NULL ORDER BY id"
+            ).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
+
+    def prune(self, retention=ACKED_RETENTION):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM batches WHERE acked_at IS NOT NULL AND acked_at < ?",
+                (time.time() - retention,)
+            )
+
+    def drain(self, send, retryable=None):
+        """Send due batches in order until one fails; returns the last HTTP status (or None).
+
+        ``send`` returns the HTTP status, or ``(status, retry_after_seconds)``.
+        A batch whose failure ``retryable(row, status)`` rejects (default:
+        is_retryable) is parked as dead and the queue moves on; its status is
+        not returned.
+        """
+        retryable = retryable or (lambda row, status: is_retryable(status))
+        status = None
+        for row in self.due():
+            retry_after = None
+            try:
+                answer = send(row)
+            except Exception as e:
+                print(f"Outbox send failed for batch {row['id']}: {e}")
+                answer = None
+            if isinstance(answer, tuple):
+                answer, retry_after = answer
+            if answer == 200:
+                status = answer
+                self.mark_acked(row["id"], answer)
+                continue
+            if not retryable(row, answer):
+                print(f"Outbox parked batch {row['id']} after a {answer} answer")
+                self.mark_failed(row["id"], answer, permanent=True)
+                continue
+            status = answer
+            self.mark_failed(row["id"], answer, retry_after)
+            break
+        self.prune()
+        metrics.set_gauge("jackwatch_outbox_pending", self.pending_count())
+        return status
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
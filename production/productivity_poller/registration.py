@@ -1,14 +1,16 @@
-import requests
+import http_client
 from constants import CentralServerApi  # e.g., CENTRAL_REGISTER = http://yourapi/register_device/
+from util import invalidate_credentials
 
 def register_device_with_server(email, token, hostname, custom_config_path=None):
     try:
         CentralServerApi.refresh_config(custom_config_path)
-        response = requests.post(
+        response = http_client.post(
             CentralServerApi.REGISTER,
-            json={"email": email, "token": token, "hostname": hostname},
-            timeout=10
+            endpoint="central",
+            json={"email": email, "token": token, "hostname": hostname}
         )
+        invalidate_credentials()
         if response.status_code == 200:
             return True
         print(f"Register failed: {response.status_code} - {response.text}")
@@ -22,11 +24,12 @@ def unregister_device_from_server(email, token, hostname, custom_config_path=Non
     try:
         print("CentralServerApi.UNREGISTER ", CentralServerApi.UNREGISTER)
         CentralServerApi.refresh_config(custom_config_path)
-        response = requests.delete(
+        response = http_client.delete(
             CentralServerApi.UNREGISTER,
-            json={"email": email, "token": token, "hostname": hostname},
-            timeout=10
+            endpoint="central",
+            json={"email": email, "token": token, "hostname": hostname}
         )
+        invalidate_credentials()
         if response.status_code == 200:
             return True
         print(f"Register failed: {response.status_code} - {response.text}")
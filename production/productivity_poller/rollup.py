@@ -0,0 +1,150 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from sync_cursor import format_aw_timestamp, parse_event_timestamp
+
+ROLLUP_STATE_FILE = "rollup_state.json"
+ROLLUP_GRANULARITY_KEY = "ROLLUP_GRANULARITY"
+GRANULARITIES = {"minute": 60, "hour": 3600}
+DEFAULT_GRANULARITY = "minute"
+
+# Window time not covered by any afk event (watcher stopped) is reported as such
+UNKNOWN_AFK_STATE = "unknown"
+# Never hold back more than this much window time waiting for afk coverage
+MAX_PENDING_SPAN = 6 * 60 * 60
+ROLLUP_COLUMNS = ["start", "app", "afk", "seconds"]
+
+
+def _interval(event, label):
+    try:
+        start = parse_event_timestamp(event["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+    end = start + float(event.get("duration") or 0)
+    if end <= start:
+        return None
+    return [start, end, label, event.get("id")]
+
+
+def _merge_intervals(known, events, label_key):
+    # Re-sent heartbeat events replace the stored copy with the same id
+    by_id = {interval[3]: interval for interval in known if interval[3] is not None}
+    anonymous = [interval for interval in known if interval[3] is None]
+    for event in events:
+        interval = _interval(event, (event.get("data") or {}).get(label_key) or UNKNOWN_AFK_STATE)
+        if interval is None:
+            continue
+        if interval[3] is None:
+            anonymous.append(interval)
+        else:
+            by_id[interval[3]] = interval
+    return sorted(list(by_id.values()) + anonymous, key=lambda interval: interval[0])
+
+
+def sweep(window, afk, start, end):
+    """Intersect window intervals with afk intervals inside [start, end) in one pass.
+
+    Both lists are sorted by start. Yields ``(seg_start, seg_end, app, afk_state)``;
+    window time with no afk interval over it is labelled ``unknown``.
+    """
+    j = 0
+    for w_start, w_end, app, _ in window:
+        w_start, w_end = max(w_start, start), min(w_end, end)
+        if w_end <= w_start:
+            continue
+        while j < len(afk) and afk[j][1] <= w_start:
+            j += 1
+        cursor = w_start
+        k = j
+        while cursor < w_end and k < len(afk) and afk[k][0] < w_end:
+            a_start, a_end, state, _ = afk[k]
+            if a_start > cursor:
+                yield cursor, min(a_start, w_end), app, UNKNOWN_AFK_STATE
+                cursor = min(a_start, w_end)
+            overlap_end = min(a_end, w_end)
+            if overlap_end > cursor:
+                yield cursor, overlap_end, app, state
+                cursor = overlap_end
+            k += 1
+        if cursor < w_end:
+            yield cursor, w_end, app, UNKNOWN_AFK_STATE
+
+
+def aggregate(segments, bucket_seconds):
+    totals = {}
+    for seg_start, seg_end, app, state in segments:
+        while seg_start < seg_end:
+            bucket = seg_start - seg_start % bucket_seconds
+            piece_end = min(seg_end, bucket + bucket_seconds)
+            key = (bucket, app, state)
+            totals[key] = totals.get(key, 0.0) + (piece_end - seg_start)
+            seg_start = piece_end
+    return totals
+
+
+def load_state(path=ROLLUP_STATE_FILE):
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"hwm": None, "window": [], "afk": []}
+    state.setdefault("hwm", None)
+    state.setdefault("window", [])
+    state.setdefault("afk", [])
+    return state
+
+
+def save_state(state, path=ROLLUP_STATE_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def fold_batch(state, window_events, afk_events, granularity=DEFAULT_GRANULARITY):
+    """Fold one sync batch into the rollups; returns ``(rollups or None, new_state)``.
+
+    Time is only aggregated up to the horizon both watchers have reported
+    (the smaller of the newest window end and the newest afk end). The high
+    water mark ``hwm`` makes re-sent heartbeat events count only their new
+    tail. Intervals that reach past the horizon are kept in the state for
+    the next batch. ``state`` itself is not modified.
+    """
+    bucket_seconds = GRANULARITIES.get(granularity, GRANULARITIES[DEFAULT_GRANULARITY])
+    window = _merge_intervals(state["window"], window_events, "app")
+    afk = _merge_intervals(state["afk"], afk_events, "status")
+    if not window:
+        hwm = state["hwm"]
+        return None, {"hwm": hwm, "window": [], "afk": [i for i in afk if hwm is None or i[1] > hwm] or afk[-1:]}
+
+    window_end = max(interval[1] for interval in window)
+    horizon = min(window_end, max((interval[1] for interval in afk), default=window_end))
+    # Without afk coverage for too long, give up waiting and report the window time as unknown
+    horizon = max(horizon, window_end - MAX_PENDING_SPAN)
+    hwm = state["hwm"] if state["hwm"] is not None else min(interval[0] for interval in window)
+
+    rollups = None
+    if horizon > hwm:
+        totals = aggregate(sweep(window, afk, hwm, horizon), bucket_seconds)
+        rows = [
+            [format_aw_timestamp(datetime.fromtimestamp(bucket, timezone.utc)), app, afk_state, round(seconds, 3)]
+            for (bucket, app, afk_state), seconds in sorted(totals.items())
+        ]
+        if rows:
+            rollups = {
+                "granularity": granularity if granularity in GRANULARITIES else DEFAULT_GRANULARITY,
+                "start": format_aw_timestamp(datetime.fromtimestamp(hwm, timezone.utc)),
+                "end": format_aw_timestamp(datetime.fromtimestamp(horizon, timezone.utc)),
+                "columns": ROLLUP_COLUMNS,
+                "rows": rows,
+            }
+        hwm = horizon
+
+    new_state = {
+        "hwm": hwm,
+        "window": [interval for interval in window if interval[1] > hwm],
+        # Keep the newest afk interval even when it ended: it may still be extended
+        "afk": [interval for interval in afk if interval[1] > hwm] or afk[-1:],
+    }
+    return rollups, new_state
@@ -0,0 +1,83 @@
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+# Per-bucket watermark: the id *and* start timestamp of the last synced event.
+# The files keep their historical names; older installs that only hold a bare
+# integer id are still readable and get upgraded on the next successful save.
+# Any other bucket type gets a file of the same pattern (see cursor_file).
+LAST_ID_FILES = {
+    "window": "last_event_id_window.txt",
+    "afk": "last_event_id_afk.txt"
+}
+
+# Used only when a bucket has no timestamp watermark yet (first run / legacy file)
+DEFAULT_LOOKBACK = timedelta(hours=12)
+
+_FRACTION_RE = re.compile(r"\.(\d+)")
+
+
+def parse_event_timestamp(value):
+    # ActivityWatch may emit "Z" suffixes and nanosecond fractions, neither of
+    # which datetime.fromisoformat accepts on older Pythons.
+    value = value.strip().replace("Z", "+00:00")
+    value = _FRACTION_RE.sub(lambda m: "." + m.group(1)[:6].ljust(6, "0"), value, count=1)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def format_aw_timestamp(dt):
+    return dt.astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def cursor_file(bucket_type):
+    return LAST_ID_FILES.get(bucket_type) or f"last_event_id_{bucket_type}.txt"
+
+
+def load_cursor(bucket_type):
+    cursor = {"id": -1, "timestamp": None}
+    file_path = cursor_file(bucket_type)
+    try:
+        with open(file_path, "r") as f:
+            raw = f.read().strip()
+    except (FileNotFoundError, TypeError):
+        return cursor
+    try:
+        stored = json.loads(raw)
+    except ValueError:
+        return cursor
+    if isinstance(stored, int):
+        cursor["id"] = stored
+    elif isinstance(stored, dict):
+        cursor["id"] = int(stored.get("id", -1))
+        cursor["timestamp"] = stored.get("timestamp")
+    return cursor
+
+
+def save_cursor(bucket_type, event):
+    file_path = cursor_file(bucket_type)
+    cursor = {"id": event["id"], "timestamp": event.get("timestamp")}
+    with open(file_path, "w") as f:
+        f.write(json.dumps(cursor))
+    return cursor
+
+
+def advance_cursor(bucket_type, events):
+    # Watermark moves to the newest event by id; that is also the in-progress
+    # heartbeat event, so its timestamp is where the next fetch must start.
+    if not events:
+        return None
+    return save_cursor(bucket_type, max(events, key=lambda e: e["id"]))
+
+
+def fetch_range(cursor, now=None):
+    now = now or datetime.now(timezone.utc)
+    start = now - DEFAULT_LOOKBACK
+    if cursor.get("timestamp"):
+        try:
+            start = min(parse_event_timestamp(cursor["timestamp"]), now)
+        except ValueError:
+            pass
+    return format_aw_timestamp(start), format_aw_timestamp(now)
@@ -0,0 +1,581 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+import JackWatch
+import buckets
+import config
+import metrics
+import rollup
+from batching import add_rollups, encode_payload, split_payload
+from buckets import BUCKET_TYPES
+from coalesce import coalesce_events
+from outbox import BACKOFF_BASE, BACKOFF_CAP, MAX_ATTEMPTS, Outbox, backoff_delay
+from sync_cursor import DEFAULT_LOOKBACK, advance_cursor, cursor_file, fetch_range, load_cursor, save_cursor
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Runs each test inside a scratch working directory; the poller keeps its state files in the cwd."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.old_cwd = os.getcwd()
+        os.chdir(self.workdir)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class OutboxTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.outbox = Outbox(os.path.join(self.workdir, "outbox.db"))
+
+    def tearDown(self):
+        self.outbox.close()
+        super().tearDown()
+
+    def enqueue(self, count, email="a@example.com"):
+        return [self.outbox.enqueue({"n": i}, email, "t1") for i in range(count)]
+
+    def test_batches_drain_in_enqueue_order(self):
+        ids = self.enqueue(3)
+        ids += self.outbox.enqueue_many([{"n": 3}, {"n": 4}], "a@example.com", "t1")
+        sent = []
+
+        def send(row):
+            sent.append(json.loads(row["payload"])["n"])
+            return 200
+
+        self.assertEqual(self.outbox.drain(send), 200)
+        self.assertEqual(sent, [0, 1, 2, 3, 4])
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(self.outbox.pending_count(), 0)
+        self.assertEqual(self.outbox.undelivered(), [])
+
+    def test_enqueue_many_is_all_or_nothing(self):
+        with self.assertRaises(TypeError):
+            self.outbox.enqueue_many([{"n": 0}, {"n": object()}])
+        self.assertEqual(self.outbox.pending_count(), 0)
+
+    def test_backoff_grows_exponentially_up_to_the_cap(self):
+        with mock.patch("outbox.random.uniform", return_value=1.0):
+            self.assertEqual([backoff_delay(n) for n in (1, 2, 3)], [BACKOFF_BASE, BACKOFF_BASE * 2, BACKOFF_BASE * 4])
+            self.assertEqual(backoff_delay(50), BACKOFF_CAP)
+        with mock.patch("outbox.random.uniform", return_value=0.5):
+            self.assertEqual(backoff_delay(1), BACKOFF_BASE / 2)
+
+    def test_only_the_head_of_the_queue_decides_when_it_is_due(self):
+        first, second = self.enqueue(2)
+        self.outbox.mark_failed(first, 503)
+        # The second batch is ready, but is not sent ahead of the first
+        self.assertEqual(self.outbox.due(), [])
+        self.assertEqual([row["id"] for row in self.outbox.due(now=time.time() + BACKOFF_CAP)], [first, second])
+
+    def test_undelivered_lists_pending_and_parked_batches(self):
+        acked, parked, pending = self.enqueue(3)
+        self.outbox.mark_acked(acked)
+        self.outbox.mark_failed(parked, 400, permanent=True)
+        self.assertEqual(self.outbox.undelivered(), [{"n": 1}, {"n": 2}])
+        self.assertEqual(self.outbox.pending_count(), 1)
+
+    def test_prune_drops_old_acknowledged_batches_only(self):
+        acked, pending = self.enqueue(2)
+        self.outbox.mark_acked(acked)
+        self.outbox.prune(retention=-1)
+        rows = self.outbox._conn.execute("SELECT id FROM batches").fetchall()
+        self.assertEqual([row["id"] for row in rows], [pending])
+
+    def test_permanent_failure_is_parked_and_the_queue_moves_on(self):
+        ids = self.enqueue(3)
+        sent = []
+
+        def send(row):
+            sent.append(row["id"])
+            return 400 if row["id"] == ids[0] else 200
+
+        self.assertEqual(self.outbox.drain(send), 200)
+        self.assertEqual(sent, ids)
+        self.assertEqual(self.outbox.pending_count(), 0)
+        self.assertEqual(len(self.outbox.undelivered()), 1)
+        # Parked for good: not sent again
+        self.assertEqual(self.outbox.drain(send), None)
+        self.assertEqual(sent, ids)
+
+    def test_retryable_failure_blocks_the_queue_with_backoff(self):
+        ids = self.enqueue(2)
+        sent = []
+
+        def send(row):
+            sent.append(row["id"])
+            return 503, 120
+
+        self.assertEqual(self.outbox.drain(send), 503)
+        self.assertEqual(sent, ids[:1])
+        self.assertEqual(self.outbox.pending_count(), 2)
+        self.assertEqual(self.outbox.due(), [])
+        self.assertTrue(self.outbox.due(now=time.time() + 121))
+
+    def test_exceptions_count_as_retryable(self):
+        self.enqueue(1)
+
+        def send(row):
+            raise TimeoutError("read timed out")
+
+        self.assertIsNone(self.outbox.drain(send))
+        self.assertEqual(self.outbox.pending_count(), 1)
+
+    def test_custom_retryable_rule(self):
+        ids = self.enqueue(2)
+        self.outbox.drain(lambda row: 401, retryable=lambda row, status: row["id"] != ids[0])
+        # The first batch is parked, the second is kept for another attempt
+        self.assertEqual(self.outbox.pending_count(), 1)
+        self.assertEqual([row["id"] for row in self.outbox.due(now=time.time() + 3600)], ids[1:])
+
+    def test_batch_is_parked_after_max_attempts(self):
+        batch_id, = self.enqueue(1)
+        for _ in range(MAX_ATTEMPTS - 1):
+            self.outbox.mark_failed(batch_id, 503)
+        self.assertEqual(self.outbox.pending_count(), 1)
+        self.outbox.mark_failed(batch_id, 503)
+        self.assertEqual(self.outbox.pending_count(), 0)
+
+
+def _events(count, start_id=1):
+    return [{"id": start_id + i, "timestamp": f"2026-01-01T00:{i % 60:02d}:00Z", "duration": 60.0,
+             "data": {"app": "code.exe", "title": f"file {i}"}} for i in range(count)]
+
+
+def _rollups(count):
+    rows = [[f"2026-01-01T{i // 60 % 24:02d}:{i % 60:02d}:00Z", f"app-{i % 7}.exe", "not-afk", 60.0]
+            for i in range(count)]
+    return {"granularity": "minute", "start": "2026-01-01T00:00:00Z", "end": "2026-01-02T00:00:00Z",
+            "columns": ["start", "app", "afk", "seconds"], "rows": rows}
+
+
+class SyncCursorTests(TempDirTestCase):
+
+    def test_legacy_bare_id_is_read_and_upgraded_on_save(self):
+        with open(cursor_file("window"), "w") as f:
+            f.write("41\n")
+        self.assertEqual(load_cursor("window"), {"id": 41, "timestamp": None})
+        advance_cursor("window", [{"id": 42, "timestamp": "2026-01-01T00:00:00Z"},
+                                  {"id": 43, "timestamp": "2026-01-01T00:01:00Z"}])
+        with open(cursor_file("window")) as f:
+            self.assertEqual(json.load(f), {"id": 43, "timestamp": "2026-01-01T00:01:00Z"})
+        self.assertEqual(load_cursor("window"), {"id": 43, "timestamp": "2026-01-01T00:01:00Z"})
+
+    def test_missing_or_corrupt_file_starts_from_scratch(self):
+        self.assertEqual(load_cursor("web"), {"id": -1, "timestamp": None})
+        with open(cursor_file("web"), "w") as f:
+            f.write("not json")
+        self.assertEqual(load_cursor("web"), {"id": -1, "timestamp": None})
+
+    def test_types_keep_their_own_files(self):
+        self.assertEqual(cursor_file("window"), "last_event_id_window.txt")
+        self.assertEqual(cursor_file("web"), "last_event_id_web.txt")
+        advance_cursor("web", [{"id": 7, "timestamp": "2026-01-01T00:00:00Z"}])
+        self.assertEqual(load_cursor("window")["id"], -1)
+        self.assertEqual(load_cursor("web")["id"], 7)
+
+    def test_fetch_range_starts_at_the_watermark_or_the_lookback(self):
+        now = datetime(2026, 1, 2, tzinfo=timezone.utc)
+        self.assertEqual(fetch_range({"id": 1, "timestamp": "2026-01-01T23:00:00.123456789Z"}, now),
+                         ("2026-01-01T23:00:00.123456Z", "2026-01-02T00:00:00Z"))
+        start, _ = fetch_range({"id": 1, "timestamp": None}, now)
+        self.assertEqual(start, (now - DEFAULT_LOOKBACK).replace(tzinfo=None).isoformat() + "Z")
+
+
+class BatchingTests(unittest.TestCase):
+
+    def payload(self, window, afk=0):
+        return {"email": "a@example.com", "system": "lab-01",
+                "window_events": _events(window), "afk_events": _events(afk, 10000)}
+
+    def test_split_respects_the_event_bound(self):
+        payload = self.payload(25, 10)
+        chunks = split_payload(payload, max_events=10)
+        self.assertEqual([len(c["window_events"]) + len(c["afk_events"]) for c in chunks], [10, 10, 10, 5])
+        # Every event once, in order, and every chunk carries the shared fields and all lists
+        self.assertEqual([e for c in chunks for e in c["window_events"]], payload["window_events"])
+        self.assertEqual([e for c in chunks for e in c["afk_events"]], payload["afk_events"])
+        for chunk in chunks:
+            self.assertEqual(set(chunk), {"email", "system", "window_events", "afk_events"})
+
+    def test_split_respects_the_byte_bound(self):
+        payload = self.payload(200, 50)
+        max_bytes = 8 * 1024
+        chunks = split_payload(payload, max_bytes=max_bytes)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(json.dumps(chunk)), max_bytes)
+        self.assertEqual(sum(len(c["window_events"]) for c in chunks), 200)
+
+    def test_an_oversized_event_still_goes_out_alone(self):
+        payload = self.payload(3)
+        payload["window_events"][1]["data"]["title"] = "x" * 5000
+        chunks = split_payload(payload, max_bytes=1024)
+        self.assertEqual([[e["id"] for e in c["window_events"]] for c in chunks], [[1], [2], [3]])
+
+    def test_empty_payload_has_no_chunks(self):
+        self.assertEqual(split_payload(self.payload(0)), [])
+
+    def test_encoded_payload_round_trips(self):
+        payload = self.payload(50)
+        body, headers = encode_payload(payload)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), payload)
+        body, headers = encode_payload(payload, compress=False)
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(json.loads(body), payload)
+
+    def test_small_rollups_ride_on_the_last_chunk(self):
+        chunks = split_payload(self.payload(10))
+        rollups = _rollups(5)
+        chunks = add_rollups(chunks, rollups)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0]["rollups"], rollups)
+
+    def test_large_rollups_stay_within_the_byte_bound(self):
+        max_bytes = 4096
+        chunks = split_payload(self.payload(30), max_bytes=max_bytes)
+        event_chunks = len(chunks)
+        rollups = _rollups(400)
+        chunks = add_rollups(chunks, rollups, max_bytes=max_bytes)
+        self.assertGreater(len(chunks), event_chunks + 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(json.dumps(chunk)), max_bytes)
+        sections = [chunk["rollups"] for chunk in chunks if "rollups" in chunk]
+        # Sent once, as consecutive sections covering the original range
+        self.assertEqual([row for section in sections for row in section["rows"]], rollups["rows"])
+        self.assertEqual(sections[0]["start"], rollups["start"])
+        self.assertEqual(sections[-1]["end"], rollups["end"])
+        for current, following in zip(sections, sections[1:]):
+            self.assertEqual(current["end"], following["start"])
+        for chunk in chunks[event_chunks:]:
+            self.assertEqual((chunk["window_events"], chunk["afk_events"]), ([], []))
+            self.assertEqual(chunk["email"], "a@example.com")
+
+
+def _window(event_id, second, duration, app="code.exe"):
+    return {"id": event_id, "timestamp": f"2026-01-01T00:{second // 60:02d}:{second % 60:02d}Z",
+            "duration": duration, "data": {"app": app}}
+
+
+class CoalesceTests(TempDirTestCase):
+
+    def test_contiguous_identical_events_merge(self):
+        events = [_window(1, 0, 10), _window(2, 10, 10), _window(3, 21, 5)]  # a 1s gap is still contiguous
+        merged = coalesce_events(events)
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0]["timestamp"], events[0]["timestamp"])
+        self.assertEqual(merged[0]["duration"], 25)
+        # Keeps the newest id, so the max-id watermark is unchanged
+        self.assertEqual((merged[0]["id"], merged[0]["id_range"]), (3, [1, 3]))
+
+    def test_gaps_and_different_data_break_a_run(self):
+        events = [_window(1, 0, 10), _window(2, 15, 10), _window(3, 25, 10, "chrome.exe")]
+        self.assertEqual([e["id"] for e in coalesce_events(events)], [1, 2, 3])
+
+    def test_pinned_events_keep_their_own_id(self):
+        events = [_window(1, 0, 10), _window(2, 10, 10), _window(3, 20, 10), _window(4, 30, 10)]
+        merged = coalesce_events(events, pinned_ids=(1, 4))
+        self.assertEqual([(e["id"], e.get("id_range")) for e in merged], [(1, None), (3, [2, 3]), (4, None)])
+
+    def test_input_events_are_not_modified(self):
+        events = [_window(1, 0, 10), _window(2, 10, 10)]
+        coalesce_events(events)
+        self.assertEqual(events, [_window(1, 0, 10), _window(2, 10, 10)])
+
+    def test_events_without_a_timestamp_pass_through(self):
+        events = [_window(1, 0, 10), {"id": 2, "duration": 5, "data": {"app": "code.exe"}}, _window(3, 15, 10)]
+        self.assertEqual([e["id"] for e in coalesce_events(events)], [1, 2, 3])
+
+    def test_collect_counts_events_before_and_after(self):
+        metrics.REGISTRY.clear()
+        events = [_window(1, 0, 10), _window(2, 10, 10), _window(3, 20, 10)]
+        with mock.patch.object(JackWatch, "fetch_events", return_value=events):
+            JackWatch.collect_pending_events(BUCKET_TYPES["window"], "aw-watcher-window_lab-01")
+        counts = {value["labels"]["stage"]: value["value"] for value in metrics.REGISTRY.snapshot()["values"]
+                  if value["name"] == "jackwatch_coalesce_events_total"}
+        self.assertEqual(counts, {"before": 3, "after": 2})
+
+
+def _afk(event_id, second, duration, status="not-afk"):
+    return {"id": event_id, "timestamp": f"2026-01-01T00:{second // 60:02d}:{second % 60:02d}Z",
+            "duration": duration, "data": {"status": status}}
+
+
+class RollupTests(TempDirTestCase):
+
+    def test_sweep_intersects_window_with_afk(self):
+        window = [[0, 100, "code.exe", 1], [100, 200, "chrome.exe", 2]]
+        afk = [[10, 50, "not-afk", 1], [60, 150, "afk", 2]]
+        self.assertEqual(list(rollup.sweep(window, afk, 0, 200)), [
+            (0, 10, "code.exe", "unknown"),
+            (10, 50, "code.exe", "not-afk"),
+            (50, 60, "code.exe", "unknown"),
+            (60, 100, "code.exe", "afk"),
+            (100, 150, "chrome.exe", "afk"),
+            (150, 200, "chrome.exe", "unknown"),
+        ])
+
+    def test_sweep_clips_to_the_range(self):
+        window = [[0, 100, "code.exe", 1]]
+        afk = [[0, 100, "not-afk", 1]]
+        self.assertEqual(list(rollup.sweep(window, afk, 30, 70)), [(30, 70, "code.exe", "not-afk")])
+
+    def test_aggregate_splits_segments_at_bucket_boundaries(self):
+        totals = rollup.aggregate([(30, 150, "code.exe", "not-afk"), (150, 160, "code.exe", "afk")], 60)
+        self.assertEqual(totals, {(0, "code.exe", "not-afk"): 30, (60, "code.exe", "not-afk"): 60,
+                                  (120, "code.exe", "not-afk"): 30, (120, "code.exe", "afk"): 10})
+
+    def test_re_sent_heartbeats_only_add_their_new_tail(self):
+        rollups, state = rollup.fold_batch(rollup.load_state(), [_window(1, 0, 120)], [_afk(1, 0, 120)])
+        self.assertEqual(sum(row[3] for row in rollups["rows"]), 120)
+        # Both heartbeat events grew by a minute: only that minute is counted
+        rollups, state = rollup.fold_batch(state, [_window(1, 0, 180)], [_afk(1, 0, 180)])
+        self.assertEqual(rollups["rows"], [["2026-01-01T00:02:00Z", "code.exe", "not-afk", 60.0]])
+        self.assertEqual(rollups["start"], "2026-01-01T00:02:00Z")
+
+    def test_window_time_past_the_afk_horizon_waits_for_the_next_batch(self):
+        rollups, state = rollup.fold_batch(rollup.load_state(), [_window(1, 0, 300)], [_afk(1, 0, 60)])
+        self.assertEqual(rollups["end"], "2026-01-01T00:01:00Z")
+        self.assertEqual(len(state["window"]), 1)
+        rollups, state = rollup.fold_batch(state, [], [_afk(1, 0, 300)])
+        self.assertEqual(sum(row[3] for row in rollups["rows"]), 240)
+
+    def test_missing_afk_coverage_is_reported_after_the_pending_span(self):
+        span = rollup.MAX_PENDING_SPAN
+        window = [{"id": 1, "timestamp": "2026-01-01T00:00:00Z", "duration": span + 600, "data": {"app": "code.exe"}}]
+        # The afk watcher reported one minute and then stopped
+        rollups, _ = rollup.fold_batch(rollup.load_state(), window, [_afk(1, 0, 60)])
+        self.assertEqual(rollups["end"], "2026-01-01T00:10:00Z")
+        seconds = {}
+        for row in rollups["rows"]:
+            seconds[row[2]] = seconds.get(row[2], 0) + row[3]
+        self.assertEqual(seconds, {"not-afk": 60, "unknown": 540})
+
+    def test_hour_granularity(self):
+        rollups, _ = rollup.fold_batch(rollup.load_state(), [_window(1, 0, 600)], [_afk(1, 0, 600)], "hour")
+        self.assertEqual(rollups["granularity"], "hour")
+        self.assertEqual(rollups["rows"], [["2026-01-01T00:00:00Z", "code.exe", "not-afk", 600.0]])
+
+    def test_state_round_trips_through_the_file(self):
+        _, state = rollup.fold_batch(rollup.load_state(), [_window(1, 0, 300)], [_afk(1, 0, 60)])
+        rollup.save_state(state)
+        self.assertEqual(rollup.load_state(), json.loads(json.dumps(state)))
+
+
+class AfkHeartbeatResendTests(TempDirTestCase):
+    """The afk watcher extends its newest event like the window watcher does, so it is re-sent too."""
+
+    def afk_event(self, event_id, minute, duration, status="not-afk"):
+        return {"id": event_id, "timestamp": f"2026-01-01T00:{minute:02d}:00Z", "duration": duration,
+                "data": {"status": status}}
+
+    def collect(self, events, include_last_sent_event):
+        with mock.patch.object(JackWatch, "fetch_events", return_value=events), \
+                mock.patch("builtins.print"):
+            return JackWatch.collect_pending_events(BUCKET_TYPES["afk"], "aw-watcher-afk_lab-01",
+                                                    include_last_sent_event)
+
+    def test_watermark_event_is_re_sent_with_its_new_duration(self):
+        save_cursor("afk", self.afk_event(2, 1, 60.0))
+        events = [self.afk_event(1, 0, 60.0, "afk"), self.afk_event(2, 1, 540.0)]
+        resent = self.collect(events, True)
+        self.assertEqual([(event["id"], event["duration"]) for event in resent], [(2, 540.0)])
+        self.assertEqual(self.collect(events, False), [])
+
+    def test_rollups_follow_a_growing_afk_event(self):
+        window = [{"id": 1, "timestamp": "2026-01-01T00:00:00Z", "duration": 600.0, "data": {"app": "code.exe"}}]
+        rollups, first = rollup.fold_batch(rollup.load_state(), window, [self.afk_event(1, 0, 60.0)])
+        self.assertEqual(rollups["end"], "2026-01-01T00:01:00Z")
+        # Next cycle: the same afk event, re-sent with its grown duration, moves the horizon on
+        rollups, _ = rollup.fold_batch(first, window, [self.afk_event(1, 0, 600.0)])
+        self.assertEqual((rollups["start"], rollups["end"]), ("2026-01-01T00:01:00Z", "2026-01-01T00:10:00Z"))
+        self.assertEqual({row[2] for row in rollups["rows"]}, {"not-afk"})
+        # Without the re-send the afk coverage, and so the rollups, stall at the first minute
+        rollups, stalled = rollup.fold_batch(first, window, [])
+        self.assertIsNone(rollups)
+        self.assertEqual(stalled["hwm"], first["hwm"])
+
+
+def _config(signature=1, **values):
+    return config.ConfigSnapshot("app.config", signature, values)
+
+
+class BucketTypeTests(TempDirTestCase):
+
+    def use_config(self, **values):
+        patcher = mock.patch.object(buckets.config, "get_config", return_value=_config(**values))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keep_rules(self):
+        web, afk, input_type = BUCKET_TYPES["web"], BUCKET_TYPES["afk"], BUCKET_TYPES["input"]
+        self.assertTrue(web.keep({"data": {"url": "https://example.com", "title": "x"}}))
+        self.assertFalse(web.keep({"data": {"url": "", "title": "New Tab"}}))
+        self.assertFalse(web.keep({}))
+        self.assertTrue(input_type.keep({"data": {"presses": 0, "clicks": 2}}))
+        self.assertFalse(input_type.keep({"data": {"presses": 0, "clicks": 0, "deltaX": 0, "deltaY": 0}}))
+        self.assertIsNone(afk.keep)
+
+    def test_rejected_events_are_dropped_but_the_newest_is_kept(self):
+        events = [{"id": i, "timestamp": f"2026-01-01T00:0{i}:00Z", "duration": 60.0,
+                   "data": {"url": "https://example.com/" if i % 2 else "", "title": str(i)}} for i in range(1, 5)]
+        with mock.patch.object(JackWatch, "fetch_events", return_value=events):
+            kept = JackWatch.collect_pending_events(BUCKET_TYPES["web"], "aw-watcher-web-chrome_lab-01")
+        # Event 4 has no url but carries the watermark
+        self.assertEqual([event["id"] for event in kept], [1, 3, 4])
+
+    def test_prefix_override_keeps_the_rule_and_payload_key(self):
+        self.use_config(BUCKET_PREFIX_WEB="aw-watcher-web-firefox_")
+        web = buckets.get_bucket_type("web")
+        self.assertEqual(web.prefix, "aw-watcher-web-firefox_")
+        self.assertIs(web.keep, BUCKET_TYPES["web"].keep)
+        self.assertEqual(web.payload_key, "web_events")
+        self.assertIs(buckets.get_bucket_type("window"), BUCKET_TYPES["window"])
+
+    def test_new_types_need_a_prefix(self):
+        self.use_config(BUCKET_PREFIX_MEDIA="aw-watcher-media_")
+        media = buckets.get_bucket_type("media")
+        self.assertEqual((media.prefix, media.payload_key, media.keep), ("aw-watcher-media_", "media_events", None))
+        self.assertIsNone(buckets.get_bucket_type("bogus"))
+
+    def test_sync_types_put_required_first_and_skip_unknown(self):
+        self.use_config(SYNC_BUCKETS=" Web ,bogus,afk,web")
+        with mock.patch("builtins.print"):
+            names = [bucket_type.name for bucket_type in buckets.sync_bucket_types()]
+        self.assertEqual(names, ["window", "afk", "web"])
+
+    def test_default_sync_types(self):
+        self.use_config()
+        self.assertEqual([bucket_type.name for bucket_type in buckets.sync_bucket_types()], ["window", "afk"])
+
+    def test_payload_keys_map_back_to_types(self):
+        self.assertEqual([buckets.type_for_payload_key(key) for key in ("window_events", "web_events", "media_events")],
+                         ["window", "web", "media"])
+
+    def test_enqueue_uses_the_types_resolved_for_the_cycle(self):
+        custom = buckets.BucketType("web", "aw-watcher-web-firefox_", payload_key="browser_events")
+        events = {"window": [_window(1, 0, 60)], "web": [{"id": 1, "timestamp": "2026-01-01T00:00:00Z",
+                                                         "duration": 5.0, "data": {"url": "https://example.com"}}]}
+        with mock.patch.object(JackWatch, "_outbox", Outbox(os.path.join(self.workdir, "outbox.db"))):
+            JackWatch.enqueue_sync_batch("a@example.com", "t1", events,
+                                         {"window": BUCKET_TYPES["window"], "web": custom})
+            payload, = JackWatch.get_outbox().undelivered()
+            JackWatch.get_outbox().close()
+        self.assertEqual(len(payload["browser_events"]), 1)
+        self.assertNotIn("web_events", payload)
+
+
+def _listing(*bucket_ids, hostname="lab-01"):
+    return {bucket_id: {"id": bucket_id, "hostname": hostname} for bucket_id in bucket_ids}
+
+
+class BucketRegistryTests(unittest.TestCase):
+
+    TYPES = [BUCKET_TYPES["window"], BUCKET_TYPES["afk"], BUCKET_TYPES["web"]]
+
+    def setUp(self):
+        self.listing = _listing("aw-watcher-window_lab-01", "aw-watcher-afk_lab-01")
+        self.get = mock.patch.object(buckets.http_client, "get", side_effect=self._answer).start()
+        mock.patch.object(buckets, "get_hostname", return_value="lab-01").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _answer(self, *args, **kwargs):
+        response = mock.Mock()
+        response.json.return_value = dict(self.listing)
+        return response
+
+    def test_resolved_ids_are_reused(self):
+        registry = buckets.BucketRegistry()
+        self.listing.update(_listing("aw-watcher-web-chrome_lab-01"))
+        first = registry.resolve(self.TYPES)
+        self.assertEqual(registry.resolve(self.TYPES), first)
+        self.assertEqual(first["web"], "aw-watcher-web-chrome_lab-01")
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_own_host_bucket_is_preferred(self):
+        self.listing = _listing("aw-watcher-window_lab-02", hostname="lab-02")
+        self.listing.update(_listing("aw-watcher-window_lab-01", "aw-watcher-afk_lab-01"))
+        self.assertEqual(buckets.BucketRegistry().resolve(self.TYPES)["window"], "aw-watcher-window_lab-01")
+
+    def test_missing_optional_type_is_rediscovered_after_the_interval(self):
+        registry = buckets.BucketRegistry(rediscover_interval=3600)
+        self.assertIsNone(registry.resolve(self.TYPES)["web"])
+        self.listing.update(_listing("aw-watcher-web-chrome_lab-01"))
+        self.assertIsNone(registry.resolve(self.TYPES)["web"])
+        self.assertEqual(self.get.call_count, 1)
+        registry.rediscover_interval = 0
+        self.assertEqual(registry.resolve(self.TYPES)["web"], "aw-watcher-web-chrome_lab-01")
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_missing_required_type_is_asked_for_every_time(self):
+        registry = buckets.BucketRegistry()
+        self.listing = _listing("aw-watcher-window_lab-01")
+        self.assertIsNone(registry.resolve(self.TYPES)["afk"])
+        self.assertIsNone(registry.resolve(self.TYPES)["afk"])
+        self.assertEqual(self.get.call_count, 2)
+        self.listing.update(_listing("aw-watcher-afk_lab-01"))
+        self.assertEqual(registry.resolve(self.TYPES)["afk"], "aw-watcher-afk_lab-01")
+
+    def test_failed_rediscovery_keeps_the_cached_ids(self):
+        registry = buckets.BucketRegistry(rediscover_interval=0)
+        first = registry.resolve(self.TYPES)
+        self.get.side_effect = ConnectionError("aw-server down")
+        with mock.patch("builtins.print"):
+            self.assertEqual(registry.resolve(self.TYPES), first)
+        self.assertEqual(first["window"], "aw-watcher-window_lab-01")
+
+    def test_invalidate_and_prefix_change_force_rediscovery(self):
+        registry = buckets.BucketRegistry()
+        registry.resolve(self.TYPES)
+        registry.invalidate()
+        registry.resolve(self.TYPES)
+        firefox = buckets.BucketType("web", "aw-watcher-web-firefox_")
+        self.listing.update(_listing("aw-watcher-web-firefox_lab-01"))
+        resolved = registry.resolve(self.TYPES[:2] + [firefox])
+        self.assertEqual(resolved["web"], "aw-watcher-web-firefox_lab-01")
+        self.assertEqual(self.get.call_count, 3)
+
+    def test_unknown_type_is_reported_once_per_config_edit(self):
+        buckets._unknown_reported.clear()
+        self.addCleanup(buckets._unknown_reported.clear)
+        with mock.patch.object(buckets.config, "get_config") as get_config, \
+                mock.patch("builtins.print") as printed:
+            for signature in (1, 1, 2):
+                get_config.return_value = _config(signature, SYNC_BUCKETS="bogus")
+                buckets.sync_bucket_types()
+        self.assertEqual(printed.call_count, 2)
+
+
+class BatchRetryableTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(JackWatch.CACHED_CREDS, {"email": "a@example.com", "token": "t2"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unauthorized_is_retried_only_for_the_signed_in_user(self):
+        self.assertTrue(JackWatch.batch_retryable({"email": "a@example.com"}, 401))
+        self.assertFalse(JackWatch.batch_retryable({"email": "b@example.com"}, 401))
+
+    def test_client_errors_are_permanent(self):
+        for status in (400, 403, 404, 413, 422):
+            self.assertFalse(JackWatch.batch_retryable({"email": "a@example.com"}, status))
+        for status in (None, 408, 429, 500, 503):
+            self.assertTrue(JackWatch.batch_retryable({"email": "a@example.com"}, status))
+
+
+if __name__ == "__main__":
+    unittest.main()
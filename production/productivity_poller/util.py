@@ -1,34 +1,148 @@
 
 import os
+import random
 import socket
-import requests
+import threading
+import time
+from urllib.parse import quote
+import config
 import constants
+import http_client
 from constants import CentralServerApi
 
+# Sync (60s) and the AW monitor (30s) share one answer from the central server.
+# A "not registered" answer is kept only briefly so a fresh login from the
+# separate login window is picked up quickly.
+CREDENTIALS_TTL = 60
+MISSING_CREDENTIALS_TTL = 10
+# How long the central server may hold a credential long-poll open
+WATCH_TIMEOUT = 50
+# Every wait is stretched or shrunk by up to this fraction so devices started
+# together drift apart instead of polling in lockstep
+POLL_JITTER = 0.2
+# Back-off after a 429/5xx that came without a Retry-After (proxies, an overloaded server)
+BUSY_RETRY_DELAY = 30
+# The only answers that may change what we believe the credentials are
+CREDENTIAL_STATUSES = (200, 304, 404)
+
+_credentials_cache = {}
+_watch_versions = {}
+# Last (ETag, credentials) per key, revalidated with If-None-Match
+_credential_etags = {}
+_credentials_lock = threading.Lock()
+# Poll interval advertised by the central server (X-Poll-Interval) and the
+# back-off deadline after a 429/5xx
+_server_poll_interval = None
+_retry_not_before = 0.0
+
 def get_hostname():
     return os.environ.get('COMPUTERNAME') or socket.gethostname()
 
-def get_credentials_from_server(custom_config_path=None):
+def invalidate_credentials():
+    with _credentials_lock:
+        _credentials_cache.clear()
+        _watch_versions.clear()
+        _credential_etags.clear()
+
+def jittered(seconds, jitter=POLL_JITTER):
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+def poll_interval(default=CREDENTIALS_TTL):
+    """Seconds between credential polls: the central server's answer when it gave one."""
+    return _server_poll_interval or default
+
+def retry_delay():
+    """Seconds left before the central server wants to hear from us again."""
+    return max(0.0, _retry_not_before - time.monotonic())
+
+def _note_server_pacing(r):
+    global _server_poll_interval, _retry_not_before
+    try:
+        _server_poll_interval = max(1, int(r.headers["X-Poll-Interval"]))
+    except (KeyError, ValueError):
+        pass
+    if r.status_code != 429 and r.status_code < 500:
+        return False
+    delay = http_client.retry_after(r)
+    if delay is None:
+        delay = BUSY_RETRY_DELAY
+    # Never earlier than asked, and not all at once either
+    _retry_not_before = time.monotonic() + delay * random.uniform(1, 1 + POLL_JITTER)
+    return True
+
+def get_credentials_from_server(custom_config_path=None, max_age=None):
+    key = (custom_config_path or None, get_hostname())
+    now = time.monotonic()
+    with _credentials_lock:
+        cached = _credentials_cache.get(key)
+    if cached is not None:
+        creds, fetched_at = cached
+        ttl = max_age if max_age is not None else (poll_interval() if creds else MISSING_CREDENTIALS_TTL)
+        if now - fetched_at < ttl or retry_delay():
+            return creds
     try:
         CentralServerApi.refresh_config(custom_config_path)
-        r = requests.get(CentralServerApi.TOKEN.format(hostname=get_hostname()), timeout=10)
-        if r.status_code == 200:
-            return r.json()
+        with _credentials_lock:
+            etag, known_creds = _credential_etags.get(key, (None, None))
+        headers = {"If-None-Match": etag} if etag else {}
+        r = http_client.get(CentralServerApi.TOKEN.format(hostname=key[1]), endpoint="central", headers=headers)
+        if _note_server_pacing(r) or r.status_code not in CREDENTIAL_STATUSES:
+            # Busy or broken: keep serving what we had rather than reporting a logout
+            print(f"Central server answered {r.status_code}; retrying in {retry_delay():.0f}s")
+            return cached[0] if cached is not None else known_creds
+        if r.status_code == 304:
+            creds = known_creds
+        else:
+            creds = r.json() if r.status_code == 200 else None
+        with _credentials_lock:
+            _credentials_cache[key] = (creds, now)
+            if creds and r.headers.get("ETag"):
+                _credential_etags[key] = (r.headers["ETag"], creds)
+            else:
+                _credential_etags.pop(key, None)
+        return creds
     except Exception as e:
         print("Token fetch error:", e)
     return None
 
-def update_central_server_ip(central_server_ip, config_path):
-    configurations = {}
-    with open(config_path, 'r') as config:
-        for config_line in config.readlines():
-            config_pair = config_line.strip().split('=')
-            if len(config_pair) == 2:
-                configurations[config_pair[0]] = config_pair[1]
+def watch_credentials(custom_config_path=None, timeout=WATCH_TIMEOUT):
+    """Block until the central server reports a credential change or ``timeout`` passes.
 
+    Returns True when the credentials changed. The answer refreshes the
+    credential cache, so get_credentials_from_server serves it without another
+    request. A 429/5xx returns False, keeps the cached credentials and sets
+    retry_delay(). Raises when the server has no long-poll endpoint.
+    """
+    key = (custom_config_path or None, get_hostname())
+    CentralServerApi.refresh_config(custom_config_path)
+    with _credentials_lock:
+        known_version = _watch_versions.get(key, "")
+    url = CentralServerApi.TOKEN_WATCH.format(hostname=quote(key[1]), version=known_version, timeout=timeout)
+    connect_timeout, read_timeout = http_client.TIMEOUTS["central"]
+    r = http_client.get(url, endpoint="central", timeout=(connect_timeout, timeout + read_timeout))
+    if _note_server_pacing(r):
+        return False
+    body = r.json()
+    if "version" not in body:
+        raise ValueError(f"Unexpected long-poll response: {r.status_code}")
+    creds = {"email": body["email"], "token": body["token"]} if r.status_code == 200 else None
+    with _credentials_lock:
+        _watch_versions[key] = body["version"]
+        _credentials_cache[key] = (creds, time.monotonic())
+        if creds:
+            # The token endpoint's ETag is the quoted watch version
+            _credential_etags[key] = (f'"{body["version"]}"', creds)
+        else:
+            _credential_etags.pop(key, None)
+    return bool(body.get("changed"))
+
+def update_central_server_ip(central_server_ip, config_path):
+    configurations = config.parse_config(config_path)
     configurations["CENTRAL_SERVER_IP"] = central_server_ip
 
-    with open(config_path, 'w') as config:
-        for k, v in configurations.items():
-            config.write(f"{k}={v}")
+    with open(config_path, 'w') as config_file:
+        config_file.write("\n".join(f"{k}={v}" for k, v in configurations.items()))
+    # Publish the new snapshot right away instead of waiting for the mtime check
+    config.invalidate(config_path)
+    invalidate_credentials()
     return configurations